@@ -0,0 +1,290 @@
+"""Microbenchmark renderer laporan.
+
+Jalankan: python bench_render.py [jumlah_iterasi]
+
+Membandingkan render_report (template ter-compile) dengan renderer lama
+(disalin apa adanya di bawah) untuk laporan kosong, setengah terisi dan
+terisi penuh, memastikan output byte-identik, lalu mencetak render/detik.
+"""
+import sys, time
+from datetime import datetime
+from types import SimpleNamespace
+
+from helpers import fmt_id, shift2digits
+from bot import render_report, render_cached, touch_laporan
+from report import Laporan
+
+# ===================== Renderer lama (referensi) =====================
+def legacy_render_report(d: dict) -> str:
+    store = d.get('store', "T67T CIBULARENG")
+    kpi_title = d.get('kpi_title', "KPI")
+    shift = shift2digits(d.get('shift', '1'))
+    tanggal = d.get('tanggal') or datetime.now().strftime("%d/%m/%Y")
+
+    total_sales = d.get('total_sales', "")
+    sales_str = fmt_id(total_sales) if isinstance(total_sales, int) else str(total_sales or "")
+    total_struk = d.get('total_struk', "")
+
+    mrbread     = fmt_id(d.get('mrbread', "")) if d.get('mrbread', "") != "" else ""
+    primebread  = fmt_id(d.get('primebread', "")) if d.get('primebread', "") != "" else ""
+    telur       = fmt_id(d.get('telur', "")) if d.get('telur', "") != "" else ""
+    buah_import = fmt_id(d.get('buah_import', "")) if d.get('buah_import', "") != "" else ""
+    buah_lokal  = fmt_id(d.get('buah_lokal', "")) if d.get('buah_lokal', "") != "" else ""
+    all_produk_v = d.get('all_produk', "")
+    all_produk  = fmt_id(all_produk_v) if all_produk_v not in ("", None) else ""
+
+    v1i = d.get('variance_shift1_induk', "")
+    v1a = d.get('variance_shift1_anak', "")
+    v2i = d.get('variance_shift2_induk', "")
+    v2a = d.get('variance_shift2_anak', "")
+    variance_poin = d.get('variance_poin', "5")
+    variance_plus_gt10k = d.get('variance_plus_total_gt10k', "0")
+
+    cancel_poin  = d.get('cancel_poin', "5")
+    cancel_budget = d.get('cancel_budget', "")
+    cancel_shift1 = d.get('cancel_shift1', "")
+    cancel_shift2 = d.get('cancel_shift2', "")
+    cancel_total  = d.get('cancel_total', "0")
+
+    tertib_poin  = d.get('tertib_poin', "5")
+    tertib_s1    = d.get('tertib_setor_shift1', "")
+    tertib_s2    = d.get('tertib_setor_shift2', "")
+
+    cpu_50_left  = d.get('cpu_50_left', "50 %")
+    cpu_50_right = d.get('cpu_50_right', "50 %")
+    cpu_s1_induk = d.get('trx_cpu_shift1_induk', "")
+    cpu_s1_anak  = d.get('trx_cpu_shift1_anak', "")
+    cpu_s2_induk = d.get('trx_cpu_shift2_induk', "")
+    cpu_s2_anak  = d.get('trx_cpu_shift2_anak', "")
+
+    tunai_poin   = d.get('tunai_poin', "5")
+    tunai_target = d.get('tunai_target', "215")
+    tunai_s1     = d.get('tunai_shift1', "")
+    tunai_s2     = d.get('tunai_shift2', "")
+    tunai_total  = d.get('tunai_total', "")
+    tunai_sisa   = d.get('tunai_sisa', "")
+
+    isaku_poin   = d.get('isaku_poin', "5")
+    isaku_target = d.get('isaku_target', "8")
+    isaku_s1     = d.get('isaku_shift1', "")
+    isaku_s2     = d.get('isaku_shift2', "")
+    isaku_total  = d.get('isaku_total', "")
+    isaku_sisa   = d.get('isaku_sisa', "")
+
+    poinku_poin   = d.get('poinku_poin', "10")
+    poinku_target = d.get('poinku_target', "10")
+    poinku_s1     = d.get('poinku_shift1', "")
+    poinku_s2     = d.get('poinku_shift2', "")
+    poinku_total  = d.get('poinku_total', "")
+    poinku_sisa   = d.get('poinku_sisa', "")
+
+    klik_poin   = d.get('klik_poin', "10")
+    klik_target = d.get('klik_target', "13")
+    klik_s1     = d.get('klik_shift1', "")
+    klik_s2     = d.get('klik_shift2', "")
+    klik_total  = d.get('klik_total', "")
+    klik_sisa   = d.get('klik_sisa', "")
+
+    store_act_s1 = d.get('store_activity_shift1', "")
+    store_act_s2 = d.get('store_activity_shift2', "")
+    kbk_poin = d.get('kbk_poin', "5")
+    kbk_s1   = d.get('kbk_shift1', "")
+    kbk_s2   = d.get('kbk_shift2', "")
+    kbk_total = d.get('kbk_total', "5")
+    kbk_sisa  = d.get('kbk_sisa', "")
+    pjr_poin   = d.get('pjr_poin', "10")
+    pjr_target = d.get('pjr_target', "")
+    pjr_s1     = d.get('pjr_shift1', "")
+    pjr_s2     = d.get('pjr_shift2', "")
+    itt_poin   = d.get('itt_poin', "5")
+    itt_budget = d.get('itt_budget', "")
+    itt_s1     = d.get('itt_shift1', "")
+    itt_s2     = d.get('itt_shift2', "")
+    itt_total  = d.get('itt_total', "")
+
+    varmin_total = d.get('total_varmin', "0")
+    varmin_dian  = d.get('varmin_dian', "0")
+    varmin_dinda = d.get('varmin_dinda', "0")
+    varmin_agung = d.get('varmin_agung', "0")
+    varmin_rifa  = d.get('varmin_rifa', "0")
+    varmin_putri = d.get('varmin_putri', "0")
+    varplus_total = d.get('total_varplus', "")
+    varplus_dian  = d.get('variance_plus_dian', "")
+    varplus_dinda = d.get('variance_plus_dinda', "")
+    varplus_agung = d.get('variance_plus_agung', "")
+    varplus_rifa  = d.get('variance_plus_rifa', "")
+    varplus_putri = d.get('variance_plus_putri', "")
+
+    lines = []
+    lines.append(f"*{store}*")
+    lines.append(f"Monitoring *{kpi_title}* ")
+    lines.append(f" SHIFT {shift}")
+    lines.append(f"Tanggal: {tanggal}\n")
+    lines.append(f"Sales: {sales_str}")
+    lines.append(f"Struk : {total_struk}\n")
+    lines.append(f"*Sales produk khusus*")
+    lines.append(f"Mr.bread: {mrbread}")
+    lines.append(f"Prime bread: {primebread}")
+    lines.append(f"Telur : {telur}")
+    lines.append(f"Buah Import : {buah_import}")
+    lines.append(f"Buah lokal : {buah_lokal}")
+    lines.append(f"All Produk : {all_produk}\n")
+    lines.append(f"*VARIANCE*")
+    lines.append(f"POIN {variance_poin}")
+    lines.append("Budget")
+    lines.append("Shift 1")
+    lines.append(f"Induk : {v1i}")
+    lines.append(f"Anak : {v1a}\n")
+    lines.append("Shift 2")
+    lines.append(f"Induk  : {v2i}")
+    lines.append(f"Anak : {v2a}\n")
+    lines.append(f"Total Variance Plus di atas Rp.10.000 : {variance_plus_gt10k}\n")
+    lines.append(f"*CANCEL SALES*")
+    lines.append(f"POIN {cancel_poin}")
+    lines.append(f"Budget : {cancel_budget}")
+    lines.append(f"Shift 1 : {cancel_shift1}")
+    lines.append(f"Shift 2 : {cancel_shift2}")
+    lines.append(f"Total cancel : {cancel_total}\n")
+    lines.append(f"*TERTIB SETOR*")
+    lines.append(f"POIN {tertib_poin}")
+    lines.append(f"Shift 1 : {tertib_s1}")
+    lines.append(f"Shift 2 : {tertib_s2}\n")
+    lines.append(f"*JMLH TRX CPU*")
+    lines.append(f"{cpu_50_left} : {cpu_50_right}")
+    lines.append("Shift 1")
+    lines.append(f"Induk : {cpu_s1_induk}")
+    lines.append(f"Anak : {cpu_s1_anak}\n")
+    lines.append("Shift 2")
+    lines.append(f"Induk : {cpu_s2_induk}")
+    lines.append(f"Anak : {cpu_s2_anak}\n")
+    lines.append(f"*JMLH TRX TUNAI*")
+    lines.append(f"POIN {tunai_poin}")
+    lines.append(f"Target : {tunai_target}")
+    lines.append(f"Shift 1 : {tunai_s1}")
+    lines.append(f"Shift 2 : {tunai_s2}")
+    lines.append(f"Total trx tunai : {tunai_total}")
+    lines.append(f"Sisa : {tunai_sisa}\n")
+    lines.append(f"*NEW MEMBER ISAKU*")
+    lines.append(f"POIN {isaku_poin}")
+    lines.append(f"Target : {isaku_target}")
+    lines.append(f"Shift 1 : {isaku_s1}")
+    lines.append(f"Shift 2 : {isaku_s2}")
+    lines.append(f"Total  : {isaku_total}")
+    lines.append(f"Sisa : {isaku_sisa}\n")
+    lines.append(f"*NEW MEMBER POINKU*")
+    lines.append(f"POIN {poinku_poin}")
+    lines.append(f"Target : {poinku_target}")
+    lines.append(f"Shift 1 : {poinku_s1}")
+    lines.append(f"Shift 2 : {poinku_s2}")
+    lines.append(f"Total : {poinku_total}")
+    lines.append(f"Sisa : {poinku_sisa}\n")
+    lines.append(f"*NEW MEMBER KLIK*")
+    lines.append(f"POIN {klik_poin}")
+    lines.append(f"Target : {klik_target}")
+    lines.append(f"Shift 1 : {klik_s1}")
+    lines.append(f"Shift 2 : {klik_s2}")
+    lines.append(f"Total : {klik_total}")
+    lines.append(f"Sisa : {klik_sisa}\n")
+    lines.append(f"*STORE ACTIVITY*")
+    lines.append("Poin 5")
+    lines.append(f"Shift 1 : {store_act_s1} ")
+    lines.append(f"Shift 2 : {store_act_s2}\n")
+    lines.append(f"*TOKO PRIMA/KBK*")
+    lines.append(f"POIN {kbk_poin}")
+    lines.append(f"Shift 1 : {kbk_s1}")
+    lines.append(f"Shift 2 : {kbk_s2}")
+    lines.append(f"Total : {kbk_total}")
+    lines.append(f"Sisa : {kbk_sisa}\n")
+    lines.append(f"*PELAKSANAAN  PJR(scan itt)*")
+    lines.append(f"Target : {pjr_target}")
+    lines.append(f"POIN {pjr_poin}")
+    lines.append("Target")
+    lines.append(f"Shift 1 : {pjr_s1}")
+    lines.append(f"Shift 2 : {pjr_s2}\n")
+    lines.append(f"*QTY ITT*")
+    lines.append(f"POIN {itt_poin}")
+    lines.append(f"Budget : {itt_budget}")
+    lines.append(f"Shift 1 : {itt_s1}")
+    lines.append(f"Shift 2 : {itt_s2}")
+    lines.append(f"Total itt : {itt_total}\n")
+    lines.append(f"*TARGET POIN 100*\n")
+    lines.append(f"*Akumulasi varian mines*")
+    lines.append(f"Total varmin : {varmin_total}")
+    lines.append(f"Dian : {varmin_dian}")
+    lines.append(f"Dinda : {varmin_dinda}")
+    lines.append(f"Agung : {varmin_agung}")
+    lines.append(f"Rifa : {varmin_rifa}")
+    lines.append(f"Putri : {varmin_putri}\n")
+    lines.append(f"*Akumulasi variance plus*")
+    lines.append(f"Total variance plus : {varplus_total}")
+    lines.append(f"Dian : {varplus_dian}")
+    lines.append(f"Dinda : {varplus_dinda}")
+    lines.append(f"Agung : {varplus_agung}")
+    lines.append(f"Rifa : {varplus_rifa}")
+    lines.append(f"Putri : {varplus_putri}")
+    return "\n".join(lines)
+
+
+# ===================== Fixture =====================
+def report_empty() -> dict:
+    return {"shift": "1"}
+
+def report_half() -> dict:
+    return {
+        "shift": "2", "tanggal": "22/08/2025",
+        "sales_induk": 12500000, "sales_anak": 3400000, "total_sales": 15900000,
+        "struk_induk": 410, "struk_anak": 95, "total_struk": 505,
+        "trx_cpu_shift1_induk": 380, "trx_cpu_shift1_anak": 88,
+        "trx_cpu_shift2_induk": 410, "trx_cpu_shift2_anak": 95,
+        "variance_shift1_induk": "+4.139 Dini", "variance_shift1_anak": "+334 Rifa",
+        "tertib_setor_shift1": "✅", "tertib_setor_shift2": "✅",
+        "store_activity_shift1": "✅", "store_activity_shift2": "✅",
+    }
+
+def report_full() -> dict:
+    d = report_half()
+    d.update({
+        "mrbread": 125000, "primebread": 98000, "telur": 450000,
+        "buah_import": 1200000, "buah_lokal": 340000, "all_produk": 2213000,
+        "variance_shift2_induk": "-1.200 Agung", "variance_shift2_anak": "+50 Putri",
+        "variance_plus_total_gt10k": "1",
+        "cancel_budget": "3", "cancel_shift1": "1", "cancel_shift2": "0", "cancel_total": "1",
+        "tunai_shift1": "101", "tunai_shift2": "97", "tunai_total": "198", "tunai_sisa": "17",
+        "isaku_shift1": "3", "isaku_shift2": "4", "isaku_total": "7", "isaku_sisa": "1",
+        "poinku_shift1": "5", "poinku_shift2": "6", "poinku_total": "11", "poinku_sisa": "0",
+        "klik_shift1": "6", "klik_shift2": "5", "klik_total": "11", "klik_sisa": "2",
+        "kbk_shift1": "✅", "kbk_shift2": "✅", "kbk_sisa": "0",
+        "pjr_target": "100%", "pjr_shift1": "✅", "pjr_shift2": "✅",
+        "itt_budget": "20", "itt_shift1": "4", "itt_shift2": "3", "itt_total": "7",
+        "total_varmin": "-1.200", "varmin_agung": "-1.200",
+        "total_varplus": "4.523", "variance_plus_dian": "4.139", "variance_plus_rifa": "334",
+        "variance_plus_putri": "50",
+    })
+    return d
+
+FIXTURES = (("kosong", report_empty), ("setengah", report_half), ("penuh", report_full))
+
+
+# ===================== Bench =====================
+def rate(fn, d, n) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n): fn(d)
+    return n / (time.perf_counter() - t0)
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for name, make in FIXTURES:
+        d = Laporan(make())   # model sesi yang dipakai bot; legacy membaca lewat get() yang sama
+        assert render_report(d) == legacy_render_report(d), f"output beda untuk laporan {name}"
+        assert render_report(make()) == legacy_render_report(d), f"output dict beda untuk laporan {name}"
+
+        ctx = SimpleNamespace(user_data={"laporan": d})
+        touch_laporan(ctx)
+        cached = rate(lambda _: render_cached(ctx), d, n)
+        old = rate(legacy_render_report, d, n)
+        new = rate(render_report, d, n)
+        print(f"{name:<9} lama {old:>10,.0f}/s  baru {new:>10,.0f}/s  ({new / old:.2f}x)  cache {cached:>12,.0f}/s")
+
+
+if __name__ == "__main__":
+    main()
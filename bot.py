@@ -1,282 +1,476 @@
-import os, re
-from datetime import datetime
+import asyncio, logging, os, weakref, zlib
+from datetime import date, datetime
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Iterable, List, NamedTuple, Optional
+from zoneinfo import ZoneInfo
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
-from telegram.constants import ParseMode
+from telegram.constants import ChatAction, MessageLimit, ParseMode
+from telegram.error import BadRequest
+from telegram.helpers import escape_markdown
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, ContextTypes,
-    CallbackQueryHandler, MessageHandler, filters
+    CallbackQueryHandler, MessageHandler, TypeHandler, filters
+)
+from helpers import fmt_id, parse_amount, parse_variance, shift2digits, valid_tanggal
+from bulk import parse_bulk
+from export import FORMATS, ExportCache
+from fanout import FanOut
+from kpi import KPIS, SHIFT1_INPUT_KEYS, score_report
+from history import METRIC_NAMES, ReportStore, periods, rank_periods, week_range
+from metrics import (
+    ACTIVE_SESSIONS, FANOUT_PENDING, RENDER_SECONDS, REPORTS_ABANDONED, REPORTS_DONE, SESSIONS_IN_MEMORY,
+    UPDATES_PENDING, UPDATES_RUNNING, InstrumentedRequest, count_update, log_periodically, timed
 )
+from persistence import SQLitePersistence
+from processor import PerUserUpdateProcessor
+from report import FIELDS as LAPORAN_FIELDS, UNSET, Laporan, report_open
+from sender import PRIORITY_BULK, SendScheduler
+from sessions import IdleSessions, SharedSessions, backend_from_url
+from stores import StoreConfig, StoreRegistry
+from webhook import UpdateLedger
 
-# ===================== Helpers =====================
-def parse_amount(text: str) -> int:
-    if text is None: return 0
-    cleaned = re.sub(r"[^\d-]", "", str(text))
-    if cleaned in ("", "-"): return 0
-    try: return int(cleaned)
-    except Exception: return 0
-
-def fmt_id(num) -> str:
-    try: return f"{int(num):,}".replace(",", ".")
-    except Exception: return str(num or "")
-
-def valid_tanggal(s: str) -> bool:
-    try:
-        datetime.strptime(s, "%d/%m/%Y")
-        return True
-    except Exception:
-        return False
+_LOGGER = logging.getLogger(__name__)
+
+# Riwayat laporan final (koneksi SQLite dibuka saat pertama dipakai)
+HISTORY = ReportStore(os.environ.get("HISTORY_DB", "reports.db"))
+
+# Config per store (target, poin, staff, mapping chat/user → store), dibaca sekali lalu hot-reload
+STORES = StoreRegistry(os.environ.get("STORES_FILE", "stores.json"))
+
+# Jam reminder di config store dibaca di zona waktu ini
+TZ = ZoneInfo(os.environ.get("TIMEZONE", "Asia/Jakarta"))
+
+# Pesan massal (laporan final ke grup, reminder) dikirim bertahap lewat JobQueue
+FANOUT = FanOut(rate=float(os.environ.get("FANOUT_RATE", "8")))
+
+# Sesi bersama antar replica webhook (sessions.SharedSessions) per Application; tidak ada =
+# sesi lokal proses ini. Per app, bukan global: loadtest.py menjalankan beberapa replica
+# dalam satu proses, masing-masing dengan koneksi backend sendiri
+_SESSIONS: "weakref.WeakKeyDictionary[Any, SharedSessions]" = weakref.WeakKeyDictionary()
 
-def get_laporan(context: ContextTypes.DEFAULT_TYPE) -> dict:
-    if 'laporan' not in context.user_data:
-        context.user_data['laporan'] = {}
-    return context.user_data['laporan']
+def shared_sessions(app) -> Optional[SharedSessions]:
+    return _SESSIONS.get(app)
 
-def shift2digits(s: str) -> str:
-    try: return f"{int(s):02d}"
-    except Exception: return str(s or "01")
+# Sesi idle dilepas dari memori (spill ke persistence / backend bersama) setelah TTL,
+# dan sesi paling lama idle saat jumlahnya melebihi batas
+IDLE = IdleSessions(ttl=float(os.environ.get("SESSION_IDLE_TTL", "1800")),
+                    max_sessions=int(os.environ.get("SESSION_MAX", "5000")))
+
+# ===================== Helpers =====================
+def get_laporan(context: ContextTypes.DEFAULT_TYPE) -> Laporan:
+    d = context.user_data.get('laporan')
+    if d.__class__ is not Laporan:
+        # Sesi baru, atau sesi lama (dict) dari persistence sebelum ada model Laporan
+        d = context.user_data['laporan'] = Laporan(d or ())
+    return d
 
 def reply_kb():
     # Tombol permanen di dekat tombol emoji
-    return ReplyKeyboardMarkup([["/start", "/help", "/preview", "/batal"]], resize_keyboard=True)
+    return ReplyKeyboardMarkup([["/start", "/help", "/preview", "/kembali", "/batal"]], resize_keyboard=True)
 
-def ensure_defaults_for_shift(d: dict, shift: str):
+def ensure_defaults_for_shift(d: Laporan, shift: str):
     s = "1" if str(shift) == "1" else "2"
     for key in [f"tertib_setor_shift{s}", f"store_activity_shift{s}", f"kbk_shift{s}", f"pjr_shift{s}", f"itt_shift{s}"]:
         if not d.get(key): d[key] = "✅"
 
-def ensure_defaults_for_both_shifts(d: dict):
+def ensure_defaults_for_both_shifts(d: Laporan):
     for s in ("1", "2"):
         for key in [f"tertib_setor_shift{s}", f"store_activity_shift{s}", f"kbk_shift{s}", f"pjr_shift{s}", f"itt_shift{s}"]:
             if not d.get(key): d[key] = "✅"
 
 # ===================== Renderer (template panjang) =====================
-def render_report(d: dict) -> str:
-    store = d.get('store', "T67T CIBULARENG")
-    kpi_title = d.get('kpi_title', "KPI")
-    shift = shift2digits(d.get('shift', '1'))
-    tanggal = d.get('tanggal') or datetime.now().strftime("%d/%m/%Y")
-
-    total_sales = d.get('total_sales', "")
-    sales_str = fmt_id(total_sales) if isinstance(total_sales, int) else str(total_sales or "")
-    total_struk = d.get('total_struk', "")
-
-    mrbread     = fmt_id(d.get('mrbread', "")) if d.get('mrbread', "") != "" else ""
-    primebread  = fmt_id(d.get('primebread', "")) if d.get('primebread', "") != "" else ""
-    telur       = fmt_id(d.get('telur', "")) if d.get('telur', "") != "" else ""
-    buah_import = fmt_id(d.get('buah_import', "")) if d.get('buah_import', "") != "" else ""
-    buah_lokal  = fmt_id(d.get('buah_lokal', "")) if d.get('buah_lokal', "") != "" else ""
-    all_produk_v = d.get('all_produk', "")
-    all_produk  = fmt_id(all_produk_v) if all_produk_v not in ("", None) else ""
-
-    v1i = d.get('variance_shift1_induk', "")
-    v1a = d.get('variance_shift1_anak', "")
-    v2i = d.get('variance_shift2_induk', "")
-    v2a = d.get('variance_shift2_anak', "")
-    variance_poin = d.get('variance_poin', "5")
-    variance_plus_gt10k = d.get('variance_plus_total_gt10k', "0")
-
-    cancel_poin  = d.get('cancel_poin', "5")
-    cancel_budget = d.get('cancel_budget', "")
-    cancel_shift1 = d.get('cancel_shift1', "")
-    cancel_shift2 = d.get('cancel_shift2', "")
-    cancel_total  = d.get('cancel_total', "0")
-
-    tertib_poin  = d.get('tertib_poin', "5")
-    tertib_s1    = d.get('tertib_setor_shift1', "")
-    tertib_s2    = d.get('tertib_setor_shift2', "")
-
-    cpu_50_left  = d.get('cpu_50_left', "50 %")
-    cpu_50_right = d.get('cpu_50_right', "50 %")
-    cpu_s1_induk = d.get('trx_cpu_shift1_induk', "")
-    cpu_s1_anak  = d.get('trx_cpu_shift1_anak', "")
-    cpu_s2_induk = d.get('trx_cpu_shift2_induk', "")
-    cpu_s2_anak  = d.get('trx_cpu_shift2_anak', "")
-
-    tunai_poin   = d.get('tunai_poin', "5")
-    tunai_target = d.get('tunai_target', "215")
-    tunai_s1     = d.get('tunai_shift1', "")
-    tunai_s2     = d.get('tunai_shift2', "")
-    tunai_total  = d.get('tunai_total', "")
-    tunai_sisa   = d.get('tunai_sisa', "")
-
-    isaku_poin   = d.get('isaku_poin', "5")
-    isaku_target = d.get('isaku_target', "8")
-    isaku_s1     = d.get('isaku_shift1', "")
-    isaku_s2     = d.get('isaku_shift2', "")
-    isaku_total  = d.get('isaku_total', "")
-    isaku_sisa   = d.get('isaku_sisa', "")
-
-    poinku_poin   = d.get('poinku_poin', "10")
-    poinku_target = d.get('poinku_target', "10")
-    poinku_s1     = d.get('poinku_shift1', "")
-    poinku_s2     = d.get('poinku_shift2', "")
-    poinku_total  = d.get('poinku_total', "")
-    poinku_sisa   = d.get('poinku_sisa', "")
-
-    klik_poin   = d.get('klik_poin', "10")
-    klik_target = d.get('klik_target', "13")
-    klik_s1     = d.get('klik_shift1', "")
-    klik_s2     = d.get('klik_shift2', "")
-    klik_total  = d.get('klik_total', "")
-    klik_sisa   = d.get('klik_sisa', "")
-
-    store_act_s1 = d.get('store_activity_shift1', "")
-    store_act_s2 = d.get('store_activity_shift2', "")
-    kbk_poin = d.get('kbk_poin', "5")
-    kbk_s1   = d.get('kbk_shift1', "")
-    kbk_s2   = d.get('kbk_shift2', "")
-    kbk_total = d.get('kbk_total', "5")
-    kbk_sisa  = d.get('kbk_sisa', "")
-    pjr_poin   = d.get('pjr_poin', "10")
-    pjr_target = d.get('pjr_target', "")
-    pjr_s1     = d.get('pjr_shift1', "")
-    pjr_s2     = d.get('pjr_shift2', "")
-    itt_poin   = d.get('itt_poin', "5")
-    itt_budget = d.get('itt_budget', "")
-    itt_s1     = d.get('itt_shift1', "")
-    itt_s2     = d.get('itt_shift2', "")
-    itt_total  = d.get('itt_total', "")
-
-    varmin_total = d.get('total_varmin', "0")
-    varmin_dian  = d.get('varmin_dian', "0")
-    varmin_dinda = d.get('varmin_dinda', "0")
-    varmin_agung = d.get('varmin_agung', "0")
-    varmin_rifa  = d.get('varmin_rifa', "0")
-    varmin_putri = d.get('varmin_putri', "0")
-    varplus_total = d.get('total_varplus', "")
-    varplus_dian  = d.get('variance_plus_dian', "")
-    varplus_dinda = d.get('variance_plus_dinda', "")
-    varplus_agung = d.get('variance_plus_agung', "")
-    varplus_rifa  = d.get('variance_plus_rifa', "")
-    varplus_putri = d.get('variance_plus_putri', "")
+# Template didefinisikan sebagai tabel (template baris, field) lalu di-compile
+# sekali saat import jadi satu fungsi: satu format string + satu ekspresi per field.
+# Field: None (baris statis), "key", ("key", default), A("key") (angka fmt_id),
+# C("teks") (teks konstan, mis. nama staff) atau callable(d) untuk field turunan.
+# Field tetap Laporan dibaca langsung dari slot, key dinamis per staff lewat d.get.
+# Nilai dari config (nama, default, key staff) tidak pernah ditulis ke source yang
+# di-compile: diikat sebagai nama di namespace exec lalu dirujuk lewat nama itu.
+class A(str):
+    """Key angka: di-render lewat fmt_id, kosong jika belum diisi."""
 
-    lines = []
-    lines.append(f"*{store}*")
-    lines.append(f"Monitoring *{kpi_title}* ")
-    lines.append(f" SHIFT {shift}")
-    lines.append(f"Tanggal: {tanggal}\n")
-    lines.append(f"Sales: {sales_str}")
-    lines.append(f"Struk : {total_struk}\n")
-    lines.append(f"*Sales produk khusus*")
-    lines.append(f"Mr.bread: {mrbread}")
-    lines.append(f"Prime bread: {primebread}")
-    lines.append(f"Telur : {telur}")
-    lines.append(f"Buah Import : {buah_import}")
-    lines.append(f"Buah lokal : {buah_lokal}")
-    lines.append(f"All Produk : {all_produk}\n")
-    lines.append(f"*VARIANCE*")
-    lines.append(f"POIN {variance_poin}")
-    lines.append("Budget")
-    lines.append("Shift 1")
-    lines.append(f"Induk : {v1i}")
-    lines.append(f"Anak : {v1a}\n")
-    lines.append("Shift 2")
-    lines.append(f"Induk  : {v2i}")
-    lines.append(f"Anak : {v2a}\n")
-    lines.append(f"Total Variance Plus di atas Rp.10.000 : {variance_plus_gt10k}\n")
-    lines.append(f"*CANCEL SALES*")
-    lines.append(f"POIN {cancel_poin}")
-    lines.append(f"Budget : {cancel_budget}")
-    lines.append(f"Shift 1 : {cancel_shift1}")
-    lines.append(f"Shift 2 : {cancel_shift2}")
-    lines.append(f"Total cancel : {cancel_total}\n")
-    lines.append(f"*TERTIB SETOR*")
-    lines.append(f"POIN {tertib_poin}")
-    lines.append(f"Shift 1 : {tertib_s1}")
-    lines.append(f"Shift 2 : {tertib_s2}\n")
-    lines.append(f"*JMLH TRX CPU*")
-    lines.append(f"{cpu_50_left} : {cpu_50_right}")
-    lines.append("Shift 1")
-    lines.append(f"Induk : {cpu_s1_induk}")
-    lines.append(f"Anak : {cpu_s1_anak}\n")
-    lines.append("Shift 2")
-    lines.append(f"Induk : {cpu_s2_induk}")
-    lines.append(f"Anak : {cpu_s2_anak}\n")
-    lines.append(f"*JMLH TRX TUNAI*")
-    lines.append(f"POIN {tunai_poin}")
-    lines.append(f"Target : {tunai_target}")
-    lines.append(f"Shift 1 : {tunai_s1}")
-    lines.append(f"Shift 2 : {tunai_s2}")
-    lines.append(f"Total trx tunai : {tunai_total}")
-    lines.append(f"Sisa : {tunai_sisa}\n")
-    lines.append(f"*NEW MEMBER ISAKU*")
-    lines.append(f"POIN {isaku_poin}")
-    lines.append(f"Target : {isaku_target}")
-    lines.append(f"Shift 1 : {isaku_s1}")
-    lines.append(f"Shift 2 : {isaku_s2}")
-    lines.append(f"Total  : {isaku_total}")
-    lines.append(f"Sisa : {isaku_sisa}\n")
-    lines.append(f"*NEW MEMBER POINKU*")
-    lines.append(f"POIN {poinku_poin}")
-    lines.append(f"Target : {poinku_target}")
-    lines.append(f"Shift 1 : {poinku_s1}")
-    lines.append(f"Shift 2 : {poinku_s2}")
-    lines.append(f"Total : {poinku_total}")
-    lines.append(f"Sisa : {poinku_sisa}\n")
-    lines.append(f"*NEW MEMBER KLIK*")
-    lines.append(f"POIN {klik_poin}")
-    lines.append(f"Target : {klik_target}")
-    lines.append(f"Shift 1 : {klik_s1}")
-    lines.append(f"Shift 2 : {klik_s2}")
-    lines.append(f"Total : {klik_total}")
-    lines.append(f"Sisa : {klik_sisa}\n")
-    lines.append(f"*STORE ACTIVITY*")
-    lines.append("Poin 5")
-    lines.append(f"Shift 1 : {store_act_s1} ")
-    lines.append(f"Shift 2 : {store_act_s2}\n")
-    lines.append(f"*TOKO PRIMA/KBK*")
-    lines.append(f"POIN {kbk_poin}")
-    lines.append(f"Shift 1 : {kbk_s1}")
-    lines.append(f"Shift 2 : {kbk_s2}")
-    lines.append(f"Total : {kbk_total}")
-    lines.append(f"Sisa : {kbk_sisa}\n")
-    lines.append(f"*PELAKSANAAN  PJR(scan itt)*")
-    lines.append(f"Target : {pjr_target}")
-    lines.append(f"POIN {pjr_poin}")
-    lines.append("Target")
-    lines.append(f"Shift 1 : {pjr_s1}")
-    lines.append(f"Shift 2 : {pjr_s2}\n")
-    lines.append(f"*QTY ITT*")
-    lines.append(f"POIN {itt_poin}")
-    lines.append(f"Budget : {itt_budget}")
-    lines.append(f"Shift 1 : {itt_s1}")
-    lines.append(f"Shift 2 : {itt_s2}")
-    lines.append(f"Total itt : {itt_total}\n")
-    lines.append(f"*TARGET POIN 100*\n")
-    lines.append(f"*Akumulasi varian mines*")
-    lines.append(f"Total varmin : {varmin_total}")
-    lines.append(f"Dian : {varmin_dian}")
-    lines.append(f"Dinda : {varmin_dinda}")
-    lines.append(f"Agung : {varmin_agung}")
-    lines.append(f"Rifa : {varmin_rifa}")
-    lines.append(f"Putri : {varmin_putri}\n")
-    lines.append(f"*Akumulasi variance plus*")
-    lines.append(f"Total variance plus : {varplus_total}")
-    lines.append(f"Dian : {varplus_dian}")
-    lines.append(f"Dinda : {varplus_dinda}")
-    lines.append(f"Agung : {varplus_agung}")
-    lines.append(f"Rifa : {varplus_rifa}")
-    lines.append(f"Putri : {varplus_putri}")
+class C(str):
+    """Teks konstan dari config; template baris hanya berisi "{}" untuknya."""
+
+def _sales(d):
+    v = d.get('total_sales', "")
+    return fmt_id(v) if isinstance(v, int) else str(v or "")
+
+def _tanggal(d):
+    return d.get('tanggal') or datetime.now().strftime("%d/%m/%Y")
+
+def _shift(d):
+    return shift2digits(d.get('shift', '1'))
+
+def _poin(d):
+    # Skor KPI hanya muncul setelah dihitung (fill_kpi); tanpa skor baris TARGET tetap seperti biasa
+    score = d.get('kpi_score')
+    if score in (None, ""): return ""
+    line = f"\nPoin hari ini : {score}"
+    if d.get('kpi_score_mtd') not in (None, ""):
+        line += f"\nRata-rata bulan ini : {d['kpi_score_mtd']}"
+    return line
+
+def _staff_rows(staff, key_fmt: str, default: str, last_blank: bool = False) -> list:
+    rows = [("{} : {}", [C(name), (key_fmt.format(name.lower()), default)]) for name in staff]
+    if last_blank and rows:
+        rows[-1] = (rows[-1][0] + "\n", rows[-1][1])
+    return rows
+
+def report_layout(cfg: StoreConfig) -> tuple:
+    t, p = cfg.targets, cfg.poin
+    return (
+        # --- Header ---
+        ("*{}*",                 ('store', cfg.name)),
+        ("Monitoring *{}* ",     ('kpi_title', "KPI")),
+        (" SHIFT {}",            _shift),
+        ("Tanggal: {}\n",        _tanggal),
+        ("Sales: {}",            _sales),
+        ("Struk : {}\n",         'total_struk'),
+        # --- Produk khusus ---
+        ("*Sales produk khusus*", None),
+        ("Mr.bread: {}",         A('mrbread')),
+        ("Prime bread: {}",      A('primebread')),
+        ("Telur : {}",           A('telur')),
+        ("Buah Import : {}",     A('buah_import')),
+        ("Buah lokal : {}",      A('buah_lokal')),
+        ("All Produk : {}\n",    A('all_produk')),
+        # --- Variance ---
+        ("*VARIANCE*",           None),
+        ("POIN {}",              ('variance_poin', p['variance'])),
+        ("Budget",               None),
+        ("Shift 1",              None),
+        ("Induk : {}",           'variance_shift1_induk'),
+        ("Anak : {}\n",          'variance_shift1_anak'),
+        ("Shift 2",              None),
+        ("Induk  : {}",          'variance_shift2_induk'),
+        ("Anak : {}\n",          'variance_shift2_anak'),
+        ("Total Variance Plus di atas Rp.10.000 : {}\n", ('variance_plus_total_gt10k', "0")),
+        # --- Cancel ---
+        ("*CANCEL SALES*",       None),
+        ("POIN {}",              ('cancel_poin', p['cancel'])),
+        ("Budget : {}",          ('cancel_budget', t['cancel'])),
+        ("Shift 1 : {}",         'cancel_shift1'),
+        ("Shift 2 : {}",         'cancel_shift2'),
+        ("Total cancel : {}\n",  ('cancel_total', "0")),
+        # --- Tertib setor ---
+        ("*TERTIB SETOR*",       None),
+        ("POIN {}",              ('tertib_poin', p['tertib'])),
+        ("Shift 1 : {}",         'tertib_setor_shift1'),
+        ("Shift 2 : {}\n",       'tertib_setor_shift2'),
+        # --- TRX CPU ---
+        ("*JMLH TRX CPU*",       None),
+        ("{} : {}",              [('cpu_50_left', "50 %"), ('cpu_50_right', "50 %")]),
+        ("Shift 1",              None),
+        ("Induk : {}",           'trx_cpu_shift1_induk'),
+        ("Anak : {}\n",          'trx_cpu_shift1_anak'),
+        ("Shift 2",              None),
+        ("Induk : {}",           'trx_cpu_shift2_induk'),
+        ("Anak : {}\n",          'trx_cpu_shift2_anak'),
+        # --- TRX tunai ---
+        ("*JMLH TRX TUNAI*",     None),
+        ("POIN {}",              ('tunai_poin', p['tunai'])),
+        ("Target : {}",          ('tunai_target', t['tunai'])),
+        ("Shift 1 : {}",         'tunai_shift1'),
+        ("Shift 2 : {}",         'tunai_shift2'),
+        ("Total trx tunai : {}", 'tunai_total'),
+        ("Sisa : {}\n",          'tunai_sisa'),
+        # --- Member ISAKU ---
+        ("*NEW MEMBER ISAKU*",   None),
+        ("POIN {}",              ('isaku_poin', p['isaku'])),
+        ("Target : {}",          ('isaku_target', t['isaku'])),
+        ("Shift 1 : {}",         'isaku_shift1'),
+        ("Shift 2 : {}",         'isaku_shift2'),
+        ("Total  : {}",          'isaku_total'),
+        ("Sisa : {}\n",          'isaku_sisa'),
+        # --- Member POINKU ---
+        ("*NEW MEMBER POINKU*",  None),
+        ("POIN {}",              ('poinku_poin', p['poinku'])),
+        ("Target : {}",          ('poinku_target', t['poinku'])),
+        ("Shift 1 : {}",         'poinku_shift1'),
+        ("Shift 2 : {}",         'poinku_shift2'),
+        ("Total : {}",           'poinku_total'),
+        ("Sisa : {}\n",          'poinku_sisa'),
+        # --- Member KLIK ---
+        ("*NEW MEMBER KLIK*",    None),
+        ("POIN {}",              ('klik_poin', p['klik'])),
+        ("Target : {}",          ('klik_target', t['klik'])),
+        ("Shift 1 : {}",         'klik_shift1'),
+        ("Shift 2 : {}",         'klik_shift2'),
+        ("Total : {}",           'klik_total'),
+        ("Sisa : {}\n",          'klik_sisa'),
+        # --- Store activity ---
+        ("*STORE ACTIVITY*",     None),
+        ("Poin {}",              ('store_activity_poin', p['store_activity'])),
+        ("Shift 1 : {} ",        'store_activity_shift1'),
+        ("Shift 2 : {}\n",       'store_activity_shift2'),
+        # --- KBK ---
+        ("*TOKO PRIMA/KBK*",     None),
+        ("POIN {}",              ('kbk_poin', p['kbk'])),
+        ("Shift 1 : {}",         'kbk_shift1'),
+        ("Shift 2 : {}",         'kbk_shift2'),
+        ("Total : {}",           ('kbk_total', "5")),
+        ("Sisa : {}\n",          'kbk_sisa'),
+        # --- PJR ---
+        ("*PELAKSANAAN  PJR(scan itt)*", None),
+        ("Target : {}",          ('pjr_target', t['pjr'])),
+        ("POIN {}",              ('pjr_poin', p['pjr'])),
+        ("Target",               None),
+        ("Shift 1 : {}",         'pjr_shift1'),
+        ("Shift 2 : {}\n",       'pjr_shift2'),
+        # --- ITT ---
+        ("*QTY ITT*",            None),
+        ("POIN {}",              ('itt_poin', p['itt'])),
+        ("Budget : {}",          ('itt_budget', t['itt'])),
+        ("Shift 1 : {}",         'itt_shift1'),
+        ("Shift 2 : {}",         'itt_shift2'),
+        ("Total itt : {}\n",     'itt_total'),
+        ("*TARGET POIN 100*{}\n", _poin),
+        # --- Akumulasi varian mines ---
+        ("*Akumulasi varian mines*", None),
+        ("Total varmin : {}",    ('total_varmin', "0")),
+        *_staff_rows(cfg.staff, 'varmin_{}', "0", last_blank=True),
+        # --- Akumulasi variance plus ---
+        ("*Akumulasi variance plus*", None),
+        ("Total variance plus : {}", 'total_varplus'),
+        *_staff_rows(cfg.staff, 'variance_plus_{}', ""),
+    )
+
+def compile_layout(layout):
+    """Compile tabel layout jadi satu fungsi render(d) — dipanggil sekali saat import."""
+    ns = {'fmt_id': fmt_id, 'Laporan': Laporan, 'U': UNSET}
+    slots = {name for name, _ in LAPORAN_FIELDS}
+
+    def bind(value) -> str:
+        name = f"_c{len(ns)}"; ns[name] = value
+        return name
+
+    # Field tetap dibaca langsung dari slot; key dinamis (per staff) lewat d.get
+    get = lambda key, default: (f"(x if (x := d.{key}) is not U else {bind(default)})" if key in slots
+                                else f"g({bind(key)}, {bind(default)})")
+    exprs = []
+    for _, fields in layout:
+        if fields is None: continue
+        for f in (fields if isinstance(fields, list) else [fields]):
+            if callable(f):
+                exprs.append(f"{bind(f)}(d)")
+            elif isinstance(f, C):
+                exprs.append(bind(str(f)))
+            elif isinstance(f, A):
+                exprs.append(f"(fmt_id(v) if (v := {get(str(f), '')}) not in ('', None) else '')")
+            elif isinstance(f, tuple):
+                exprs.append(get(f[0], f[1]))
+            else:
+                exprs.append(get(f, ''))
+    # Satu f-string besar: literal di-escape, tiap "{}" diganti ekspresi field
+    lits = "\n".join(t for t, _ in layout).split("{}")
+    assert len(lits) == len(exprs) + 1, "jumlah {} tidak sama dengan jumlah field"
+    esc = lambda s: (s.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                      .replace("{", "{{").replace("}", "}}"))
+    body = esc(lits[0]) + "".join(f"{{{e}}}{esc(l)}" for e, l in zip(exprs, lits[1:]))
+    code = (f'def render(d):\n    if d.__class__ is not Laporan: d = Laporan(d)\n'
+            f'    g = d.get\n    return f"{body}"\n')
+    exec(compile(code, "<report_layout>", "exec"), ns)
+    return ns['render']
+
+# Satu renderer ter-compile per StoreConfig; config lama ikut hilang setelah reload
+_RENDERERS: "weakref.WeakKeyDictionary[StoreConfig, Callable]" = weakref.WeakKeyDictionary()
+
+def renderer_for(cfg: StoreConfig) -> Callable:
+    fn = _RENDERERS.get(cfg)
+    if fn is None:
+        fn = _RENDERERS[cfg] = compile_layout(report_layout(cfg))
+    return fn
+
+def store_config(d: dict) -> StoreConfig:
+    return STORES.get(d.get('store_code'))
+
+def current_store(update: Update, context: ContextTypes.DEFAULT_TYPE) -> StoreConfig:
+    # Laporan yang sedang jalan tetap di store awalnya; selain itu pakai mapping user/chat
+    code = get_laporan(context).get('store_code')
+    if code: return STORES.get(code)
+    chat, user = update.effective_chat, update.effective_user
+    return STORES.for_ids(chat.id if chat else None, user.id if user else None)
+
+def render_report(d: Laporan, cfg: Optional[StoreConfig] = None) -> str:
+    t0 = perf_counter()
+    text = renderer_for(cfg or store_config(d))(d)
+    RENDER_SECONDS.observe(perf_counter() - t0)
+    return text
+
+# ----- Cache render per laporan -----
+# Handler yang mengubah `laporan` wajib memanggil touch_laporan(); /preview pada
+# laporan yang tidak berubah langsung memakai teks hasil render sebelumnya.
+def touch_laporan(context: ContextTypes.DEFAULT_TYPE):
+    context.user_data['laporan_rev'] = context.user_data.get('laporan_rev', 0) + 1
+
+def render_cached(context: ContextTypes.DEFAULT_TYPE) -> str:
+    d = get_laporan(context)
+    # Tanpa tanggal, render bergantung pada hari ini → ikut jadi bagian key
+    key = (context.user_data.get('laporan_rev', 0), STORES.generation,
+           d.get('tanggal') or datetime.now().strftime("%d/%m/%Y"))
+    cached = context.user_data.get('_render_cache')
+    if cached and cached[0] == key:
+        return cached[1]
+    text = render_report(d)
+    context.user_data['_render_cache'] = (key, text)
+    return text
+
+# ----- Form: satu pesan per sesi -----
+# FORM_MODE: seluruh alur laporan memakai SATU pesan bot (pesan /start) yang diedit
+# di tempat — ringkasan data yang sudah diisi + prompt step aktif; laporan final juga
+# menggantikan isi pesan itu. Edit dengan isi & keyboard identik dilewati; keyboard
+# inline hanya dikirim ulang bila berubah. Jika pesan form tidak bisa diedit lagi
+# (dihapus, terlalu lama) form pindah ke pesan baru. FORM_MODE=0 → satu pesan per step.
+FORM_MODE = os.environ.get("FORM_MODE", "1") != "0"
+
+# Ringkasan ringkas (bukan template penuh): tiap edit mengirim ulang seluruh teks,
+# jadi form cukup satu baris per kelompok field yang sudah terisi
+def _var(part):
+    return lambda d: d.get(f"variance_shift{d.get('shift', '1')}_{part}")
+
+FORM_LINES = (
+    ("Sales",    ('sales_induk', 'sales_anak'), " + "),
+    ("Struk",    ('struk_induk', 'struk_anak'), " + "),
+    ("Produk",   ('mrbread', 'primebread', 'telur', 'buah_import', 'buah_lokal'), " / "),
+    ("Variance", (_var('induk'), _var('anak')), " / "),
+)
+FORM_LINES_S1 = (
+    ("Struk S1",    ('trx_cpu_shift1_induk', 'trx_cpu_shift1_anak'), " + "),
+    ("Variance S1", ('variance_shift1_induk', 'variance_shift1_anak'), " / "),
+)
+
+def form_summary(d: dict) -> str:
+    lines = [f"*{store_config(d).name}* · Shift {d.get('shift') or '-'} · {d.get('tanggal') or '-'}"]
+    for label, keys, sep in (FORM_LINES_S1 if d.get('shift') == '2' else ()) + FORM_LINES:
+        vals = [k(d) if callable(k) else d.get(k) for k in keys]
+        if all(v in (None, "") for v in vals): continue
+        lines.append(label + " " + sep.join("…" if v in (None, "") else fmt_id(v) if isinstance(v, int) else str(v)
+                                           for v in vals))
     return "\n".join(lines)
 
+def form_open(context: ContextTypes.DEFAULT_TYPE, message):
+    """Jadikan `message` (pesan bot) pesan form sesi ini."""
+    if FORM_MODE:
+        context.user_data['form'] = {'chat': message.chat_id, 'id': message.message_id, 'sig': None}
+
+async def show_form(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, kb=None, **kwargs) -> bool:
+    """Tampilkan `text` di pesan form (edit di tempat). False jika form mode tidak aktif
+    untuk sesi ini → pemanggil mengirim pesan biasa."""
+    form = context.user_data.get('form')
+    if not FORM_MODE or form is None: return False
+    sig = [zlib.crc32(text.encode()), zlib.crc32(kb.to_json().encode()) if kb else 0]
+    if sig == form['sig']: return True
+    try:
+        if form['sig'] and sig[0] == form['sig'][0]:
+            await context.bot.edit_message_reply_markup(form['chat'], form['id'], reply_markup=kb, **kwargs)
+        else:
+            await context.bot.edit_message_text(text, form['chat'], form['id'], parse_mode=ParseMode.MARKDOWN,
+                                                reply_markup=kb, **kwargs)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            _LOGGER.info("Pesan form tidak bisa diedit (%s), pindah ke pesan baru", e)
+            msg = await context.bot.send_message(update.effective_chat.id, text, parse_mode=ParseMode.MARKDOWN,
+                                                 reply_markup=kb, **kwargs)
+            form_open(context, msg)
+            form = context.user_data['form']
+    form['sig'] = sig
+    return True
+
+# ----- Akumulasi variance bulanan -----
+async def fill_variance(d: dict) -> bool:
+    """Isi section Akumulasi varian mines/plus + jumlah variance plus > Rp.10.000 dari
+    akumulasi bulan ini (tabel variance di HISTORY). True jika ada nilai yang berubah."""
+    if not d.get('tanggal'): return False
+    cfg = store_config(d)
+    try:
+        totals = await asyncio.to_thread(HISTORY.variance_totals, cfg.code, d)
+    except Exception:
+        _LOGGER.exception("Gagal membaca akumulasi variance")
+        return False
+    vals = {'total_varmin': fmt_id(sum(t[0] for t in totals.values())),
+            'total_varplus': fmt_id(sum(t[1] for t in totals.values())),
+            'variance_plus_total_gt10k': fmt_id(sum(t[2] for t in totals.values()))}
+    for name in cfg.staff:
+        vmin, vplus, _ = totals.get(name.lower(), (0, 0, 0))
+        vals[f'varmin_{name.lower()}'] = fmt_id(vmin)
+        vals[f'variance_plus_{name.lower()}'] = fmt_id(vplus)
+    changed = any(d.get(k) != v for k, v in vals.items())
+    d.update(vals)
+    return changed
+
+# ----- Skor KPI -----
+KPI_DERIVED_KEYS = tuple(k for kpi in KPIS for k in (kpi.total, kpi.sisa) if k)
+
+async def fill_kpi(d: dict) -> bool:
+    """Isi Total/Sisa per KPI, skor hari ini (kpi_score) dan rata-rata skor bulan ini.
+    True jika ada nilai yang berubah."""
+    out = score_report(d, store_config(d))
+    vals = {k: fmt_id(out[k]) if k in out else None for k in KPI_DERIVED_KEYS}
+    vals['kpi_score'] = out['kpi_score']
+    vals['kpi_score_mtd'] = None
+    if out['kpi_score'] is not None and d.get('tanggal'):
+        try:
+            days, poin = await asyncio.to_thread(HISTORY.score_mtd, store_config(d).code, {**d, **vals})
+            if days: vals['kpi_score_mtd'] = round(poin / days)
+        except Exception:
+            _LOGGER.exception("Gagal membaca akumulasi skor KPI")
+    changed = False
+    for k, v in vals.items():
+        if v is None:
+            # Tidak dinilai → kosongkan, default layout (mis. kbk_total "5") yang tampil
+            changed |= d.pop(k, None) is not None
+        elif d.get(k) != v:
+            d[k] = v; changed = True
+    return changed
+
+async def fill_derived(context: ContextTypes.DEFAULT_TYPE, force: bool = False):
+    """Nilai turunan sebelum render laporan (akumulasi variance + skor KPI).
+    Hasilnya berlaku selama revisi laporan, jumlah tulis HISTORY dan config store sama:
+    /preview berulang tidak membaca SQLite lagi dan tidak menaikkan revisi (cache render
+    tetap kena). `force` untuk laporan final — HISTORY.writes hanya menghitung tulis
+    proses ini, replica lain bisa sudah mengarsipkan laporan."""
+    key = [context.user_data.get('laporan_rev', 0), HISTORY.writes, STORES.generation]
+    if not force and context.user_data.get('_derived') == key: return
+    d = get_laporan(context)
+    changed = await fill_variance(d)
+    if await fill_kpi(d) or changed: touch_laporan(context)
+    key[0] = context.user_data.get('laporan_rev', 0)
+    context.user_data['_derived'] = key
+
+# ----- Status laporan (untuk metrics): report_open() di report.py -----
+def count_abandoned(context: ContextTypes.DEFAULT_TYPE):
+    if report_open(context.user_data):
+        REPORTS_ABANDONED.inc(context.user_data.get('step') or "keyboard")
+
 # ===================== Commands =====================
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "Panduan:\n"
         "• /start → pilih shift\n"
-        "• Shift 2: bot minta data Shift 1 dulu (Struk & Variance) → auto isi TRX CPU/Variance Shift 1\n"
+        "• Shift 2: data Shift 1 (Struk & Variance) diambil otomatis dari laporan Shift 1 hari itu; "
+        "kalau belum ada, bot memintanya\n"
         "• Tanggal → sales → struk → (tanya produk khusus) → variance → preview\n"
-        "• Tombol /start /help /preview /batal ada di bawah.",
+        "• /kembali → ulangi langkah sebelumnya, /ubah → ganti satu field tanpa mengulang semua\n"
+        "• /rekap → total mingguan & bulanan dari laporan yang sudah selesai\n"
+        "• /area [hari|minggu|bulan] [skor|sales|tunai|isaku|poinku|klik|cancel|itt] → peringkat store satu area\n"
+        "• /isi → isi semua data dalam satu pesan (atau paste laporan lengkap)\n"
+        "• /export → unduh laporan final sebagai CSV/XLSX untuk rentang tanggal\n"
+        "• Tombol /start /help /preview /kembali /batal ada di bawah.",
         parse_mode=ParseMode.MARKDOWN,
         reply_markup=reply_kb()
     )
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    count_abandoned(context)
     context.user_data.clear()
     kb = [[InlineKeyboardButton("Mulai Laporan KPI", callback_data="start_laporan")]]
     await update.message.reply_text("Selamat datang! Klik tombol untuk mulai laporan.", reply_markup=InlineKeyboardMarkup(kb))
 
 async def batal(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    count_abandoned(context)
     context.user_data.clear()
     await update.message.reply_text("Sesi di-reset. Ketik /start untuk mulai lagi.", reply_markup=reply_kb())
 
@@ -285,51 +479,649 @@ async def preview(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not d.get("shift"):
         await update.message.reply_text("Belum ada data. Ketik /start dulu ya.", reply_markup=reply_kb())
         return
-    await update.message.reply_text(render_report(d), parse_mode=ParseMode.MARKDOWN, reply_markup=reply_kb())
+    await fill_derived(context)
+    form = context.user_data.get('form')
+    if FORM_MODE and form is not None:
+        # Laporan lengkap + prompt step aktif di pesan form; jika tidak berubah cukup tunjuk pesannya
+        step = context.user_data.get('step')
+        text = render_cached(context) + (f"\n\n{step_prompt(step, d)}" if step in STEPS else "")
+        before = form['sig']
+        await show_form(update, context, text)
+        form = context.user_data['form']
+        if form['sig'] == before:
+            await update.message.reply_text("Laporan ada di pesan ini ↑", reply_to_message_id=form['id'],
+                                            reply_markup=reply_kb())
+        return
+    await update.message.reply_text(render_cached(context), parse_mode=ParseMode.MARKDOWN, reply_markup=reply_kb())
+
+REKAP_LABELS = {
+    "sales": "Sales", "struk": "Struk", "produk": "Produk khusus", "cancel": "Cancel",
+    "tunai": "Trx tunai", "isaku": "Member ISAKU", "poinku": "Member POINKU",
+    "klik": "Member KLIK", "itt": "ITT",
+}
+
+def render_rekap(title: str, r: dict) -> str:
+    lines = [f"*{title}* — {r['n']} laporan"]
+    lines += [f"{REKAP_LABELS[m]} : {fmt_id(r[m])}" for m in METRIC_NAMES]
+    return "\n".join(lines)
+
+async def rekap(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /rekap [dd/mm/yyyy] → total minggu & bulan yang memuat tanggal tsb (default hari ini)
+    arg = context.args[0] if context.args else datetime.now().strftime("%d/%m/%Y")
+    if not valid_tanggal(arg):
+        await update.message.reply_text("Format: /rekap atau /rekap dd/mm/yyyy", reply_markup=reply_kb())
+        return
+    day = datetime.strptime(arg, "%d/%m/%Y").date()
+    cfg = current_store(update, context)
+    week, month = periods(day)
+    r_week, r_month = await asyncio.gather(asyncio.to_thread(HISTORY.rollup, cfg.code, week),
+                                           asyncio.to_thread(HISTORY.rollup, cfg.code, month))
+    w0, w1 = week_range(day)
+    text = (f"*REKAP {cfg.name}*\n\n"
+            + render_rekap(f"Minggu {w0:%d/%m}–{w1:%d/%m/%Y}", r_week) + "\n\n"
+            + render_rekap(f"Bulan {day:%m/%Y}", r_month))
+    await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_kb())
+
+# ----- /area -----
+# Peringkat store satu area (StoreConfig.area) dari index `ranking` di history.py:
+# satu range scan per halaman, tanpa memindai riwayat. Paging lewat tombol inline,
+# tiap halaman pasti di bawah batas 4096 karakter.
+AREA_PAGE = 25
+AREA_KINDS = ("hari", "minggu", "bulan")
+AREA_METRICS = {"skor": "score", **{m: m for m in METRIC_NAMES}}   # argumen -> metrik ranking
+AREA_LOWER_BETTER = {"cancel", "itt"}   # budget: makin kecil makin baik
+AREA_USAGE = "Format: /area [hari|minggu|bulan] [" + "|".join(AREA_METRICS) + "] [dd/mm/yyyy]"
+
+def parse_area_args(args: list):
+    """→ (periode, argumen metrik, tanggal). ValueError jika argumen tidak valid."""
+    kind, metric, day = "bulan", "skor", datetime.now().date()
+    for a in args:
+        a = a.lower()
+        if a in AREA_KINDS: kind = a
+        elif a in AREA_METRICS: metric = a
+        elif valid_tanggal(a): day = datetime.strptime(a, "%d/%m/%Y").date()
+        else: raise ValueError(a)
+    return kind, metric, day
+
+def area_period(kind: str, day: date):
+    period = rank_periods(day)[AREA_KINDS.index(kind)]
+    if kind == "hari": return period, f"{day:%d/%m/%Y}"
+    if kind == "minggu":
+        w0, w1 = week_range(day)
+        return period, f"{w0:%d/%m}–{w1:%d/%m/%Y}"
+    return period, f"{day:%m/%Y}"
+
+def area_mark(cfg: Optional[StoreConfig], metric: str, value: int, days: int) -> str:
+    # Target/budget di config berlaku per hari → dikali jumlah hari yang ada laporannya
+    limit = cfg.targets.get(metric, "") if cfg else ""
+    if limit in ("", None) or not days: return ""
+    limit = parse_amount(limit) * days
+    ok = value <= limit if metric in AREA_LOWER_BETTER else value >= limit
+    return " ✅" if ok else f" ⚠️ /{fmt_id(limit)}"
+
+def kb_area(kind: str, arg: str, day: date, page: int, pages: int) -> InlineKeyboardMarkup:
+    ref = f"{arg}:{day:%Y%m%d}"
+    nav = []
+    if page > 0: nav.append(InlineKeyboardButton("◀️", callback_data=f"area:{kind}:{ref}:{page - 1}"))
+    if page + 1 < pages: nav.append(InlineKeyboardButton("▶️", callback_data=f"area:{kind}:{ref}:{page + 1}"))
+    kinds = [InlineKeyboardButton(("• " if k == kind else "") + k.capitalize(), callback_data=f"area:{k}:{ref}:0")
+             for k in AREA_KINDS]
+    return InlineKeyboardMarkup([nav, kinds] if nav else [kinds])
+
+async def area_page(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str, arg: str, day: date, page: int):
+    area = current_store(update, context).area
+    stores = {c.code: c for c in STORES.in_area(area)}
+    codes = list(stores) if area else None   # None = semua store, termasuk yang sudah dihapus dari config
+    metric = AREA_METRICS[arg]
+    period, label = area_period(kind, day)
+    total, rows = await asyncio.to_thread(HISTORY.leaderboard, period, metric, codes, page * AREA_PAGE,
+                                          AREA_PAGE, metric in AREA_LOWER_BETTER)
+    pages = max(1, -(-total // AREA_PAGE))
+    lines = [f"*PERINGKAT {escape_markdown(area or 'SEMUA STORE')}*",
+             f"{REKAP_LABELS.get(metric, 'Skor KPI')} — {kind} {label}", ""]
+    for i, (code, value, days) in enumerate(rows, page * AREA_PAGE + 1):
+        cfg = stores.get(code)
+        name = escape_markdown((cfg.name if cfg else code)[:28])
+        lines.append(f"{i}. {name} — {fmt_id(value)}{area_mark(cfg, metric, value, days)}")
+    if not rows: lines.append("Belum ada laporan.")
+    lines += ["", f"Hal {page + 1}/{pages}"]
+    text = "\n".join(lines)
+    if page + 1 >= pages:
+        reported = set(await asyncio.to_thread(HISTORY.reported, period, codes))
+        missing = [escape_markdown(c.name) for c in stores.values() if c.code not in reported]
+        if missing:
+            tail = f"\n\nBelum lapor ({len(missing)}): " + ", ".join(missing)
+            room = MessageLimit.MAX_TEXT_LENGTH - len(text)
+            text += tail if len(tail) <= room else tail[:room - 1].rpartition(",")[0] + " …"
+    return text, kb_area(kind, arg, day, page, pages)
+
+async def area_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        kind, arg, day = parse_area_args(context.args or [])
+    except ValueError:
+        await update.message.reply_text(AREA_USAGE, reply_markup=reply_kb())
+        return
+    text, kb = await area_page(update, context, kind, arg, day, 0)
+    await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+
+async def on_area_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query; await q.answer()
+    _, kind, arg, day, page = q.data.split(":")
+    text, kb = await area_page(update, context, kind, arg, datetime.strptime(day, "%Y%m%d").date(), int(page))
+    try:
+        await q.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower(): raise
+
+# ----- /export -----
+EXPORTS = ExportCache(os.environ.get("EXPORT_DIR", "exports"), int(os.environ.get("EXPORT_CACHE_MAX", "100")))
+EXPORT_MAX_BYTES = 50 * 1024 * 1024   # batas upload dokumen Bot API
+EXPORT_USAGE = ("Format: /export [dari] [sampai] [csv|xlsx] [KODE,KODE|semua]\n"
+                "Contoh: /export 01/08/2025 31/08/2025 xlsx semua\n"
+                "Default: awal bulan ini s/d hari ini, csv, store kamu. "
+                "semua = semua store di area kamu.")
+
+def parse_export_args(args: list, default_store: str, known: Iterable[str]):
+    """→ (stores atau None = semua, dari, sampai, format). ValueError jika argumen tidak valid,
+    termasuk kode store yang tidak ada di config (`known`)."""
+    by_upper = {c.upper(): c for c in known}
+    dates, fmt, stores, codes = [], "csv", [default_store], []
+    for a in args:
+        if valid_tanggal(a): dates.append(datetime.strptime(a, "%d/%m/%Y").date())
+        elif a.lower() in ("csv", "xlsx"): fmt = a.lower()
+        elif a.lower() == "semua": stores = None
+        else:
+            parts = [c.strip().upper() for c in a.split(",") if c.strip()]
+            if not parts or any(c not in by_upper for c in parts): raise ValueError(a)
+            codes += [by_upper[c] for c in parts]
+    if codes:
+        if stores is None: raise ValueError("semua")
+        stores = list(dict.fromkeys(codes))
+    today = date.today()
+    if len(dates) > 2: raise ValueError("tanggal")
+    start = dates[0] if dates else today.replace(day=1)
+    end = dates[1] if len(dates) == 2 else today
+    if start > end: raise ValueError("rentang")
+    return stores, start, end, fmt
+
+def bulk_args(context: ContextTypes.DEFAULT_TYPE) -> dict:
+    # rate_limit_args hanya diterima method bot, dan hanya jika rate limiter terpasang
+    return {"rate_limit_args": {"priority": PRIORITY_BULK}} if getattr(context.bot, "rate_limiter", None) else {}
+
+def export_scope(update: Update) -> List[str]:
+    """Store yang boleh di-export: semua store di area user/chat ini, atau storenya sendiri
+    jika tanpa area. User/chat yang tidak terdaftar di config hanya store default."""
+    chat, user = update.effective_chat, update.effective_user
+    cfg = STORES.mapped(chat.id if chat else None, user.id if user else None)
+    if cfg is None: return [STORES.default.code]
+    return [c.code for c in STORES.in_area(cfg.area)] if cfg.area else [cfg.code]
+
+async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    cfg = current_store(update, context)
+    try:
+        stores, start, end, fmt = parse_export_args(context.args or [], cfg.code, (c.code for c in STORES.all()))
+    except ValueError:
+        await update.message.reply_text(EXPORT_USAGE, reply_markup=reply_kb())
+        return
+    scope = export_scope(update)
+    if stores is None:
+        stores = scope
+    denied = [c for c in stores if c not in scope]
+    if denied:
+        await update.message.reply_text(f"Tidak bisa export store di luar area kamu: {', '.join(denied)}",
+                                        reply_markup=reply_kb())
+        return
+    if fmt not in FORMATS:
+        await update.message.reply_text("XLSX belum tersedia di server ini, pakai csv.", reply_markup=reply_kb())
+        return
+
+    chat_id = update.effective_chat.id
+    await context.bot.send_chat_action(chat_id, ChatAction.UPLOAD_DOCUMENT)
+    # Periode yang sudah tutup di-cache; hari ini masih bisa bertambah laporan
+    art = await EXPORTS.get(HISTORY, stores, start, end, fmt, closed=end < date.today())
+    if art is None:
+        await update.message.reply_text(f"Tidak ada laporan {start:%d/%m/%Y}–{end:%d/%m/%Y}.", reply_markup=reply_kb())
+        return
+    caption = f"{art.rows} laporan, {start:%d/%m/%Y}–{end:%d/%m/%Y}"
+    try:
+        if art.file_id:
+            try:
+                await context.bot.send_document(chat_id, art.file_id, caption=caption, **bulk_args(context))
+                return
+            except BadRequest:
+                pass   # file_id tidak berlaku lagi → upload ulang dari file
+        if os.path.getsize(art.path) > EXPORT_MAX_BYTES:
+            await update.message.reply_text("File terlalu besar untuk Telegram, perkecil rentang tanggal/store.",
+                                            reply_markup=reply_kb())
+            return
+        data = await asyncio.to_thread(Path(art.path).read_bytes)
+        msg = await context.bot.send_document(chat_id, data, filename=art.filename, caption=caption,
+                                              **bulk_args(context))
+        if not art.temporary and msg.document:
+            EXPORTS.remember(art.path, msg.document.file_id)
+    finally:
+        if art.temporary: os.remove(art.path)
+
+# ===================== Keyboard & aksi akhir langkah =====================
+def kb_tanggal():
+    return InlineKeyboardMarkup([[InlineKeyboardButton("Hari ini", callback_data="tgl_today")],
+                                 [InlineKeyboardButton("Input manual", callback_data="tgl_manual")]])
+
+def kb_produk():
+    return InlineKeyboardMarkup([[InlineKeyboardButton("Ya", callback_data="produk_yes")],
+                                 [InlineKeyboardButton("Tidak", callback_data="produk_no")]])
+
+def kb_shift():
+    return InlineKeyboardMarkup([[InlineKeyboardButton("Shift 1", callback_data="shift_1")],
+                                 [InlineKeyboardButton("Shift 2", callback_data="shift_2")]])
+
+# Aksi = successor step yang bukan step teks (kirim keyboard / laporan akhir).
+# Keyboard yang sedang menunggu pilihan dicatat di user_data['keyboard'] (step None),
+# supaya /ubah bisa kembali ke keyboard itu.
+async def ask_keyboard(update: Update, context: ContextTypes.DEFAULT_TYPE, name: str, text: str, kb,
+                       edit: bool = False):
+    context.user_data['step'] = None
+    context.user_data['keyboard'] = name
+    if await show_form(update, context, form_summary(get_laporan(context)) + "\n\n" + text, kb): return
+    if edit:
+        await update.callback_query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+    else:
+        await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb)
+
+async def ask_shift(update: Update, context: ContextTypes.DEFAULT_TYPE, edit: bool = False):
+    await ask_keyboard(update, context, 'shift', "Pilih shift:", kb_shift(), edit)
+
+async def ask_tanggal(update: Update, context: ContextTypes.DEFAULT_TYPE, edit: bool = False):
+    await ask_keyboard(update, context, 'tanggal', "Set tanggal:", kb_tanggal(), edit)
+
+async def ask_produk(update: Update, context: ContextTypes.DEFAULT_TYPE, edit: bool = False):
+    await ask_keyboard(update, context, 'produk', "Jual *Produk Khusus* hari ini?", kb_produk(), edit)
+
+KEYBOARDS = {'shift': ask_shift, 'tanggal': ask_tanggal, 'produk': ask_produk}
+
+async def send_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data['step'] = None
+    context.user_data.pop('keyboard', None)
+    await fill_derived(context, force=True)
+    # Laporan final masuk lane bulk: prompt step user lain didahulukan saat jam tutup shift
+    if not await show_form(update, context, render_cached(context), **bulk_args(context)):
+        await context.bot.send_message(update.effective_chat.id, render_cached(context), parse_mode=ParseMode.MARKDOWN,
+                                       reply_markup=reply_kb(), **bulk_args(context))
+    if report_open(context.user_data):
+        REPORTS_DONE.inc(get_laporan(context).get('shift') or "-")
+    context.user_data['selesai'] = context.user_data.get('laporan_rev')
+    await archive_report(context)
+    post_to_groups(update, context)
+
+def post_to_groups(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Antrekan laporan final ke grup report_chats store (kecuali grup tempat laporan dibuat).
+    Revisi yang belum sempat terposting menggantikan versi sebelumnya di antrean."""
+    d = get_laporan(context)
+    cfg = store_config(d)
+    for chat_id in cfg.report_chats:
+        if chat_id == update.effective_chat.id: continue
+        FANOUT.enqueue(chat_id, render_cached(context), ParseMode.MARKDOWN,
+                       key=("laporan", chat_id, cfg.code, d.get('tanggal'), d.get('shift')))
+
+async def archive_report(context: ContextTypes.DEFAULT_TYPE):
+    d = get_laporan(context)
+    if not d.get('tanggal'): return
+    try:
+        await asyncio.to_thread(HISTORY.append, store_config(d).code, dict(d))
+    except Exception:
+        _LOGGER.exception("Gagal menyimpan laporan ke riwayat")
+
+# ----- Carry-over Shift 1 → Shift 2 -----
+# Data Shift 1 yang dibutuhkan laporan Shift 2 diambil dari laporan Shift 1 final
+# (store & tanggal sama) lewat index `latest`; step s1_* hanya untuk fallback.
+# Input KPI Shift 1 (tunai, member, cancel, ...) ikut dibawa agar skor menggabungkan dua shift.
+S1_CARRY_KEYS = ('trx_cpu_shift1_induk', 'trx_cpu_shift1_anak', 'variance_shift1_induk', 'variance_shift1_anak')
+
+async def carry_over_shift1(d: dict, only_missing: bool = False) -> bool:
+    """Isi S1_CARRY_KEYS dari laporan Shift 1; True jika semuanya terisi."""
+    try:
+        prev = await asyncio.to_thread(HISTORY.get, store_config(d).code, d['tanggal'], '1')
+    except Exception:
+        _LOGGER.exception("Gagal membaca laporan Shift 1")
+        return False
+    if not prev or any(prev.get(k) in (None, "") for k in S1_CARRY_KEYS):
+        return False
+    for k in S1_CARRY_KEYS:
+        if not (only_missing and d.get(k) not in (None, "")):
+            d[k] = prev[k]
+    for k in SHIFT1_INPUT_KEYS:
+        if prev.get(k) not in (None, "") and not (only_missing and d.get(k) not in (None, "")):
+            d[k] = prev[k]
+    return True
+
+async def after_tanggal(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    d = get_laporan(context)
+    edit = update.callback_query is not None
+    if _shift_of(d) == '2':
+        if not await carry_over_shift1(d):
+            await ask_step(update, context, 's1_struk_induk_for_s2', edit=edit)
+            return
+        touch_laporan(context)
+        note = (f"Data Shift 1 diambil dari laporan Shift 1 {d['tanggal']}: "
+                f"struk {fmt_id(d['trx_cpu_shift1_induk'])}/{fmt_id(d['trx_cpu_shift1_anak'])}, "
+                f"variance {d['variance_shift1_induk']} / {d['variance_shift1_anak']}.\n\n")
+        await ask_step(update, context, 'sales_induk', edit=edit, note=note)
+        return
+    await ask_step(update, context, 'sales_induk', edit=edit)
+
+# ===================== Step graph =====================
+# Tiap step mendeklarasikan prompt, parser, key tujuan, perhitungan turunan dan
+# successor-nya. STEPS adalah tabel dispatch (dict) — input_text tidak lagi
+# membandingkan step satu per satu. Step KPI baru cukup ditambah ke tabel.
+class Step(NamedTuple):
+    prompt: Any                 # str | callable(d) -> str
+    next: Any = None            # nama step | coroutine aksi(update, context)
+    key: Any = None             # str | callable(d) -> str; default = nama step
+    parse: Callable = parse_amount
+    derive: Optional[Callable] = None   # dipanggil setelah nilai disimpan
+    error: Optional[str] = None         # pesan jika parse raise ValueError
+    shift: Optional[str] = None         # step hanya berlaku untuk shift ini
+
+def _variance_input(text: str) -> str:
+    # Disimpan apa adanya (tampil di laporan); harus bisa di-parse jadi (jumlah, staff)
+    if parse_variance(text) is None: raise ValueError(text)
+    return text
+
+VARIANCE_ERROR = "Format variance: tanda + angka + nama staff, contoh +4.139 Dian atau -1.200 Agung (0 jika tidak ada)."
+
+def _tanggal_input(text: str) -> str:
+    if not valid_tanggal(text): raise ValueError(text)
+    return text
+
+def _shift_of(d: dict) -> str:
+    return d.get('shift', '1')
+
+def _derive_s1_struk(d: dict):
+    for part in ('induk', 'anak'):
+        if f's1_struk_{part}_for_s2' in d:
+            d[f'trx_cpu_shift1_{part}'] = d[f's1_struk_{part}_for_s2']
+
+def _derive_sales(d: dict):
+    if 'sales_anak' in d:
+        d['total_sales'] = d.get('sales_induk', 0) + d['sales_anak']
+
+def _derive_struk(d: dict):
+    if 'struk_anak' not in d: return
+    d['total_struk'] = d.get('struk_induk', 0) + d['struk_anak']
+    if _shift_of(d) == '1':
+        d['trx_cpu_shift1_induk'] = d.get('struk_induk', 0)
+        d['trx_cpu_shift1_anak']  = d['struk_anak']
+        ensure_defaults_for_shift(d, '1')
+    else:
+        d['trx_cpu_shift2_induk'] = d.get('struk_induk', 0)
+        d['trx_cpu_shift2_anak']  = d['struk_anak']
+        ensure_defaults_for_both_shifts(d)
+
+PRODUK_KEYS = ('mrbread', 'primebread', 'telur', 'buah_import', 'buah_lokal')
+
+def _derive_produk(d: dict):
+    if 'buah_lokal' in d:
+        d['all_produk'] = sum(d.get(k, 0) for k in PRODUK_KEYS)
+
+def _prompt_struk_induk(d: dict) -> str:
+    if 'total_sales' in d:
+        return f"Total Sales sementara: {fmt_id(d['total_sales'])}\nMasukkan *Struk Induk* (angka):"
+    return "Masukkan *Struk Induk* (angka):"
+
+STEPS = {
+    # --- SHIFT 2 prefill SHIFT 1 ---
+    's1_struk_induk_for_s2':    Step("Masukkan *Struk Induk Shift 1* (angka, 0 jika tidak ada):",
+                                     next='s1_struk_anak_for_s2', derive=_derive_s1_struk, shift='2'),
+    's1_struk_anak_for_s2':     Step("Masukkan *Struk Anak Shift 1* (angka, 0 jika tidak ada):",
+                                     next='s1_variance_induk_for_s2', derive=_derive_s1_struk, shift='2'),
+    's1_variance_induk_for_s2': Step("Masukkan *Variance Induk Shift 1* (contoh: +4.139 Dini):",
+                                     next='s1_variance_anak_for_s2', key='variance_shift1_induk', parse=_variance_input,
+                                     error=VARIANCE_ERROR, shift='2'),
+    's1_variance_anak_for_s2':  Step("Masukkan *Variance Anak Shift 1* (contoh: +334 Rifa):",
+                                     next='sales_induk', key='variance_shift1_anak', parse=_variance_input,
+                                     error=VARIANCE_ERROR, shift='2'),
+    # --- Tanggal ---
+    'tanggal_manual': Step("Ketik tanggal *dd/mm/yyyy* (contoh 22/08/2025):", next=after_tanggal,
+                           key='tanggal', parse=_tanggal_input, error="Format salah. Contoh benar: 22/08/2025"),
+    # --- Sales ---
+    'sales_induk': Step("Masukkan *Sales Induk* (angka):", next='sales_anak', derive=_derive_sales),
+    'sales_anak':  Step("Masukkan *Sales Anak* (angka):", next='struk_induk', derive=_derive_sales),
+    # --- Struk -> TRX CPU sesuai shift aktif ---
+    'struk_induk': Step(_prompt_struk_induk, next='struk_anak', derive=_derive_struk),
+    'struk_anak':  Step("Masukkan *Struk Anak* (angka):", next=ask_produk, derive=_derive_struk),
+    # --- Produk Khusus (per item) ---
+    'mrbread':     Step("Mr Bread berapa? (angka)", next='primebread', derive=_derive_produk),
+    'primebread':  Step("Prime Bread berapa? (angka)", next='telur', derive=_derive_produk),
+    'telur':       Step("Telur berapa? (angka)", next='buah_import', derive=_derive_produk),
+    'buah_import': Step("Buah Import berapa? (angka)", next='buah_lokal', derive=_derive_produk),
+    'buah_lokal':  Step("Buah Lokal berapa? (angka)", next='variance_induk', derive=_derive_produk),
+    # --- Variance (ke shift yang benar) ---
+    'variance_induk': Step("Masukkan *Variance Induk* (contoh: +4.139 Dini):", next='variance_anak',
+                           key=lambda d: f"variance_shift{_shift_of(d)}_induk", parse=_variance_input,
+                           error=VARIANCE_ERROR),
+    'variance_anak':  Step("Masukkan *Variance Anak* (contoh: +334 Rifa):", next=send_report,
+                           key=lambda d: f"variance_shift{_shift_of(d)}_anak", parse=_variance_input,
+                           error=VARIANCE_ERROR),
+}
+
+def compile_steps(steps: dict) -> dict:
+    """Validasi graph saat startup: semua successor string harus step yang terdaftar."""
+    for name, st in steps.items():
+        if isinstance(st.next, str) and st.next not in steps:
+            raise RuntimeError(f"Step {name!r}: successor {st.next!r} tidak terdaftar")
+    return steps
+
+STEPS = compile_steps(STEPS)
+
+def step_prompt(name: str, d: dict) -> str:
+    p = STEPS[name].prompt
+    return p(d) if callable(p) else p
+
+async def ask_step(update: Update, context: ContextTypes.DEFAULT_TYPE, name: str, edit: bool = False,
+                   note: str = ""):
+    context.user_data['step'] = name
+    context.user_data.pop('keyboard', None)
+    text = note + step_prompt(name, get_laporan(context))
+    if await show_form(update, context, form_summary(get_laporan(context)) + "\n\n" + text): return
+    if edit:
+        await update.callback_query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN)
+    else:
+        await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_kb())
+
+async def goto(update: Update, context: ContextTypes.DEFAULT_TYPE, nxt):
+    if nxt is None:
+        context.user_data['step'] = None
+    elif isinstance(nxt, str):
+        await ask_step(update, context, nxt)
+    else:
+        await nxt(update, context)
+
+# ===================== Navigasi: /kembali & /ubah =====================
+async def kembali(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    history = context.user_data.get('history') or []
+    if not history:
+        await update.message.reply_text("Tidak ada langkah sebelumnya.", reply_markup=reply_kb())
+        return
+    context.user_data.pop('resume', None)
+    await ask_step(update, context, history.pop())
+
+async def ubah(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    d = get_laporan(context)
+    if not d.get("shift"):
+        await update.message.reply_text("Belum ada data. Ketik /start dulu ya.", reply_markup=reply_kb())
+        return
+    name = (context.args[0] if context.args else "").strip().lower()
+    st = STEPS.get(name)
+    if st is None or (st.shift and st.shift != _shift_of(d)):
+        fields = [n for n, s in STEPS.items() if not s.shift or s.shift == _shift_of(d)]
+        await update.message.reply_text("Pakai: /ubah <field>\nField: " + ", ".join(fields), reply_markup=reply_kb())
+        return
+    # Setelah field diisi, kembali ke step teks yang sedang aktif, atau ke keyboard yang
+    # sedang menunggu pilihan (shift/tanggal/produk); lihat resume_target
+    if 'resume' not in context.user_data:
+        context.user_data['resume'] = context.user_data.get('step') or context.user_data.get('keyboard')
+    await ask_step(update, context, name)
+
+def resume_target(resume: Optional[str], d: Laporan):
+    """Tujuan setelah field /ubah diisi. Laporan final hanya dikirim ulang jika laporan
+    memang sudah lengkap; selain itu daftar field yang masih kurang."""
+    if resume in STEPS: return resume
+    if resume in KEYBOARDS: return KEYBOARDS[resume]
+    return ask_missing if missing_fields(d) else send_report
+
+# ===================== Input sekaligus (/isi) =====================
+# Satu pesan berisi blok "label: nilai" (atau paste laporan hasil bot) mengisi seluruh
+# laporan; bot membalas SATU pesan: laporan final, atau daftar field yang kurang/invalid.
+BULK_KEYS = {(st.key or name): st.parse is parse_amount for name, st in STEPS.items() if not callable(st.key)}
+
+BULK_CONTOH = (
+    "Kirim dalam satu pesan, contoh:\n"
+    "/isi\n"
+    "shift: 1\n"
+    "tanggal: 22/08/2025\n"
+    "sales induk: 1.250.000\n"
+    "sales anak: 300.000\n"
+    "struk induk: 310\n"
+    "struk anak: 45\n"
+    "mr bread: 0\n"
+    "variance induk: +4.139 Dini\n"
+    "variance anak: +334 Rifa\n\n"
+    "Shift 2: data Shift 1 diambil dari laporan Shift 1 hari itu; jika belum ada, tambahkan\n"
+    "struk induk shift 1, struk anak shift 1, variance induk shift 1, variance anak shift 1.\n"
+    "Bisa juga paste ulang laporan lengkap hasil bot."
+)
+
+def bulk_values(text: str):
+    """parse_bulk + validasi yang sama dengan input per step: variance yang tidak bisa
+    di-parse (_variance_input) masuk daftar tidak valid dan tidak disimpan."""
+    values, errors = parse_bulk(text, BULK_KEYS)
+    for key in [k for k in values if k.startswith('variance_')]:
+        try:
+            _variance_input(values[key])
+        except ValueError:
+            part, _, rest = key[len('variance_'):].partition('_')
+            # variance_induk / variance_shift1_induk → label seperti di BULK_CONTOH
+            label = f"variance {rest} shift {part[-1]}" if rest else f"variance {part}"
+            errors.append(f"{label}: {values.pop(key)}")
+    return values, errors
+
+def looks_like_bulk(text: str) -> bool:
+    return text.count("\n") >= 2 and text.count(":") >= 3
+
+def apply_bulk(d: dict, values: dict):
+    s = values.get('shift') or d.get('shift')
+    for part in ('induk', 'anak'):
+        if f'variance_{part}' in values:
+            values[f'variance_shift{s or "1"}_{part}'] = values.pop(f'variance_{part}')
+    d.update(values)
+    if not s: return
+    if s == '1': ensure_defaults_for_shift(d, '1')
+    else: ensure_defaults_for_both_shifts(d)
+    # Paste laporan: struk induk/anak hanya ada di JMLH TRX CPU shift aktif
+    for part in ('induk', 'anak'):
+        if f'struk_{part}' not in d and f'trx_cpu_shift{s}_{part}' in d:
+            d[f'struk_{part}'] = d[f'trx_cpu_shift{s}_{part}']
+    _derive_s1_struk(d); _derive_sales(d); _derive_struk(d)
+    if any(k in values for k in PRODUK_KEYS):
+        d['all_produk'] = sum(parse_amount(d.get(k, 0)) for k in PRODUK_KEYS)
+
+def missing_lines(missing: list) -> list:
+    return ["Belum diisi — kirim /isi lalu baris berikut:"] + [f"{m}: " for m in missing]
+
+async def ask_missing(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data['step'] = None
+    await update.message.reply_text("\n".join(missing_lines(missing_fields(get_laporan(context)))),
+                                    reply_markup=reply_kb())
+
+def missing_fields(d: dict) -> list:
+    s = d.get('shift')
+    if not s: return ["shift"]
+    need = [('tanggal', "tanggal")]
+    if d.get('total_sales') in (None, ""):
+        need += [('sales_induk', "sales induk"), ('sales_anak', "sales anak")]
+    need += [('struk_induk', "struk induk"), ('struk_anak', "struk anak"),
+             (f'variance_shift{s}_induk', "variance induk"), (f'variance_shift{s}_anak', "variance anak")]
+    if s == '2':
+        need += [('trx_cpu_shift1_induk', "struk induk shift 1"), ('trx_cpu_shift1_anak', "struk anak shift 1"),
+                 ('variance_shift1_induk', "variance induk shift 1"), ('variance_shift1_anak', "variance anak shift 1")]
+    return [label for key, label in need if d.get(key) in (None, "")]
+
+async def bulk_input(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    values, errors = bulk_values(text)
+    if not values and not errors:
+        await update.message.reply_text(BULK_CONTOH, reply_markup=reply_kb())
+        return
+    if 'shift' in values:
+        # Blok dengan shift = laporan baru; tanpa shift = melengkapi laporan yang sedang jalan
+        code = current_store(update, context).code
+        context.user_data['laporan'] = Laporan(store_code=code)
+        context.user_data['history'] = []
+    context.user_data['step'] = None
+    context.user_data.pop('resume', None); context.user_data.pop('keyboard', None)
+    d = get_laporan(context)
+    if not d.get('store_code'):
+        d['store_code'] = current_store(update, context).code
+    apply_bulk(d, values)
+    if d.get('shift') == '2' and d.get('tanggal') and any(d.get(k) in (None, "") for k in S1_CARRY_KEYS):
+        await carry_over_shift1(d, only_missing=True)
+    touch_laporan(context)
+
+    missing = missing_fields(d)
+    if not missing and not errors:
+        await send_report(update, context)
+        return
+    lines = []
+    if errors:
+        lines += ["Tidak valid:"] + [f"• {e}" for e in errors]
+        if any(e.startswith("variance") for e in errors): lines.append(VARIANCE_ERROR)
+        lines.append("")
+    if missing:
+        lines += missing_lines(missing)
+    await update.message.reply_text("\n".join(lines).strip(), reply_markup=reply_kb())
+
+async def isi(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = (update.message.text or "").partition("\n")[2] or " ".join(context.args or [])
+    await bulk_input(update, context, text)
 
 # ===================== Inline callbacks =====================
 async def on_start_laporan(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query; await q.answer()
-    context.user_data['laporan'] = {}; context.user_data['step'] = None
-    kb = [[InlineKeyboardButton("Shift 1", callback_data="shift_1")],
-          [InlineKeyboardButton("Shift 2", callback_data="shift_2")]]
-    await q.edit_message_text("Pilih shift:", reply_markup=InlineKeyboardMarkup(kb))
+    count_abandoned(context)
+    context.user_data['laporan'] = Laporan(); context.user_data['step'] = None
+    context.user_data['history'] = []; context.user_data.pop('resume', None)
+    context.user_data['chat'] = update.effective_chat.id   # tujuan reminder
+    get_laporan(context)['store_code'] = current_store(update, context).code
+    touch_laporan(context)
+    form_open(context, q.message)
+    await ask_shift(update, context, edit=True)
 
 async def on_pilih_shift(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query; await q.answer()
     shift = q.data.split("_")[1]
     d = get_laporan(context); d['shift'] = shift
+    touch_laporan(context)
 
-    if shift == '2':
-        # Isi dulu data S1 + ceklist dua shift
-        ensure_defaults_for_both_shifts(d)
-        context.user_data['step'] = 's1_struk_induk_for_s2'
-        await q.edit_message_text("Masukkan *Struk Induk Shift 1* (angka, 0 jika tidak ada):", parse_mode=ParseMode.MARKDOWN)
-    else:
-        ensure_defaults_for_shift(d, '1')
-        kb = [[InlineKeyboardButton("Hari ini", callback_data="tgl_today")],
-              [InlineKeyboardButton("Input manual", callback_data="tgl_manual")]]
-        await q.edit_message_text("Set tanggal:", reply_markup=InlineKeyboardMarkup(kb))
+    # Shift 2: data Shift 1 dicari setelah tanggal diketahui (after_tanggal)
+    if shift == '2': ensure_defaults_for_both_shifts(d)
+    else: ensure_defaults_for_shift(d, '1')
+    await ask_tanggal(update, context, edit=True)
 
 async def on_set_tanggal(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query; await q.answer()
     d = get_laporan(context)
     if q.data == "tgl_today":
         d['tanggal'] = datetime.now().strftime("%d/%m/%Y")
-        context.user_data['step'] = 'sales_induk'
-        await q.edit_message_text("Masukkan *Sales Induk* (angka):", parse_mode=ParseMode.MARKDOWN)
+        touch_laporan(context)
+        await after_tanggal(update, context)
     else:
-        context.user_data['step'] = 'tanggal_manual'
-        await q.edit_message_text("Ketik tanggal *dd/mm/yyyy* (contoh 22/08/2025):", parse_mode=ParseMode.MARKDOWN)
+        await ask_step(update, context, 'tanggal_manual', edit=True)
 
 async def on_produk_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query; await q.answer()
     if q.data == "produk_yes":
-        context.user_data['step'] = 'mrbread'
-        await q.edit_message_text("Mr Bread berapa? (angka)")
+        await ask_step(update, context, 'mrbread', edit=True)
     else:
-        context.user_data['step'] = 'variance_induk'
-        await q.edit_message_text("Masukkan *Variance Induk* (contoh: +4.139 Dini):", parse_mode=ParseMode.MARKDOWN)
+        await ask_step(update, context, 'variance_induk', edit=True)
 
 # ===================== Input bertahap =====================
 async def input_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -340,6 +1132,8 @@ async def input_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if text == "/help":    return await help_cmd(update, context)
     if text == "/preview": return await preview(update, context)
     if text == "/batal":   return await batal(update, context)
+    if text == "/kembali": return await kembali(update, context)
+    if looks_like_bulk(text): return await bulk_input(update, context, text)
 
     step = context.user_data.get('step')
     d = get_laporan(context)
@@ -347,166 +1141,223 @@ async def input_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Ketik /start untuk memulai.", reply_markup=reply_kb())
         return
 
+    st = STEPS.get(step)
+    if st is None:
+        await update.message.reply_text("Langkah tidak dikenali. /batal lalu /start untuk ulang.", reply_markup=reply_kb())
+        context.user_data['step'] = None
+        return
+
     try:
-        # --- SHIFT 2 prefill SHIFT 1 ---
-        if step == 's1_struk_induk_for_s2':
-            d['s1_struk_induk_for_s2'] = parse_amount(text)
-            context.user_data['step'] = 's1_struk_anak_for_s2'
-            await update.message.reply_text("Masukkan *Struk Anak Shift 1* (angka, 0 jika tidak ada):", parse_mode=ParseMode.MARKDOWN, reply_markup=reply_kb())
-
-        elif step == 's1_struk_anak_for_s2':
-            d['s1_struk_anak_for_s2'] = parse_amount(text)
-            d['trx_cpu_shift1_induk'] = d['s1_struk_induk_for_s2']
-            d['trx_cpu_shift1_anak']  = d['s1_struk_anak_for_s2']
-            context.user_data['step'] = 's1_variance_induk_for_s2'
-            await update.message.reply_text("Masukkan *Variance Induk Shift 1* (contoh: +4.139 Dini):", parse_mode=ParseMode.MARKDOWN, reply_markup=reply_kb())
-
-        elif step == 's1_variance_induk_for_s2':
-            d['variance_shift1_induk'] = text
-            context.user_data['step'] = 's1_variance_anak_for_s2'
-            await update.message.reply_text("Masukkan *Variance Anak Shift 1* (contoh: +334 Rifa):", parse_mode=ParseMode.MARKDOWN, reply_markup=reply_kb())
-
-        elif step == 's1_variance_anak_for_s2':
-            d['variance_shift1_anak'] = text
-            kb = [[InlineKeyboardButton("Hari ini", callback_data="tgl_today")],
-                  [InlineKeyboardButton("Input manual", callback_data="tgl_manual")]]
-            context.user_data['step'] = None
-            await update.message.reply_text("Set tanggal untuk Shift 2:", reply_markup=InlineKeyboardMarkup(kb))
-
-        # --- Tanggal ---
-        elif step == 'tanggal_manual':
-            if not valid_tanggal(text):
-                await update.message.reply_text("Format salah. Contoh benar: 22/08/2025", reply_markup=reply_kb())
-                return
-            d['tanggal'] = text
-            context.user_data['step'] = 'sales_induk'
-            await update.message.reply_text("Masukkan *Sales Induk* (angka):", parse_mode=ParseMode.MARKDOWN, reply_markup=reply_kb())
-
-        # --- Sales ---
-        elif step == 'sales_induk':
-            d['sales_induk'] = parse_amount(text)
-            context.user_data['step'] = 'sales_anak'
-            await update.message.reply_text("Masukkan *Sales Anak* (angka):", parse_mode=ParseMode.MARKDOWN, reply_markup=reply_kb())
-
-        elif step == 'sales_anak':
-            d['sales_anak'] = parse_amount(text)
-            d['total_sales'] = d['sales_induk'] + d['sales_anak']
-            context.user_data['step'] = 'struk_induk'
-            await update.message.reply_text(f"Total Sales sementara: {fmt_id(d['total_sales'])}\nMasukkan *Struk Induk* (angka):", parse_mode=ParseMode.MARKDOWN, reply_markup=reply_kb())
-
-        # --- Struk -> TRX CPU sesuai shift aktif ---
-        elif step == 'struk_induk':
-            d['struk_induk'] = parse_amount(text)
-            context.user_data['step'] = 'struk_anak'
-            await update.message.reply_text("Masukkan *Struk Anak* (angka):", parse_mode=ParseMode.MARKDOWN, reply_markup=reply_kb())
-
-        elif step == 'struk_anak':
-            d['struk_anak'] = parse_amount(text)
-            d['total_struk'] = d['struk_induk'] + d['struk_anak']
-            s = d.get('shift', '1')
-            if s == '1':
-                d['trx_cpu_shift1_induk'] = d['struk_induk']
-                d['trx_cpu_shift1_anak']  = d['struk_anak']
-                ensure_defaults_for_shift(d, '1')
-            else:
-                d['trx_cpu_shift2_induk'] = d['struk_induk']
-                d['trx_cpu_shift2_anak']  = d['struk_anak']
-                ensure_defaults_for_both_shifts(d)
-
-            kb = [[InlineKeyboardButton("Ya", callback_data="produk_yes")],
-                  [InlineKeyboardButton("Tidak", callback_data="produk_no")]]
-            context.user_data['step'] = None
-            await update.message.reply_text("Jual *Produk Khusus* hari ini?", parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(kb))
-
-        # --- Produk Khusus (per item) ---
-        elif step == 'mrbread':
-            d['mrbread'] = parse_amount(text)
-            context.user_data['step'] = 'primebread'
-            await update.message.reply_text("Prime Bread berapa? (angka)", reply_markup=reply_kb())
-
-        elif step == 'primebread':
-            d['primebread'] = parse_amount(text)
-            context.user_data['step'] = 'telur'
-            await update.message.reply_text("Telur berapa? (angka)", reply_markup=reply_kb())
-
-        elif step == 'telur':
-            d['telur'] = parse_amount(text)
-            context.user_data['step'] = 'buah_import'
-            await update.message.reply_text("Buah Import berapa? (angka)", reply_markup=reply_kb())
-
-        elif step == 'buah_import':
-            d['buah_import'] = parse_amount(text)
-            context.user_data['step'] = 'buah_lokal'
-            await update.message.reply_text("Buah Lokal berapa? (angka)", reply_markup=reply_kb())
-
-        elif step == 'buah_lokal':
-            d['buah_lokal'] = parse_amount(text)
-            d['all_produk'] = (d.get('mrbread', 0) + d.get('primebread', 0) + d.get('telur', 0) +
-                               d.get('buah_import', 0) + d.get('buah_lokal', 0))
-            context.user_data['step'] = 'variance_induk'
-            await update.message.reply_text("Masukkan *Variance Induk* (contoh: +4.139 Dini):", parse_mode=ParseMode.MARKDOWN, reply_markup=reply_kb())
-
-        # --- Variance (ke shift yang benar) ---
-        elif step == 'variance_induk':
-            s = d.get('shift', '1')
-            d[f'variance_shift{s}_induk'] = text
-            context.user_data['step'] = 'variance_anak'
-            await update.message.reply_text("Masukkan *Variance Anak* (contoh: +334 Rifa):", parse_mode=ParseMode.MARKDOWN, reply_markup=reply_kb())
-
-        elif step == 'variance_anak':
-            s = d.get('shift', '1')
-            d[f'variance_shift{s}_anak'] = text
-            context.user_data['step'] = None
-            await update.message.reply_text(render_report(d), parse_mode=ParseMode.MARKDOWN, reply_markup=reply_kb())
+        try:
+            value = st.parse(text)
+        except ValueError:
+            if st.error is None: raise
+            text = f"⚠️ {st.error}\n\n{step_prompt(step, d)}"
+            if await show_form(update, context, form_summary(d) + "\n\n" + text): return
+            await update.message.reply_text(st.error, reply_markup=reply_kb())
+            return
+        key = st.key(d) if callable(st.key) else (st.key or step)
+        d[key] = value
+        if st.derive: st.derive(d)
+        touch_laporan(context)
 
+        if 'resume' in context.user_data:
+            # Mode /ubah: balik ke step/keyboard sebelumnya, atau laporan final jika sudah lengkap
+            await goto(update, context, resume_target(context.user_data.pop('resume'), d))
         else:
-            await update.message.reply_text("Langkah tidak dikenali. /batal lalu /start untuk ulang.", reply_markup=reply_kb())
-            context.user_data['step'] = None
+            context.user_data.setdefault('history', []).append(step)
+            await goto(update, context, st.next)
 
     except Exception as e:
         await update.message.reply_text(f"Input tidak valid: {e}\nCoba lagi.", parse_mode=ParseMode.MARKDOWN, reply_markup=reply_kb())
 
-# ===================== Main =====================
-def main():
-    import os
-    token = os.environ.get("BOT_TOKEN")
-    if not token:
-        raise RuntimeError("Environment variable BOT_TOKEN belum di-set.")
+# ===================== Jadwal: reminder akhir shift =====================
+# Satu job harian per (shift, jam) — bukan per store — lalu semua pesan masuk FANOUT,
+# jadi ratusan store dengan jam yang sama tidak mengirim serentak. Job dibuat ulang
+# saat config store berubah (hot-reload).
+REMINDER_JOB = "reminder"
+
+def schedule_reminders(app) -> int:
+    for job in app.job_queue.get_jobs_by_name(REMINDER_JOB):
+        job.schedule_removal()
+    slots = {}
+    for cfg in STORES.all():
+        for shift, hhmm in cfg.reminders.items():
+            slots.setdefault((shift, hhmm), []).append(cfg.code)
+    for (shift, hhmm), codes in slots.items():
+        try:
+            at = datetime.strptime(hhmm, "%H:%M").time().replace(tzinfo=TZ)
+        except ValueError:
+            _LOGGER.warning("Jam reminder tidak valid: %r (store %s)", hhmm, ", ".join(codes))
+            continue
+        app.job_queue.run_daily(remind_shift, at, data=(shift, frozenset(codes)), name=REMINDER_JOB)
+    return len(slots)
+
+async def all_sessions(app) -> dict:
+    """Semua sesi: backend bersama (semua replica), atau persistence + memori (yang di memori
+    lebih baru). app.user_data saja tidak berisi sesi yang belum di-load sejak restart atau
+    sudah di-evict IdleSessions."""
+    if (shared := shared_sessions(app)) is not None:
+        return await shared.all()
+    persistence = app.persistence
+    sessions = {}
+    if isinstance(persistence, SQLitePersistence) and persistence.store_data.user_data:
+        sessions = await persistence.all_user_data()
+    sessions.update(app.user_data)
+    return sessions
+
+async def remind_shift(context: ContextTypes.DEFAULT_TYPE):
+    shift, codes = context.job.data
+    tanggal = datetime.now(TZ).strftime("%d/%m/%Y")
+    # Tombol "Hari ini" memakai jam server; sekitar tengah malam bisa beda hari dengan TZ
+    today = {tanggal, datetime.now().strftime("%d/%m/%Y")}
+    if (shared := shared_sessions(context.application)) is not None:
+        # Job ini jalan di setiap replica: hanya yang pertama claim yang mengirim,
+        # sesinya dibaca dari backend (cache lokal hanya berisi user replica ini)
+        slot = zlib.crc32(",".join(sorted(codes)).encode())
+        if not await shared.claim(f"reminder:{shift}:{tanggal}:{slot:x}", 6 * 3600):
+            return
+    sessions = await all_sessions(context.application)
+    # Kasir dengan laporan shift ini yang masih terbuka; yang berhenti sebelum mengisi
+    # tanggal dianggap laporan tanggal shift ini
+    nudged = 0
+    for user_id, ud in sessions.items():
+        d = ud.get('laporan') or {}
+        if (not report_open(ud) or d.get('store_code') not in codes or d.get('shift') != shift
+                or (d.get('tanggal') or tanggal) not in today):
+            continue
+        nudged += FANOUT.enqueue(
+            ud.get('chat', user_id),
+            f"⏰ Shift {shift} hampir selesai, laporan KPI kamu belum terkirim "
+            f"(langkah: {ud.get('step') or 'pilih tombol'}). Lanjutkan input, /preview untuk cek, "
+            "atau /isi untuk kirim sekaligus.",
+            key=("reminder", user_id))
+    # Grup store yang laporan shift ini belum masuk
+    missing = await asyncio.to_thread(lambda: [c for c in codes if HISTORY.get(c, tanggal, shift) is None])
+    for code in missing:
+        cfg = STORES.get(code)
+        for chat_id in cfg.report_chats:
+            FANOUT.enqueue(chat_id, f"⏰ Laporan KPI *{cfg.name}* Shift {shift} {tanggal} belum masuk.",
+                           ParseMode.MARKDOWN, key=("belum", chat_id, code, shift))
+    _LOGGER.info("Reminder Shift %s: %d kasir diingatkan, %d dari %d store belum lapor",
+                 shift, nudged, len(missing), len(codes))
+
+async def reschedule_on_reload(context: ContextTypes.DEFAULT_TYPE):
+    if context.job.data != STORES.generation:
+        context.job.data = STORES.generation
+        schedule_reminders(context.application)
 
-    base_url = os.environ.get("WEBHOOK_BASE_URL", "").rstrip("/")
-    port = int(os.environ.get("PORT", "10000"))
+# ===================== Lifecycle =====================
+_BACKGROUND_TASKS = set()
+METRICS_LOG_SEC = 0.0   # >0 → ringkasan metrics ke log (mode polling, tanpa endpoint /metrics)
+OPEN_SESSIONS = 0       # laporan terbuka di semua sesi, dihitung count_open_sessions()
 
-    from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, filters
+async def count_open_sessions(app, interval: float):
+    # Gauge dibaca sinkron saat scrape, sedangkan sesi yang di-evict hanya ada di persistence:
+    # hitungannya diperbarui berkala dari flag `open` yang disimpan bersama sesi (COUNT di SQL,
+    # thread I/O). SharedSessions: seluruh backend (sama di semua replica). Tertinggal sampai
+    # update_interval + flush_interval persistence dari memori — cukup untuk gauge
+    global OPEN_SESSIONS
+    persistence, shared = app.persistence, shared_sessions(app)
+    while True:
+        try:
+            if shared is not None:
+                OPEN_SESSIONS = await shared.count_open()
+            elif isinstance(persistence, SQLitePersistence) and persistence.store_data.user_data:
+                OPEN_SESSIONS = await persistence.count_open()
+            else:
+                OPEN_SESSIONS = sum(1 for ud in app.user_data.values() if report_open(ud))
+        except Exception:
+            _LOGGER.exception("Gagal menghitung sesi aktif")
+        await asyncio.sleep(interval)
+
+async def post_init(app):
+    # Config store dimuat sebelum update pertama, lalu dicek perubahan file secara berkala
+    await asyncio.to_thread(STORES.reload)
+    _BACKGROUND_TASKS.add(asyncio.create_task(STORES.watch(float(os.environ.get("STORES_RELOAD_SEC", "30")))))
+    if METRICS_LOG_SEC > 0:
+        _BACKGROUND_TASKS.add(asyncio.create_task(log_periodically(METRICS_LOG_SEC)))
+    _BACKGROUND_TASKS.add(asyncio.create_task(IDLE.run(app, shared_sessions(app))))
+    _BACKGROUND_TASKS.add(asyncio.create_task(
+        count_open_sessions(app, float(os.environ.get("ACTIVE_SESSIONS_SEC", "30")))))
+    if app.job_queue is None:
+        _LOGGER.warning("JobQueue tidak tersedia (pip install \"python-telegram-bot[job-queue]\"): "
+                        "reminder shift & posting laporan ke grup nonaktif")
+        return
+    FANOUT.start(app.job_queue)
+    schedule_reminders(app)
+    app.job_queue.run_repeating(reschedule_on_reload, interval=60, first=60, data=STORES.generation)
 
-    app = ApplicationBuilder().token(token).build()
+async def post_shutdown(app):
+    for task in _BACKGROUND_TASKS: task.cancel()
+    _BACKGROUND_TASKS.clear()
 
-    # === handlers kamu yang sudah ada ===
+# ===================== Main =====================
+def register_handlers(app):
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_cmd))
     app.add_handler(CommandHandler("preview", preview))
     app.add_handler(CommandHandler("batal", batal))
+    app.add_handler(CommandHandler("kembali", kembali))
+    app.add_handler(CommandHandler("ubah", ubah))
+    app.add_handler(CommandHandler("rekap", rekap))
+    app.add_handler(CommandHandler("isi", isi))
+    app.add_handler(CommandHandler("export", export_cmd))
+    app.add_handler(CommandHandler("area", area_cmd))
     app.add_handler(CallbackQueryHandler(on_start_laporan, pattern="^start_laporan$"))
     app.add_handler(CallbackQueryHandler(on_pilih_shift,   pattern="^shift_[12]$"))
     app.add_handler(CallbackQueryHandler(on_set_tanggal,   pattern="^tgl_(today|manual)$"))
     app.add_handler(CallbackQueryHandler(on_produk_choice, pattern="^produk_(yes|no)$"))
+    app.add_handler(CallbackQueryHandler(on_area_page,     pattern="^area:"))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, input_text))
 
-    if base_url:
-        # WEBHOOK (untuk Web Service gratis: Render/Koyeb)
-        path = token  # secret path
-        print(f"Webhook on 0.0.0.0:{port} → {base_url}/{path}")
-        app.run_webhook(
-            listen="0.0.0.0",
-            port=port,
-            url_path=path,
-            webhook_url=f"{base_url}/{path}",
-            drop_pending_updates=True,
-        )
-    else:
-        # POLLING (untuk lokal/VPS/worker)
-        print("Polling mode (no WEBHOOK_BASE_URL set).")
-        app.run_polling()
+    # Timing per handler (input_text per step), plus hitungan semua update di group -1
+    for group in app.handlers.values():
+        for h in group:
+            h.callback = timed(h.callback.__name__, h.callback, by_step=h.callback is input_text)
+    app.add_handler(TypeHandler(Update, count_update), group=-1)
 
+def build_app(token: str, api_base_url: Optional[str] = None, persistence=None, rate_limiter=None,
+              update_processor=None, sessions=None):
+    """Application lengkap dengan semua handler; dipakai main.py dan loadtest.py.
+    `sessions` (SharedSessions) butuh `update_processor`: lease + sinkronisasi sesi per update."""
+    builder = (ApplicationBuilder().token(token).post_init(post_init).post_shutdown(post_shutdown)
+               .request(InstrumentedRequest(connection_pool_size=256)))
+    if api_base_url: builder = builder.base_url(api_base_url)
+    if persistence is not None: builder = builder.persistence(persistence)
+    if rate_limiter is not None: builder = builder.rate_limiter(rate_limiter)
+    if update_processor is not None: builder = builder.concurrent_updates(update_processor)
+    app = builder.build()
+    if sessions is not None: _SESSIONS[app] = sessions
+    register_handlers(app)
+    ledger = UpdateLedger(sessions)
+    ledger.install(app)
+    IDLE.install(app)
+    if update_processor is not None: update_processor.attach(app, sessions, ledger)
+    FANOUT_PENDING.set_function(lambda: len(FANOUT))
+    SESSIONS_IN_MEMORY.set_function(lambda: len(app.user_data))
+    ACTIVE_SESSIONS.set_function(lambda: OPEN_SESSIONS)
+    if update_processor is not None:
+        UPDATES_PENDING.set_function(lambda: update_processor.pending)
+        UPDATES_RUNNING.set_function(lambda: update_processor.running)
+    return app
 
-if __name__ == "__main__":
-    main()
+def make_app(token: str):
+    """Application produksi dari environment; dipanggil main.py setelah port webhook di-bind."""
+    # Sesi laporan disimpan ke SQLite supaya tidak hilang saat restart/redeploy;
+    # semua pengiriman keluar lewat SendScheduler (flood limit Telegram, lane prioritas, retry 429);
+    # update antar user diproses paralel (MAX_CONCURRENT_UPDATES=1 → berurutan seperti dulu).
+    # SESSION_BACKEND di-set (beberapa replica di belakang load balancer) → sesi user
+    # dipegang backend bersama, persistence lokal hanya menyimpan bot_data/chat_data
+    concurrency = int(os.environ.get("MAX_CONCURRENT_UPDATES", "32"))
+    backend = os.environ.get("SESSION_BACKEND")
+    sessions = SharedSessions(backend_from_url(backend),
+                              ttl=float(os.environ.get("SESSION_LEASE_SEC", "30"))) if backend else None
+    return build_app(token,
+                     persistence=SQLitePersistence(os.environ.get("SESSION_DB", "sessions.db"),
+                                                   user_data=sessions is None),
+                     rate_limiter=SendScheduler(),
+                     update_processor=PerUserUpdateProcessor(
+                         concurrency, max_pending=int(os.environ.get("MAX_PENDING_UPDATES", "4096")))
+                     if concurrency > 1 or sessions else None,
+                     sessions=sessions)
@@ -0,0 +1,98 @@
+import re
+from typing import Dict, List, Tuple
+
+from helpers import parse_amount, valid_tanggal
+
+# ===================== Parser input sekaligus (bulk) =====================
+# Menerima blok "label : nilai" per baris — baik format bebas ("sales induk: 1.250.000")
+# maupun teks laporan hasil render_report yang di-paste ulang. Header bold (*VARIANCE*)
+# menentukan section, baris "Shift 1"/"Shift 2" tanpa nilai menentukan sub-shift.
+# Hasilnya dict key laporan -> nilai, plus daftar baris yang nilainya tidak valid.
+
+def _norm(label: str) -> str:
+    return re.sub(r"\s+", " ", label.replace("*", "").strip().lower())
+
+# Label datar (berlaku di luar section ber-shift)
+FLAT_AMOUNT = {
+    "sales": "total_sales", "total sales": "total_sales",
+    "sales induk": "sales_induk", "sales anak": "sales_anak",
+    "struk": "total_struk", "total struk": "total_struk",
+    "struk induk": "struk_induk", "struk anak": "struk_anak",
+    "mr.bread": "mrbread", "mr bread": "mrbread", "mrbread": "mrbread",
+    "prime bread": "primebread", "primebread": "primebread",
+    "telur": "telur",
+    "buah import": "buah_import", "buah lokal": "buah_lokal",
+    "struk induk shift 1": "trx_cpu_shift1_induk", "struk anak shift 1": "trx_cpu_shift1_anak",
+}
+FLAT_TEXT = {
+    "variance induk": "variance_induk", "variance anak": "variance_anak",  # shift aktif, di-resolve oleh pemanggil
+    "variance induk shift 1": "variance_shift1_induk", "variance anak shift 1": "variance_shift1_anak",
+    "variance induk shift 2": "variance_shift2_induk", "variance anak shift 2": "variance_shift2_anak",
+}
+
+# Section laporan -> prefix key untuk baris "Shift N : nilai"
+SECTION_PREFIX = {
+    "cancel sales": "cancel", "tertib setor": "tertib_setor", "jmlh trx tunai": "tunai",
+    "new member isaku": "isaku", "new member poinku": "poinku", "new member klik": "klik",
+    "store activity": "store_activity", "toko prima/kbk": "kbk",
+    "pelaksanaan pjr(scan itt)": "pjr", "qty itt": "itt",
+}
+# Section dengan sub-header Shift N lalu baris Induk/Anak
+SECTION_INDUK_ANAK = {"variance": ("variance_shift{}_{}", False), "jmlh trx cpu": ("trx_cpu_shift{}_{}", True)}
+
+_SHIFT_RE = re.compile(r"^shift\s*:?\s*0?([12])$")
+
+def parse_bulk(text: str, known_keys: Dict[str, bool] = None) -> Tuple[Dict[str, object], List[str]]:
+    """Parse blok teks → (nilai, error). `known_keys` = {key laporan mentah: angka?} yang
+    juga boleh dipakai langsung sebagai label (mis. "s1_struk_induk_for_s2: 100")."""
+    known_keys = known_keys or {}
+    values: Dict[str, object] = {}
+    errors: List[str] = []
+    section, sub = "", None
+
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line: continue
+        label, sep, value = (line.partition(":") if ":" in line else line.partition("="))
+        label, value = _norm(label), value.strip()
+
+        # " SHIFT 02" di header laporan / "shift: 2" — bukan sub-header Shift N di dalam section
+        m = _SHIFT_RE.match(_norm(line))
+        if m and section not in SECTION_PREFIX and section not in SECTION_INDUK_ANAK:
+            values["shift"] = m.group(1)
+            continue
+        if not sep:
+            if line.startswith("*") and line.endswith("*"):
+                section, sub = label, None
+            elif label in ("shift 1", "shift 2"):
+                sub = label[-1]
+            continue
+
+        key, amount = None, False
+        if label == "tanggal":
+            if valid_tanggal(value): values["tanggal"] = value
+            else: errors.append(f"Tanggal: {value or '(kosong)'}")
+            continue
+        if section in SECTION_INDUK_ANAK and sub and label in ("induk", "anak"):
+            fmt, amount = SECTION_INDUK_ANAK[section]
+            key = fmt.format(sub, label)
+        elif section in SECTION_PREFIX and label in ("shift 1", "shift 2"):
+            key = f"{SECTION_PREFIX[section]}_shift{label[-1]}"
+        elif label in FLAT_AMOUNT:
+            key, amount = FLAT_AMOUNT[label], True
+        elif label in FLAT_TEXT:
+            key = FLAT_TEXT[label]
+        elif label.replace(" ", "_") in known_keys:
+            key = label.replace(" ", "_")
+            amount = known_keys[key]
+        if key is None or value == "":
+            continue  # baris turunan (Total/Sisa/POIN/Target) atau kosong → diabaikan
+
+        if amount:
+            if not re.search(r"\d", value):
+                errors.append(line)
+                continue
+            values[key] = parse_amount(value)
+        else:
+            values[key] = value
+    return values, errors
@@ -0,0 +1,161 @@
+import asyncio, csv, hashlib, logging, os, tempfile
+from importlib.util import find_spec
+from datetime import date
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from history import ReportStore
+
+_LOGGER = logging.getLogger(__name__)
+
+# ===================== Export laporan ke CSV / XLSX =====================
+# Satu baris per laporan final terbaru (store, tanggal, shift). Baris dibaca dari
+# SQLite per batch dan langsung ditulis ke file di thread worker, jadi memori tetap
+# kecil walau rentangnya berbulan-bulan dan event loop tidak ikut tertahan.
+# File untuk periode yang sudah tutup (tanggal akhir < hari ini) disimpan di
+# EXPORT_DIR dan dipakai ulang; setelah terkirim sekali, file_id Telegram-nya juga
+# diingat sehingga export ulang tidak perlu upload lagi.
+# XLSX butuh openpyxl (opsional); tanpa itu hanya CSV yang tersedia. openpyxl baru
+# di-import saat export XLSX pertama (~100 ms) supaya tidak memperlambat cold start.
+
+FORMATS = ("csv", "xlsx") if find_spec("openpyxl") is not None else ("csv",)
+
+def _k(key):
+    return lambda d, s: d.get(key)
+
+def _sk(fmt):
+    # Key per shift: nilai shift laporan itu sendiri (bukan akumulasi dua shift)
+    return lambda d, s: d.get(fmt.format(s))
+
+# Kolom tetap sesudah Store/Tanggal/Shift/Dibuat
+COLUMNS = (
+    ("Sales", _k("total_sales")), ("Sales induk", _k("sales_induk")), ("Sales anak", _k("sales_anak")),
+    ("Struk", _k("total_struk")), ("Struk induk", _k("struk_induk")), ("Struk anak", _k("struk_anak")),
+    ("Mr.bread", _k("mrbread")), ("Prime bread", _k("primebread")), ("Telur", _k("telur")),
+    ("Buah import", _k("buah_import")), ("Buah lokal", _k("buah_lokal")), ("All produk", _k("all_produk")),
+    ("Variance induk", _sk("variance_shift{}_induk")), ("Variance anak", _sk("variance_shift{}_anak")),
+    ("Cancel", _sk("cancel_shift{}")), ("Tertib setor", _sk("tertib_setor_shift{}")),
+    ("TRX CPU induk", _sk("trx_cpu_shift{}_induk")), ("TRX CPU anak", _sk("trx_cpu_shift{}_anak")),
+    ("Trx tunai", _sk("tunai_shift{}")), ("Member ISAKU", _sk("isaku_shift{}")),
+    ("Member POINKU", _sk("poinku_shift{}")), ("Member KLIK", _sk("klik_shift{}")),
+    ("Store activity", _sk("store_activity_shift{}")), ("Toko prima/KBK", _sk("kbk_shift{}")),
+    ("PJR", _sk("pjr_shift{}")), ("Qty ITT", _sk("itt_shift{}")),
+)
+HEADER = ("Store", "Tanggal", "Shift", "Dibuat") + tuple(h for h, _ in COLUMNS)
+
+
+def iter_export_rows(history: ReportStore, stores: Optional[Sequence[str]], start: date, end: date):
+    for store, tanggal, shift, created, d in history.iter_range(stores, start, end):
+        yield (store, tanggal, shift, created) + tuple(
+            "" if (v := get(d, shift)) is None else v for _, get in COLUMNS)
+
+def _write_csv(rows, path: str) -> int:
+    n = 0
+    # utf-8-sig: Excel langsung mengenali encoding-nya
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        w = csv.writer(f)
+        w.writerow(HEADER)
+        for row in rows:
+            w.writerow(row); n += 1
+    return n
+
+def _write_xlsx(rows, path: str) -> int:
+    from openpyxl import Workbook
+    # write_only: baris langsung di-stream ke file sementara openpyxl, tidak disimpan di memori
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Laporan")
+    ws.append(HEADER)
+    n = 0
+    for row in rows:
+        ws.append(row); n += 1
+    wb.save(path)
+    return n
+
+def build_export(history: ReportStore, stores: Optional[Sequence[str]], start: date, end: date,
+                 fmt: str, path: str) -> int:
+    """Tulis export ke `path` (atomik lewat file .tmp); mengembalikan jumlah baris. Blocking."""
+    tmp = os.path.join(os.path.dirname(path), "." + os.path.basename(path) + ".tmp")
+    writer = _write_xlsx if fmt == "xlsx" else _write_csv
+    try:
+        n = writer(iter_export_rows(history, stores, start, end), tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+    return n
+
+
+class Artifact(NamedTuple):
+    path: str
+    filename: str
+    rows: int
+    file_id: Optional[str]   # terisi jika artefak ini pernah terkirim → kirim ulang tanpa upload
+    temporary: bool          # True → hapus setelah dikirim
+
+
+class ExportCache:
+    def __init__(self, directory: str = "exports", max_files: int = 100):
+        self.directory = directory
+        self.max_files = max_files
+        self._file_ids: Dict[str, str] = {}            # nama file -> file_id Telegram
+        self._building: Dict[str, asyncio.Future] = {}  # export identik yang sedang dibuat
+
+    @staticmethod
+    def filename(stores: Optional[Sequence[str]], start: date, end: date, fmt: str,
+                 version: Tuple[int, int]) -> str:
+        scope = "semua" if stores is None else "-".join(sorted(stores))
+        if len(scope) > 40:
+            scope = hashlib.sha1(scope.encode()).hexdigest()[:12]
+        return f"laporan_{scope}_{start:%Y%m%d}_{end:%Y%m%d}_v{version[0]}-{version[1]}.{fmt}"
+
+    async def get(self, history: ReportStore, stores: Optional[Sequence[str]], start: date, end: date,
+                  fmt: str, closed: bool) -> Optional["Artifact"]:
+        """Artefak export; None jika tidak ada laporan di rentang tsb."""
+        version = await asyncio.to_thread(history.range_version, stores, start, end)
+        if version[0] == 0:
+            return None
+        name = self.filename(stores, start, end, fmt, version)
+        if not closed:
+            # Periode berjalan: file sekali pakai, dihapus pemanggil setelah terkirim
+            os.makedirs(self.directory, exist_ok=True)
+            fd, path = tempfile.mkstemp(suffix="." + fmt, prefix=".open_", dir=self.directory)
+            os.close(fd)
+            n = await asyncio.to_thread(build_export, history, stores, start, end, fmt, path)
+            return Artifact(path, name, n, None, True)
+
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            os.utime(path)   # urutan LRU untuk _prune
+            return Artifact(path, name, version[0], self._file_ids.get(name), False)
+        fut = self._building.get(name)
+        if fut is None:
+            os.makedirs(self.directory, exist_ok=True)
+            fut = self._building[name] = asyncio.ensure_future(
+                self._build(history, stores, start, end, fmt, path))
+            fut.add_done_callback(lambda _: self._building.pop(name, None))
+        n = await asyncio.shield(fut)
+        return Artifact(path, name, n, None, False)
+
+    def remember(self, path: str, file_id: str):
+        self._file_ids[os.path.basename(path)] = file_id
+
+    async def _build(self, history: ReportStore, stores: Optional[Sequence[str]], start: date, end: date,
+                     fmt: str, path: str) -> int:
+        n = await asyncio.to_thread(build_export, history, stores, start, end, fmt, path)
+        # Scan direktori dan unlink juga di thread; file_id dibuang di event loop
+        for removed in await asyncio.to_thread(self._prune):
+            self._file_ids.pop(removed, None)
+        return n
+
+    def _prune(self) -> List[str]:
+        """Hapus file terlama di atas max_files (dipanggil di thread); mengembalikan nama yang dihapus."""
+        try:
+            files = [(e.stat().st_mtime, e) for e in os.scandir(self.directory)
+                     if e.is_file() and not e.name.startswith(".")]
+        except FileNotFoundError:
+            return []
+        files.sort(key=lambda f: f[0])
+        removed = []
+        for _, e in files[:max(0, len(files) - self.max_files)]:
+            try: os.remove(e.path)
+            except OSError: pass
+            removed.append(e.name)
+        return removed
@@ -0,0 +1,68 @@
+import asyncio, logging
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from telegram.error import Forbidden, TelegramError
+
+from sender import PRIORITY_BULK
+
+_LOGGER = logging.getLogger(__name__)
+
+# ===================== Fan-out bertahap (laporan ke grup, reminder) =====================
+# Pesan massal tidak dikirim langsung dari handler: masuk antrean lalu job repeating
+# JobQueue mengirim paling banyak `rate` pesan/detik (default jauh di bawah budget
+# global 30/s, jadi prompt kasir tetap lancar). Reminder ratusan store di jam tutup
+# shift tersebar beberapa detik, tidak meledak dalam satu tick.
+# Item dengan key sama yang belum terkirim digabung (isi terakhir menang), mis.
+# laporan yang direvisi lewat /ubah sebelum sempat diposting.
+
+class FanOut:
+    def __init__(self, rate: float = 8.0, tick: float = 1.0):
+        self.rate, self.tick = rate, tick
+        self._queue: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._seq = 0
+        self._budget = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.started = False   # tanpa JobQueue tidak ada yang mengirim → enqueue diabaikan
+
+    def __len__(self):
+        return len(self._queue)
+
+    def enqueue(self, chat_id, text: str, parse_mode: Optional[str] = None, key: Optional[Hashable] = None) -> bool:
+        if not self.started: return False
+        if key is None:
+            self._seq += 1
+            key = ("_", self._seq)
+        self._queue[key] = (chat_id, text, parse_mode)   # key yang sudah antre: posisi tetap, isi diganti
+        return True
+
+    def start(self, job_queue):
+        job_queue.run_repeating(self._run, interval=self.tick, first=self.tick, name="fanout")
+        self.started = True
+
+    async def _run(self, context):
+        if not self._queue:
+            self._budget = 0.0
+            return
+        self._budget = min(self.rate * self.tick, self._budget + self.rate * self.tick)
+        batch = []
+        while self._queue and self._budget >= 1:
+            batch.append(self._queue.popitem(last=False)[1])
+            self._budget -= 1
+        if not batch: return
+        extra: dict = {"rate_limit_args": {"priority": PRIORITY_BULK}} if context.bot.rate_limiter else {}
+        results = await asyncio.gather(
+            *(context.bot.send_message(chat_id, text, parse_mode=parse_mode, **extra)
+              for chat_id, text, parse_mode in batch), return_exceptions=True)
+        for (chat_id, _, _), r in zip(batch, results):
+            if isinstance(r, BaseException):
+                self.failed += 1
+                if isinstance(r, Forbidden):
+                    _LOGGER.warning("Fan-out ke chat %s ditolak (bot dikeluarkan/diblokir)", chat_id)
+                elif isinstance(r, TelegramError):
+                    _LOGGER.warning("Fan-out ke chat %s gagal: %s", chat_id, r)
+                else:
+                    _LOGGER.error("Fan-out ke chat %s gagal", chat_id, exc_info=r)
+            else:
+                self.sent += 1
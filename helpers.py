@@ -0,0 +1,37 @@
+import re
+from datetime import datetime
+from typing import Optional, Tuple
+
+# Helper murni (tanpa telegram) — dipakai bot.py dan modul pendukungnya
+def parse_amount(text: str) -> int:
+    if text is None: return 0
+    cleaned = re.sub(r"[^\d-]", "", str(text))
+    if cleaned in ("", "-"): return 0
+    try: return int(cleaned)
+    except Exception: return 0
+
+def fmt_id(num) -> str:
+    try: return f"{int(num):,}".replace(",", ".")
+    except Exception: return str(num or "")
+
+def valid_tanggal(s: str) -> bool:
+    try:
+        datetime.strptime(s, "%d/%m/%Y")
+        return True
+    except Exception:
+        return False
+
+def shift2digits(s: str) -> str:
+    try: return f"{int(s):02d}"
+    except Exception: return str(s or "01")
+
+_VARIANCE_RE = re.compile(r"([+-])?\s*(?:rp\.?\s*)?(\d[\d.,]*)", re.IGNORECASE)
+
+def parse_variance(text) -> Optional[Tuple[int, str]]:
+    """"+4.139 Dini" → (4139, "Dini"), "Agung -1.200" → (-1200, "Agung"); None jika tanpa angka."""
+    if text is None: return None
+    m = _VARIANCE_RE.search(str(text))
+    if not m: return None
+    amount = int(re.sub(r"\D", "", m.group(2)))
+    staff = re.sub(r"\s+", " ", (text[:m.start()] + " " + text[m.end():])).strip(" :,-")
+    return (-amount if m.group(1) == "-" else amount), staff
@@ -0,0 +1,404 @@
+import json, sqlite3, threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from helpers import parse_amount, parse_variance
+
+# ===================== Riwayat laporan final =====================
+# - `reports`: log append-only, setiap laporan final (termasuk revisi lewat /ubah)
+#   ditambahkan sebagai baris baru, tidak pernah di-UPDATE.
+# - `latest`: index (store, tanggal, shift) -> id laporan terbaru.
+# - `rollup`: agregat berjalan per (store, periode) untuk minggu ("2025-W34") dan
+#   bulan ("2025-08"). Diperbarui delta dalam transaksi yang sama saat append, jadi
+#   /rekap cukup membaca satu baris per periode — tidak pernah memindai riwayat.
+# - `variance`: akumulasi variance per (store, bulan, staff) — total minus, total plus,
+#   dan jumlah variance plus > VARIANCE_PLUS_BIG. Diperbarui dengan cara delta yang sama.
+# - `day_score` + `score`: skor KPI harian (kpi_score laporan) dan counter bulanan
+#   (jumlah hari, jumlah poin) untuk rata-rata bulan berjalan. Skor hari = laporan
+#   Shift 2 (sudah menggabungkan dua shift), atau Shift 1 selama Shift 2 belum ada.
+#   Baris `score` ada per minggu dan per bulan.
+# - `ranking`: index peringkat antar store per (periode, metrik) untuk /area, periode
+#   hari ("2025-08-17"), minggu dan bulan. Nilai metrik rollup + "days" (jumlah hari
+#   yang ada laporannya) diperbarui delta, "score" = rata-rata skor KPI periode tsb.
+#   Leaderboard = range scan index (period, metric, value): tidak bergantung panjang riwayat.
+
+# Kolom rollup -> fungsi ambil nilai dari laporan (nilai per shift, bukan kumulatif,
+# supaya Shift 1 + Shift 2 tidak terhitung dobel)
+METRICS = (
+    ("sales",  lambda d, s: d.get("total_sales")),
+    ("struk",  lambda d, s: d.get("total_struk")),
+    ("produk", lambda d, s: d.get("all_produk")),
+    ("cancel", lambda d, s: d.get(f"cancel_shift{s}")),
+    ("tunai",  lambda d, s: d.get(f"tunai_shift{s}")),
+    ("isaku",  lambda d, s: d.get(f"isaku_shift{s}")),
+    ("poinku", lambda d, s: d.get(f"poinku_shift{s}")),
+    ("klik",   lambda d, s: d.get(f"klik_shift{s}")),
+    ("itt",    lambda d, s: d.get(f"itt_shift{s}")),
+)
+METRIC_NAMES = tuple(m for m, _ in METRICS)
+RANK_METRICS = METRIC_NAMES + ("score", "days")
+
+VARIANCE_PLUS_BIG = 10_000
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS reports (
+    id      INTEGER PRIMARY KEY,
+    store   TEXT NOT NULL,
+    tanggal TEXT NOT NULL,   -- ISO yyyy-mm-dd
+    shift   TEXT NOT NULL,
+    created TEXT NOT NULL,
+    data    TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS latest (
+    store   TEXT NOT NULL,
+    tanggal TEXT NOT NULL,
+    shift   TEXT NOT NULL,
+    id      INTEGER NOT NULL,
+    PRIMARY KEY (store, tanggal, shift)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup (
+    store  TEXT NOT NULL,
+    period TEXT NOT NULL,
+    n      INTEGER NOT NULL DEFAULT 0,
+    {", ".join(f"{m} INTEGER NOT NULL DEFAULT 0" for m in METRIC_NAMES)},
+    PRIMARY KEY (store, period)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS variance (
+    store   TEXT NOT NULL,
+    period  TEXT NOT NULL,   -- bulan yyyy-mm
+    staff   TEXT NOT NULL,   -- nama lowercase
+    varmin  INTEGER NOT NULL DEFAULT 0,
+    varplus INTEGER NOT NULL DEFAULT 0,
+    big     INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (store, period, staff)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS day_score (
+    store   TEXT NOT NULL,
+    tanggal TEXT NOT NULL,
+    shift   TEXT NOT NULL,   -- laporan yang menentukan skor hari itu
+    poin    INTEGER NOT NULL,
+    PRIMARY KEY (store, tanggal)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS score (
+    store  TEXT NOT NULL,
+    period TEXT NOT NULL,   -- bulan yyyy-mm
+    days   INTEGER NOT NULL DEFAULT 0,
+    poin   INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (store, period)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ranking (
+    period TEXT NOT NULL,   -- hari yyyy-mm-dd, minggu yyyy-Www, bulan yyyy-mm
+    metric TEXT NOT NULL,
+    store  TEXT NOT NULL,
+    value  INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (period, metric, store)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ranking_value ON ranking (period, metric, value);
+"""
+
+def _num(v) -> int:
+    return v if isinstance(v, int) else parse_amount(v)
+
+def iso_tanggal(tanggal: str) -> str:
+    return datetime.strptime(tanggal, "%d/%m/%Y").date().isoformat()
+
+def periods(day: date) -> Tuple[str, str]:
+    """(minggu ISO, bulan) dari sebuah tanggal, mis. ("2025-W34", "2025-08")."""
+    y, w, _ = day.isocalendar()
+    return f"{y}-W{w:02d}", f"{day.year}-{day.month:02d}"
+
+def rank_periods(day: date) -> Tuple[str, str, str]:
+    """(hari, minggu, bulan) — periode index `ranking`."""
+    return (day.isoformat(),) + periods(day)
+
+def week_range(day: date) -> Tuple[date, date]:
+    start = day - timedelta(days=day.weekday())
+    return start, start + timedelta(days=6)
+
+def metric_values(d: dict) -> Tuple[int, ...]:
+    s = "1" if str(d.get("shift", "1")) == "1" else "2"
+    return tuple(_num(get(d, s)) for _, get in METRICS)
+
+def variance_entries(d: dict) -> List[Tuple[str, int]]:
+    """(staff lowercase, jumlah bertanda) untuk variance shift laporan ini saja —
+    variance Shift 1 yang ikut di laporan Shift 2 sudah dihitung di laporan Shift 1."""
+    s = "1" if str(d.get("shift", "1")) == "1" else "2"
+    out = []
+    for part in ("induk", "anak"):
+        v = parse_variance(d.get(f"variance_shift{s}_{part}"))
+        if v and v[0]:
+            out.append((v[1].lower(), v[0]))
+    return out
+
+def variance_delta(new: dict, old: Optional[dict] = None) -> Dict[str, List[int]]:
+    """staff -> [delta varmin, delta varplus, delta big] antara dua versi laporan."""
+    out: Dict[str, List[int]] = {}
+    for sign, d in ((1, new), (-1, old)):
+        if d is None: continue
+        for staff, amount in variance_entries(d):
+            acc = out.setdefault(staff, [0, 0, 0])
+            if amount < 0: acc[0] += sign * amount
+            else:
+                acc[1] += sign * amount
+                if amount > VARIANCE_PLUS_BIG: acc[2] += sign
+    return out
+
+
+class ReportStore:
+    def __init__(self, path: str = "reports.db"):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()  # dipanggil dari thread worker (asyncio.to_thread)
+        self.writes = 0   # naik setiap append; key cache nilai turunan (akumulasi, skor MTD)
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._migrate(conn)
+            self._conn = conn
+        return self._conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        # user_version 1: tabel variance diisi sekali dari laporan yang sudah ada
+        # user_version 2: skor mingguan + index ranking diisi sekali dari laporan yang sudah ada
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= 2: return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version < 1:
+                cur = conn.execute("SELECT l.store, l.tanggal, r.data FROM latest l JOIN reports r ON r.id = l.id")
+                for store, tanggal, data in cur:
+                    self._apply_variance(conn, store, tanggal[:7], variance_delta(json.loads(data)))
+            self._build_ranking(conn)
+            conn.execute("PRAGMA user_version = 2")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _build_ranking(self, conn: sqlite3.Connection):
+        cur = conn.execute("SELECT l.store, l.tanggal, r.data FROM latest l JOIN reports r ON r.id = l.id")
+        days = set()
+        for store, tanggal, data in cur.fetchall():
+            new_day = (store, tanggal) not in days
+            days.add((store, tanggal))
+            self._apply_rank(conn, store, date.fromisoformat(tanggal), metric_values(json.loads(data)), new_day)
+        for store, tanggal, shift, poin in conn.execute("SELECT store, tanggal, shift, poin FROM day_score").fetchall():
+            week = periods(date.fromisoformat(tanggal))[0]
+            conn.execute(
+                "INSERT INTO score (store, period, days, poin) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (store, period) DO UPDATE SET days = days + 1, poin = poin + excluded.poin",
+                (store, week, poin))
+            self._set_rank(conn, tanggal, "score", store, poin)
+        for store, period, n, poin in conn.execute("SELECT store, period, days, poin FROM score").fetchall():
+            if n: self._set_rank(conn, period, "score", store, round(poin / n))
+
+    def append(self, store: str, d: dict) -> int:
+        """Simpan laporan final; revisi untuk (store, tanggal, shift) yang sama menggantikan
+        kontribusi versi sebelumnya di rollup. Mengembalikan id baris baru."""
+        tanggal = iso_tanggal(d["tanggal"])
+        shift = "1" if str(d.get("shift", "1")) == "1" else "2"
+        new_vals = metric_values(d)
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                prev = db.execute(
+                    "SELECT r.data FROM latest l JOIN reports r ON r.id = l.id "
+                    "WHERE l.store=? AND l.tanggal=? AND l.shift=?", (store, tanggal, shift)).fetchone()
+                prev_d = json.loads(prev[0]) if prev else None
+                new_day = db.execute("SELECT 1 FROM latest WHERE store=? AND tanggal=? LIMIT 1",
+                                     (store, tanggal)).fetchone() is None
+                cur = db.execute(
+                    "INSERT INTO reports (store, tanggal, shift, created, data) VALUES (?, ?, ?, ?, ?)",
+                    (store, tanggal, shift, datetime.now().isoformat(timespec="seconds"),
+                     json.dumps(d, ensure_ascii=False)))
+                rid = cur.lastrowid
+                db.execute("INSERT OR REPLACE INTO latest (store, tanggal, shift, id) VALUES (?, ?, ?, ?)",
+                           (store, tanggal, shift, rid))
+
+                delta, dn = list(new_vals), 1
+                if prev_d is not None:
+                    delta = [a - b for a, b in zip(new_vals, metric_values(prev_d))]
+                    dn = 0
+                cols = ", ".join(METRIC_NAMES)
+                sets = ", ".join(f"{m} = {m} + excluded.{m}" for m in METRIC_NAMES)
+                for period in periods(date.fromisoformat(tanggal)):
+                    db.execute(
+                        f"INSERT INTO rollup (store, period, n, {cols}) VALUES (?, ?, ?, {', '.join('?' * len(delta))}) "
+                        f"ON CONFLICT (store, period) DO UPDATE SET n = n + excluded.n, {sets}",
+                        (store, period, dn, *delta))
+                self._apply_rank(db, store, date.fromisoformat(tanggal), delta, new_day)
+                self._apply_variance(db, store, periods(date.fromisoformat(tanggal))[1], variance_delta(d, prev_d))
+                if isinstance(d.get("kpi_score"), int):
+                    self._apply_score(db, store, tanggal, shift, d["kpi_score"])
+                db.execute("COMMIT")
+                self.writes += 1
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return rid
+
+    @staticmethod
+    def _set_rank(db, period: str, metric: str, store: str, value: int):
+        db.execute("INSERT OR REPLACE INTO ranking (period, metric, store, value) VALUES (?, ?, ?, ?)",
+                   (period, metric, store, value))
+
+    @staticmethod
+    def _apply_rank(db, store: str, day: date, delta: Sequence[int], new_day: bool):
+        # Hari pertama store di periode: semua metrik dibuat (nilai 0 tetap ikut peringkat)
+        rows = [(m, v) for m, v in zip(METRIC_NAMES, delta) if v or new_day] + ([("days", 1)] if new_day else [])
+        for period in rank_periods(day):
+            db.executemany(
+                "INSERT INTO ranking (period, metric, store, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (period, metric, store) DO UPDATE SET value = value + excluded.value",
+                [(period, m, store, v) for m, v in rows])
+
+    @staticmethod
+    def _apply_variance(db, store: str, month: str, delta: Dict[str, List[int]]):
+        for staff, (vmin, vplus, big) in delta.items():
+            if not (vmin or vplus or big): continue
+            db.execute(
+                "INSERT INTO variance (store, period, staff, varmin, varplus, big) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (store, period, staff) DO UPDATE SET varmin = varmin + excluded.varmin, "
+                "varplus = varplus + excluded.varplus, big = big + excluded.big",
+                (store, month, staff, vmin, vplus, big))
+
+    @staticmethod
+    def _day_score(db, store: str, tanggal: str, shift: str, poin: int) -> Optional[Tuple[int, int]]:
+        """(delta hari, delta poin) jika laporan `shift` dengan skor `poin` diarsipkan;
+        None jika skor hari itu sudah ditentukan laporan Shift 2."""
+        old = db.execute("SELECT shift, poin FROM day_score WHERE store=? AND tanggal=?",
+                         (store, tanggal)).fetchone()
+        if old is None: return 1, poin
+        if old[0] == "2" and shift == "1": return None
+        return 0, poin - old[1]
+
+    def _apply_score(self, db, store: str, tanggal: str, shift: str, poin: int):
+        delta = self._day_score(db, store, tanggal, shift, poin)
+        if delta is None: return
+        db.execute("INSERT OR REPLACE INTO day_score (store, tanggal, shift, poin) VALUES (?, ?, ?, ?)",
+                   (store, tanggal, shift, poin))
+        self._set_rank(db, tanggal, "score", store, poin)
+        for period in periods(date.fromisoformat(tanggal)):
+            days, total = db.execute(
+                "INSERT INTO score (store, period, days, poin) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (store, period) DO UPDATE SET days = days + excluded.days, poin = poin + excluded.poin "
+                "RETURNING days, poin", (store, period, *delta)).fetchall()[0]
+            if days: self._set_rank(db, period, "score", store, round(total / days))
+
+    def score_mtd(self, store: str, d: dict) -> Tuple[int, int]:
+        """(jumlah hari, jumlah poin) bulan laporan `d`, termasuk skor `d` sendiri —
+        dibaca dari counter `score`, tanpa memindai hari-hari sebelumnya."""
+        tanggal = iso_tanggal(d["tanggal"])
+        shift = "1" if str(d.get("shift", "1")) == "1" else "2"
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT days, poin FROM score WHERE store=? AND period=?",
+                             (store, tanggal[:7])).fetchone() or (0, 0)
+            delta = self._day_score(db, store, tanggal, shift, d["kpi_score"]) \
+                if isinstance(d.get("kpi_score"), int) else None
+        dn, dp = delta or (0, 0)
+        return row[0] + dn, row[1] + dp
+
+    def variance_totals(self, store: str, d: dict) -> Dict[str, List[int]]:
+        """Akumulasi variance bulan laporan `d` per staff: [varmin, varplus, big], termasuk
+        laporan `d` sendiri (menggantikan versi finalnya jika sudah pernah diarsipkan)."""
+        tanggal = iso_tanggal(d["tanggal"])
+        shift = "1" if str(d.get("shift", "1")) == "1" else "2"
+        with self._lock:
+            db = self._db()
+            rows = db.execute("SELECT staff, varmin, varplus, big FROM variance WHERE store=? AND period=?",
+                              (store, periods(date.fromisoformat(tanggal))[1])).fetchall()
+            prev = db.execute(
+                "SELECT r.data FROM latest l JOIN reports r ON r.id = l.id "
+                "WHERE l.store=? AND l.tanggal=? AND l.shift=?", (store, tanggal, shift)).fetchone()
+        totals = {staff: [vmin, vplus, big] for staff, vmin, vplus, big in rows}
+        for staff, delta in variance_delta(d, json.loads(prev[0]) if prev else None).items():
+            acc = totals.setdefault(staff, [0, 0, 0])
+            for i, v in enumerate(delta): acc[i] += v
+        return totals
+
+    def rollup(self, store: str, period: str) -> Dict[str, int]:
+        with self._lock:
+            row = self._db().execute(
+                f"SELECT n, {', '.join(METRIC_NAMES)} FROM rollup WHERE store=? AND period=?",
+                (store, period)).fetchone()
+        return dict(zip(("n",) + METRIC_NAMES, row or (0,) * (len(METRIC_NAMES) + 1)))
+
+    def leaderboard(self, period: str, metric: str, stores: Optional[Sequence[str]] = None,
+                    offset: int = 0, limit: int = 25, ascending: bool = False) -> Tuple[int, List[Tuple[str, int, int]]]:
+        """(jumlah store di peringkat, [(store, nilai, jumlah hari)]) untuk satu halaman,
+        urut nilai (terbaik dulu). `stores` None = semua store."""
+        where = "r.period=? AND r.metric=?"
+        args: list = [period, metric]
+        if stores is not None:
+            where += f" AND r.store IN ({', '.join('?' * len(stores))})"
+            args += stores
+        order = "ASC" if ascending else "DESC"
+        with self._lock:
+            db = self._db()
+            total = db.execute(f"SELECT COUNT(*) FROM ranking r WHERE {where}", args).fetchone()[0]
+            rows = db.execute(
+                f"SELECT r.store, r.value, COALESCE(d.value, 0) FROM ranking r "
+                f"LEFT JOIN ranking d ON d.period = r.period AND d.metric = 'days' AND d.store = r.store "
+                f"WHERE {where} ORDER BY r.value {order}, r.store LIMIT ? OFFSET ?",
+                (*args, limit, offset)).fetchall()
+        return total, rows
+
+    def reported(self, period: str, stores: Optional[Sequence[str]] = None) -> List[str]:
+        """Store yang punya laporan di periode tsb."""
+        where = "period=? AND metric='days'"
+        if stores is not None:
+            where += f" AND store IN ({', '.join('?' * len(stores))})"
+        with self._lock:
+            return [r[0] for r in self._db().execute(f"SELECT store FROM ranking WHERE {where}",
+                                                     (period, *(stores or ())))]
+
+    def get(self, store: str, tanggal: str, shift: str) -> Optional[dict]:
+        """Laporan final terbaru untuk (store, tanggal dd/mm/yyyy, shift), None jika belum ada."""
+        with self._lock:
+            row = self._db().execute(
+                "SELECT r.data FROM latest l JOIN reports r ON r.id = l.id "
+                "WHERE l.store=? AND l.tanggal=? AND l.shift=?",
+                (store, iso_tanggal(tanggal), str(shift))).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # ----- Export rentang tanggal -----
+    @staticmethod
+    def _range_where(stores: Optional[Sequence[str]]) -> str:
+        where = "l.tanggal BETWEEN ? AND ?"
+        if stores is not None:
+            where += f" AND l.store IN ({', '.join('?' * len(stores))})"
+        return where
+
+    def range_version(self, stores: Optional[Sequence[str]], start: date, end: date) -> Tuple[int, int]:
+        """(jumlah laporan, id terbesar) di rentang — berubah setiap ada laporan/revisi baru."""
+        args = (start.isoformat(), end.isoformat(), *(stores or ()))
+        with self._lock:
+            row = self._db().execute(
+                f"SELECT COUNT(*), COALESCE(MAX(l.id), 0) FROM latest l WHERE {self._range_where(stores)}",
+                args).fetchone()
+        return row[0], row[1]
+
+    def iter_range(self, stores: Optional[Sequence[str]], start: date, end: date,
+                   batch: int = 500) -> Iterator[Tuple[str, str, str, str, dict]]:
+        """Laporan terbaru per (store, tanggal, shift) di rentang, urut store/tanggal/shift:
+        (store, tanggal ISO, shift, created, data). `stores` None = semua store.
+        Pakai koneksi baca sendiri (WAL) supaya export panjang tidak menahan append."""
+        self._db()   # pastikan schema ada
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            cur = conn.execute(
+                "SELECT l.store, l.tanggal, l.shift, r.created, r.data FROM latest l "
+                f"JOIN reports r ON r.id = l.id WHERE {self._range_where(stores)} "
+                "ORDER BY l.store, l.tanggal, l.shift",
+                (start.isoformat(), end.isoformat(), *(stores or ())))
+            while rows := cur.fetchmany(batch):
+                for store, tanggal, shift, created, data in rows:
+                    yield store, tanggal, shift, created, json.loads(data)
+        finally:
+            conn.close()
@@ -0,0 +1,99 @@
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from helpers import parse_amount, parse_variance
+from stores import StoreConfig
+
+# ===================== Skor KPI =====================
+# Tiap KPI dideklarasikan sekali: jenis penilaian, bobot poin (cfg.poin), batas
+# target/budget (cfg.targets) dan key Total/Sisa di laporan. score_report()
+# menggabungkan input Shift 1 (+ Shift 2 untuk laporan Shift 2), mengisi Total/Sisa,
+# lalu menghitung skor 0–100 dari KPI yang bisa dinilai. Murni (tanpa I/O): akumulasi
+# bulanan skor disimpan history.py saat laporan diarsipkan.
+#
+# Jenis:
+#   target   — poin penuh jika total >= target; Sisa = target - total
+#   budget   — poin penuh jika total <= budget
+#   check    — poin penuh jika semua shift ✅; Total = poin didapat, Sisa = poin yang hilang
+#   variance — poin penuh jika tidak ada variance minus
+# KPI tanpa input (atau target/budget kosong di config) tidak ikut dinilai.
+
+CHECK = "✅"
+
+
+class KPI(NamedTuple):
+    name: str                    # prefix input per shift: f"{name}_shift{s}"
+    kind: str
+    poin: str                    # key di cfg.poin
+    limit: Optional[str] = None  # key di cfg.targets
+    total: Optional[str] = None  # key Total di laporan
+    sisa: Optional[str] = None   # key Sisa di laporan
+
+
+KPIS = (
+    KPI("variance",       "variance", "variance"),
+    KPI("cancel",         "budget",   "cancel",         "cancel", total="cancel_total"),
+    KPI("tertib_setor",   "check",    "tertib"),
+    KPI("tunai",          "target",   "tunai",          "tunai",  total="tunai_total",  sisa="tunai_sisa"),
+    KPI("isaku",          "target",   "isaku",          "isaku",  total="isaku_total",  sisa="isaku_sisa"),
+    KPI("poinku",         "target",   "poinku",         "poinku", total="poinku_total", sisa="poinku_sisa"),
+    KPI("klik",           "target",   "klik",           "klik",   total="klik_total",   sisa="klik_sisa"),
+    KPI("store_activity", "check",    "store_activity"),
+    KPI("kbk",            "check",    "kbk",                      total="kbk_total",    sisa="kbk_sisa"),
+    KPI("pjr",            "check",    "pjr"),
+    KPI("itt",            "budget",   "itt",            "itt",    total="itt_total"),
+)
+# Input Shift 1 yang ikut dibawa ke laporan Shift 2 (carry-over)
+SHIFT1_INPUT_KEYS = tuple(f"{k.name}_shift1" for k in KPIS if k.kind != "variance")
+
+
+def _blank(v) -> bool:
+    return v is None or v == ""
+
+def _shifts(d: dict) -> Tuple[str, ...]:
+    return ("1", "2") if str(d.get("shift", "1")) == "2" else ("1",)
+
+def _evaluate(k: KPI, d: dict, cfg: StoreConfig, shifts) -> Tuple[Optional[bool], Dict[str, object]]:
+    """(lulus? atau None jika tidak dinilai, nilai Total/Sisa untuk laporan)."""
+    weight = parse_amount(cfg.poin.get(k.poin))
+    if k.kind == "variance":
+        entries = [parse_variance(d.get(f"variance_shift{s}_{p}")) for s in shifts for p in ("induk", "anak")]
+        entries = [e for e in entries if e is not None]
+        return (all(a >= 0 for a, _ in entries) if entries else None), {}
+
+    values = [d.get(f"{k.name}_shift{s}") for s in shifts]
+    if all(_blank(v) for v in values):
+        return None, {}
+    if k.kind == "check":
+        ok = all(str(v).strip() == CHECK for v in values)
+        out = {}
+        if k.total: out[k.total] = weight if ok else 0
+        if k.sisa: out[k.sisa] = 0 if ok else weight
+        return ok, out
+
+    total = sum(parse_amount(v) for v in values if not _blank(v))
+    out = {k.total: total} if k.total else {}
+    limit = cfg.targets.get(k.limit, "")
+    if _blank(limit):
+        return None, out
+    limit = parse_amount(limit)
+    if k.kind == "target":
+        if k.sisa: out[k.sisa] = max(0, limit - total)
+        return total >= limit, out
+    return total <= limit, out
+
+
+def score_report(d: dict, cfg: StoreConfig) -> Dict[str, object]:
+    """Nilai turunan untuk laporan: Total/Sisa per KPI + kpi_score (0–100, None jika
+    belum ada KPI yang bisa dinilai)."""
+    shifts = _shifts(d)
+    out: Dict[str, object] = {}
+    earned = possible = 0
+    for k in KPIS:
+        ok, vals = _evaluate(k, d, cfg, shifts)
+        out.update(vals)
+        if ok is None: continue
+        weight = parse_amount(cfg.poin.get(k.poin))
+        possible += weight
+        if ok: earned += weight
+    out["kpi_score"] = round(100 * earned / possible) if possible else None
+    return out
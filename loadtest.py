@@ -0,0 +1,337 @@
+"""Load test offline: N kasir simulasi menjalankan alur Shift 1 / Shift 2 lengkap.
+
+Jalankan: python loadtest.py --users 200 [--shift2 0.5] [--rate-limit] [--ramp 0] [--s1-first] [--concurrency 32] [--api-delay 0.1] [--no-form] [--replicas 3]
+
+Bot dibangun dengan build_app() (handler yang sama persis dengan main()) plus
+post_init/post_shutdown asli (config store, FanOut, reminder, sweep sesi idle), dan
+bicara lewat polling ke server HTTP lokal yang meniru Bot API (getMe, getUpdates,
+setWebhook, deleteWebhook, sendMessage, editMessageText, answerCallbackQuery).
+Tidak ada koneksi jaringan keluar. Laporan akhir: latency p50/p95/p99 per step
+(update masuk → pesan balasan diterima server), updates/detik, memori per sesi
+aktif, jumlah API call keluar, pesan baru dan byte keluar per laporan
+(--no-form membandingkan dengan mode satu pesan per step).
+Setiap kasir harus menerima laporan final; jika ada yang tidak (error handler, balasan
+tidak datang dalam STEP_TIMEOUT) run gagal dengan exit code 1.
+--replicas N: N Application di belakang "load balancer" round-robin per update (update
+berurutan dari kasir yang sama jatuh ke replica berbeda), sesi lewat SharedSessions di
+satu file SQLite bersama.
+"""
+import argparse, asyncio, bisect, contextlib, email.policy, json, os, statistics, sys, tempfile, time
+from email.parser import BytesParser
+from collections import defaultdict
+from typing import Optional
+from urllib.parse import parse_qsl
+
+TOKEN = "123456:LOADTEST"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "KPI Bot", "username": "kpi_bot"}
+
+# (label step, jenis, isi) — label = step yang sedang dijawab user
+SHIFT1_FLOW = (
+    ("/start", "cmd", "/start"), ("start_laporan", "cb", "start_laporan"), ("pilih_shift", "cb", "shift_1"),
+    ("tanggal", "cb", "tgl_today"),
+    ("sales_induk", "text", "1.250.000"), ("sales_anak", "text", "300.000"),
+    ("struk_induk", "text", "310"), ("struk_anak", "text", "45"),
+    ("produk", "cb", "produk_yes"),
+    ("mrbread", "text", "125.000"), ("primebread", "text", "98.000"), ("telur", "text", "450.000"),
+    ("buah_import", "text", "1.200.000"), ("buah_lokal", "text", "340.000"),
+    ("variance_induk", "text", "+4.139 Dian"), ("variance_anak", "text", "+334 Rifa"),
+)
+# Step s1_* hanya dijawab jika bot memintanya (belum ada laporan Shift 1 untuk carry-over)
+SHIFT2_FLOW = (
+    ("/start", "cmd", "/start"), ("start_laporan", "cb", "start_laporan"), ("pilih_shift", "cb", "shift_2"),
+    ("tanggal", "cb", "tgl_today"),
+    ("s1_struk_induk_for_s2", "text", "380"), ("s1_struk_anak_for_s2", "text", "88"),
+    ("s1_variance_induk_for_s2", "text", "+4.139 Dian"), ("s1_variance_anak_for_s2", "text", "+334 Rifa"),
+    ("sales_induk", "text", "1.100.000"), ("sales_anak", "text", "250.000"),
+    ("struk_induk", "text", "290"), ("struk_anak", "text", "40"),
+    ("produk", "cb", "produk_no"),
+    ("variance_induk", "text", "-1.200 Agung"), ("variance_anak", "text", "+50 Putri"),
+)
+
+REPORT_MARK = "Monitoring *"   # baris judul laporan final (report_layout)
+STEP_TIMEOUT = 30.0            # detik menunggu balasan bot per step
+
+VISIBLE = {"sendMessage", "editMessageText", "editMessageReplyMarkup", "sendDocument"}
+
+
+# ===================== Fake Bot API =====================
+class FakeBotAPI:
+    def __init__(self, delay: float = 0.0, replicas: int = 1):
+        self.delay = delay           # latency tambahan per pesan keluar (meniru round trip ke Telegram)
+        self.updates = []            # semua update, index = update_id - 1
+        self.lanes = [[] for _ in range(replicas)]   # update_id per replica (round-robin)
+        self.new_update = asyncio.Event()
+        self.inbox = defaultdict(asyncio.Queue)   # chat_id -> pesan yang dikirim bot
+        self.calls = defaultdict(int)
+        self.bytes_out = 0           # ukuran body request pesan yang terlihat user (kirim/edit)
+        self.last_msg_id = {}        # chat_id -> message_id pesan bot terakhir
+        self._msg_seq = 0
+        self.port = None
+
+    async def start(self):
+        server = await asyncio.start_server(self._conn, "127.0.0.1", 0)
+        self.port = server.sockets[0].getsockname()[1]
+        self._server = server
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def push(self, update: dict):
+        update["update_id"] = len(self.updates) + 1
+        self.updates.append(update)
+        self.lanes[(update["update_id"] - 1) % len(self.lanes)].append(update["update_id"])
+        self.new_update.set()
+
+    async def _conn(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line: break
+                _, path, _ = line.decode().split(" ", 2)
+                headers = {}
+                while (h := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    k, _, v = h.decode().partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                params = self._params(body, headers.get("content-type", ""))
+                if path.rsplit("/", 1)[-1] in VISIBLE: self.bytes_out += len(body)
+                # Token replica: TOKEN-<n> (lihat replica_token)
+                lane = int(path.split("/")[1].rpartition("-")[2] or 0) if "-" in path.split("/")[1] else 0
+                result = await self._call(path.rsplit("/", 1)[-1], params, lane)
+                payload = json.dumps({"ok": True, "result": result}).encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: " + str(len(payload)).encode() + b"\r\n\r\n" + payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass  # koneksi ditutup klien / server dimatikan di akhir run
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _params(body: bytes, ctype: str) -> dict:
+        if not body: return {}
+        if "json" in ctype: return json.loads(body)
+        out = {}
+        if "multipart" in ctype:   # sendDocument: file sebagai bytes, field lain seperti biasa
+            msg = BytesParser(policy=email.policy.HTTP).parsebytes(b"Content-Type: " + ctype.encode() + b"\r\n\r\n" + body)
+            for part in msg.iter_parts():
+                name, raw = part.get_param("name", header="content-disposition"), part.get_payload(decode=True)
+                if part.get_filename(): out[name] = raw; continue
+                try: out[name] = json.loads(raw)
+                except ValueError: out[name] = raw.decode()
+            return out
+        for k, v in parse_qsl(body.decode(), keep_blank_values=True):
+            try: out[k] = json.loads(v)
+            except ValueError: out[k] = v
+        return out
+
+    def _message(self, chat_id, text, message_id=None):
+        if message_id is None:
+            self._msg_seq += 1
+            message_id = self._msg_seq
+        self.last_msg_id[chat_id] = message_id
+        return {"message_id": message_id, "date": int(time.time()), "text": text or "",
+                "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER}
+
+    async def _call(self, method: str, p: dict, lane: int = 0):
+        self.calls[method] += 1
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            offset = int(p.get("offset") or 1)
+            ids = self.lanes[lane]
+            if bisect.bisect_left(ids, offset) == len(ids):
+                self.new_update.clear()
+                try: await asyncio.wait_for(self.new_update.wait(), float(p.get("timeout") or 0) or 0.05)
+                except asyncio.TimeoutError: pass
+            i = bisect.bisect_left(ids, offset)
+            return [self.updates[u - 1] for u in ids[i:i + int(p.get("limit") or 100)]]
+        if method in ("setWebhook", "deleteWebhook", "answerCallbackQuery", "setMyCommands"):
+            return True
+        if method in VISIBLE:
+            if self.delay: await asyncio.sleep(self.delay)
+            chat_id = int(p["chat_id"])
+            msg = self._message(chat_id, p.get("text") or p.get("caption"), p.get("message_id"))
+            self.inbox[chat_id].put_nowait((method, time.perf_counter(), p.get("text") or ""))
+            return msg
+        return True
+
+
+def replica_token(i: int) -> str:
+    return TOKEN if i == 0 else f"{TOKEN}-{i}"
+
+
+# ===================== Kasir simulasi =====================
+def _user(uid):
+    return {"id": uid, "is_bot": False, "first_name": f"Kasir{uid}"}
+
+def make_update(api: FakeBotAPI, uid: int, kind: str, payload: str) -> dict:
+    chat = {"id": uid, "type": "private"}
+    if kind == "cb":
+        msg = {"message_id": api.last_msg_id.get(uid, 1), "date": int(time.time()), "chat": chat,
+               "from": BOT_USER, "text": "..."}
+        return {"callback_query": {"id": f"{uid}-{time.perf_counter_ns()}", "from": _user(uid),
+                                   "chat_instance": str(uid), "data": payload, "message": msg}}
+    msg = {"message_id": int(time.perf_counter_ns() % 2**31), "date": int(time.time()), "chat": chat,
+           "from": _user(uid), "text": payload}
+    if kind == "cmd":
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(payload.split()[0])}]
+    return {"message": msg}
+
+async def cashier(api: FakeBotAPI, uid: int, flow, latencies, delay: float) -> Optional[str]:
+    """Jalankan satu alur; None jika laporan final tercapai, selain itu alasan gagal."""
+    await asyncio.sleep(delay)
+    inbox = api.inbox[uid]
+    prompt = ""
+    for label, kind, payload in flow:
+        if label.startswith("s1_") and "Shift 1*" not in prompt:
+            continue
+        t0 = time.perf_counter()
+        api.push(make_update(api, uid, kind, payload))
+        try:
+            _, t1, prompt = await asyncio.wait_for(inbox.get(), STEP_TIMEOUT)
+        except asyncio.TimeoutError:
+            return f"tidak ada balasan untuk {label}"
+        latencies[label].append(t1 - t0)
+    if REPORT_MARK not in prompt:
+        return "balasan terakhir bukan laporan final: " + prompt.strip()[:80].replace("\n", " ")
+    return None
+
+
+# ===================== Ukuran sesi =====================
+def deep_size(obj, seen=None) -> int:
+    from report import Laporan
+    seen = seen if seen is not None else set()
+    if id(obj) in seen: return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(deep_size(v, seen) for v in obj)
+    elif isinstance(obj, Laporan):   # slot: nilai saja, key tidak disimpan per objek
+        size += sum(deep_size(v, seen) for v in obj.values()) + deep_size(obj._extra, seen)
+    return size
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def run(args):
+    tmp = tempfile.mkdtemp(prefix="kpi-loadtest-")
+    os.environ.setdefault("HISTORY_DB", os.path.join(tmp, "reports.db"))
+    os.environ.setdefault("STORES_FILE", os.path.join(tmp, "stores.json"))
+    os.environ["NO_PROXY"] = "127.0.0.1,localhost"   # server palsu lokal, jangan lewat proxy
+    import bot
+    from processor import PerUserUpdateProcessor
+    from sender import SendScheduler
+    from metrics import REPORTS_DONE
+    from persistence import SQLitePersistence
+    from sessions import SharedSessions, SQLiteSessionBackend
+
+    bot.FORM_MODE = not args.no_form
+    api = FakeBotAPI(args.api_delay, args.replicas)
+    await api.start()
+    shared = args.replicas > 1
+    # Tiap replica punya koneksi backend sendiri, seperti proses terpisah
+    sessions = [SharedSessions(SQLiteSessionBackend(os.path.join(tmp, "shared_sessions.db"))) if shared else None
+                for _ in range(args.replicas)]
+    apps = [bot.build_app(replica_token(i), api_base_url=f"http://127.0.0.1:{api.port}/bot",
+                          rate_limiter=SendScheduler() if args.rate_limit else None,
+                          update_processor=PerUserUpdateProcessor(args.concurrency)
+                          if args.concurrency > 1 or shared else None,
+                          sessions=sessions[i],
+                          persistence=SQLitePersistence(os.path.join(tmp, f"sessions-{i}.db"), user_data=not shared)
+                          if args.evict else None)
+            for i in range(args.replicas)]
+    if args.evict:
+        # Paling agresif: tiap sweep melepas semua sesi yang tidak antre/diproses di
+        # PerUserUpdateProcessor (tanpa processor hanya min_idle yang melindungi handler)
+        bot.IDLE.ttl, bot.IDLE.min_idle = 0.0, 0.0 if args.concurrency > 1 or shared else 1.0
+    latencies = defaultdict(list)
+    n2 = int(args.users * args.shift2)
+    flows = [SHIFT2_FLOW if i < n2 else SHIFT1_FLOW for i in range(args.users)]
+
+    failures = {}
+    async with contextlib.AsyncExitStack() as stack:
+        for app, app_sessions in zip(apps, sessions):
+            # Urutan seperti run_polling: initialize → post_init → start; post_shutdown paling akhir
+            stack.push_async_callback(app.post_shutdown, app)
+            await stack.enter_async_context(app)
+            await app.post_init(app)
+            await app.start()
+            await app.updater.start_polling(poll_interval=0, timeout=1)
+            if args.evict:
+                sweeper = asyncio.create_task(bot.IDLE.run(app, app_sessions, args.evict))
+                stack.callback(sweeper.cancel)
+        t0 = time.perf_counter()
+        # --s1-first: Shift 1 selesai dulu (seperti hari biasa) → Shift 2 memakai carry-over
+        waves = ([[i for i in range(args.users) if i >= n2], list(range(n2))] if args.s1_first
+                 else [list(range(args.users))])
+        for wave in waves:
+            results = await asyncio.gather(*(cashier(api, 1000 + i, flows[i], latencies,
+                                                     args.ramp * i / max(1, args.users)) for i in wave))
+            failures.update((1000 + i, r) for i, r in zip(wave, results) if r)
+        wall = time.perf_counter() - t0
+        n_sessions = sum(len(app.user_data) for app in apps)
+        session_bytes = sum(deep_size(dict(app.user_data)) for app in apps) / max(1, n_sessions)
+        for app in apps:
+            await app.updater.stop()
+            await app.stop()
+    await api.stop()
+
+    outbound = sum(v for k, v in api.calls.items() if k not in ("getUpdates", "getMe", "deleteWebhook", "setWebhook"))
+    print(f"users={args.users} shift2={n2} rate_limit={args.rate_limit} concurrency={args.concurrency} wall={wall:.2f}s")
+    print(f"updates/detik        : {len(api.updates) / wall:,.1f}")
+    print(f"memori per sesi      : {session_bytes / 1024:,.1f} KiB ({n_sessions} sesi)")
+    if args.evict:
+        print(f"sesi dilepas         : {bot.IDLE.evicted} (sweep tiap {args.evict}s), "
+              f"laporan selesai {int(REPORTS_DONE.total())}/{args.users}")
+    if shared:
+        hits, misses = sum(s.hits for s in sessions), sum(s.misses for s in sessions)
+        print(f"sesi bersama         : {args.replicas} replica, cache hit {hits}, muat ulang {misses}, "
+              f"konflik {sum(s.conflicts for s in sessions)}")
+    print(f"API call per laporan : {outbound / max(1, args.users):.1f}  {dict(api.calls)}")
+    print(f"pesan baru / laporan : {api.calls['sendMessage'] / max(1, args.users):.1f}, "
+          f"byte keluar / laporan : {api.bytes_out / max(1, args.users):,.0f} (form mode {bot.FORM_MODE})")
+    print(f"{'step':<26}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    order = list(dict.fromkeys(label for flow in (SHIFT2_FLOW, SHIFT1_FLOW) for label, _, _ in flow))
+    for label in order:
+        v = latencies.get(label)
+        if not v: continue
+        print(f"{label:<26}{len(v):>6}{pct(v, 50) * 1e3:>10.2f}{pct(v, 95) * 1e3:>10.2f}{pct(v, 99) * 1e3:>10.2f}")
+    allv = [x for v in latencies.values() for x in v]
+    print(f"{'SEMUA':<26}{len(allv):>6}{pct(allv, 50) * 1e3:>10.2f}{pct(allv, 95) * 1e3:>10.2f}"
+          f"{pct(allv, 99) * 1e3:>10.2f}  mean {statistics.mean(allv) * 1e3:.2f}")
+    if args.metrics:
+        import metrics
+        print(metrics.render(), end="")
+    done = int(REPORTS_DONE.total())
+    if failures or done < args.users:
+        print(f"GAGAL: {len(failures)} kasir tanpa laporan final, {done}/{args.users} laporan selesai")
+        for uid, reason in sorted(failures.items())[:10]:
+            print(f"  kasir {uid}: {reason}")
+        return 1
+    return 0
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=100)
+    ap.add_argument("--shift2", type=float, default=0.5, help="proporsi kasir Shift 2 (0..1)")
+    ap.add_argument("--ramp", type=float, default=0.0, help="detik untuk menyebar mulai kasir (0 = serentak)")
+    ap.add_argument("--rate-limit", action="store_true", help="pasang SendScheduler seperti produksi")
+    ap.add_argument("--api-delay", type=float, default=0.0, help="detik latency per sendMessage/edit di server palsu")
+    ap.add_argument("--s1-first", action="store_true", help="semua kasir Shift 1 selesai sebelum Shift 2 mulai")
+    ap.add_argument("--metrics", action="store_true", help="cetak isi /metrics di akhir run")
+    ap.add_argument("--no-form", action="store_true", help="FORM_MODE=0: satu pesan baru per step")
+    ap.add_argument("--concurrency", type=int, default=1, help="PerUserUpdateProcessor dengan N worker (1 = berurutan)")
+    ap.add_argument("--replicas", type=int, default=1, help="N replica berbagi sesi lewat SQLite (round-robin per update)")
+    ap.add_argument("--evict", type=float, default=0.0,
+                    help="sweep IdleSessions tiap N detik dengan TTL 0 (sesi di-spill ke persistence)")
+    sys.exit(asyncio.run(run(ap.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
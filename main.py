@@ -0,0 +1,46 @@
+"""Entry point: `python main.py`.
+
+Mode webhook bind port dulu (webhook.bind, tanpa telegram/tornado) baru mengimpor bot —
+import bot beserta telegram.ext, tornado, history, export, sessions makan ±300 ms dan
+health check platform (Render/Koyeb) sudah bisa connect selama itu.
+"""
+import asyncio, logging, os
+
+
+def main():
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+                        level=os.environ.get("LOG_LEVEL", "INFO"))
+    logging.getLogger("httpx").setLevel(logging.WARNING)   # satu baris per request terlalu ramai
+    token = os.environ.get("BOT_TOKEN")
+    if not token:
+        raise RuntimeError("Environment variable BOT_TOKEN belum di-set.")
+
+    base_url = os.environ.get("WEBHOOK_BASE_URL", "").rstrip("/")
+    port = int(os.environ.get("PORT", "10000"))
+
+    if base_url:
+        # WEBHOOK (untuk Web Service gratis: Render/Koyeb). Port di-bind sebelum app dibangun,
+        # update yang tertunda selama instance tidur diproses (tidak dibuang)
+        from metrics import metrics_route
+        from webhook import bind, serve_webhook
+        sock = bind("0.0.0.0", port)
+        path = token  # secret path
+        print(f"Webhook on 0.0.0.0:{port} → {base_url}/{path}")
+
+        def build():
+            import bot
+            return bot.make_app(token)
+
+        asyncio.run(serve_webhook(
+            build, "0.0.0.0", port, path, f"{base_url}/{path}", sock=sock,
+            extra_routes=[metrics_route(os.environ.get("METRICS_PATH", "/metrics"))]))
+    else:
+        # POLLING (untuk lokal/VPS/worker)
+        print("Polling mode (no WEBHOOK_BASE_URL set).")
+        import bot
+        bot.METRICS_LOG_SEC = float(os.environ.get("METRICS_LOG_SEC", "60"))
+        bot.make_app(token).run_polling()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import asyncio, bisect, logging, os
+from time import monotonic, perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+_LOGGER = logging.getLogger(__name__)
+
+# ===================== Metrics (format teks Prometheus) =====================
+# Counter/histogram minimal tanpa dependency: hot path cuma dict lookup + bisect,
+# orde 1 µs per observasi. Semua di event loop yang sama → tanpa lock.
+# Webhook: GET /metrics di port yang sama dengan webhook (metrics_route).
+# Polling: ringkasan periodik ke log (log_periodically).
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+_REGISTRY: List["_Metric"] = []
+
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: Tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra: parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, labels
+        _REGISTRY.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+    def samples(self) -> List[str]:
+        return []
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, n: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + n
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def samples(self):
+        return [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in self.values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        self.values: Dict[tuple, list] = {}   # labels -> [hitungan per bucket (+Inf terakhir), sum]
+
+    def observe(self, seconds: float, *labels):
+        v = self.values.get(labels)
+        if v is None:
+            v = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        v[bisect.bisect_left(self.buckets, seconds)] += 1
+        v[-1] += seconds
+
+    def merged(self) -> list:
+        out = [0] * (len(self.buckets) + 1)
+        for v in self.values.values():
+            for i in range(len(out)): out[i] += v[i]
+        return out
+
+    def quantile(self, q: float, counts: Optional[list] = None) -> float:
+        """Perkiraan kasar: batas atas bucket yang memuat kuantil q."""
+        counts = counts if counts is not None else self.merged()
+        n = sum(counts)
+        if not n: return 0.0
+        seen = 0
+        for i, c in enumerate(counts):
+            seen += c
+            if seen >= q * n:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def samples(self):
+        out = []
+        for k, v in self.values.items():
+            acc = 0
+            for b, c in zip(self.buckets + ("+Inf",), v):
+                acc += c
+                le = f'le="{b}"'
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, k, le)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, k)} {v[-1]}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, k)} {acc}")
+        return out
+
+
+class Gauge(_Metric):
+    """Nilai dihitung saat scrape lewat fungsi yang dipasang dengan set_function()."""
+    kind = "gauge"
+
+    def __init__(self, name, help):
+        super().__init__(name, help)
+        self.fn: Optional[Callable[[], float]] = None
+
+    def set_function(self, fn: Callable[[], float]):
+        self.fn = fn
+
+    def value(self) -> float:
+        if self.fn is None: return 0.0
+        try: return float(self.fn())
+        except Exception:
+            _LOGGER.exception("Gagal membaca gauge %s", self.name)
+            return float("nan")
+
+    def samples(self):
+        return [f"{self.name} {self.value()}"] if self.fn is not None else []
+
+
+def _process_age() -> float:
+    """Umur proses (detik) dari /proc — cold start dihitung sejak proses dibuat, termasuk
+    start interpreter dan import. 0 jika /proc tidak tersedia."""
+    try:
+        with open("/proc/self/stat") as f:
+            start = int(f.read().rsplit(")", 1)[1].split()[19])   # field 22: starttime (tick)
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class ColdStart(_Metric):
+    """Detik sejak proses dibuat sampai tiap fase start (port, siap, update/respons pertama)."""
+    kind = "gauge"
+
+    def __init__(self, name, help):
+        super().__init__(name, help, ("phase",))
+        self.origin = monotonic() - _process_age()
+        self.marks: Dict[str, float] = {}
+
+    def mark(self, phase: str):
+        if phase in self.marks: return
+        self.marks[phase] = monotonic() - self.origin
+        if phase == "first_response":
+            _LOGGER.info("cold start: %s", ", ".join(f"{k} {v:.2f}s" for k, v in self.marks.items()))
+
+    def samples(self):
+        return [f"{self.name}{_labels(self.labelnames, (k,))} {v}" for k, v in self.marks.items()]
+
+
+def render() -> str:
+    return "\n".join(line for m in _REGISTRY for line in m.render()) + "\n"
+
+
+# ----- Metrik bot -----
+UPDATES = Counter("kpi_updates_total", "Update Telegram yang diterima")
+HANDLER_SECONDS = Histogram("kpi_handler_seconds", "Durasi handler per step", ("handler", "step"))
+RENDER_SECONDS = Histogram("kpi_render_seconds", "Durasi render_report")
+API_SECONDS = Histogram("kpi_api_seconds", "Latency Bot API keluar per method", ("method",))
+API_ERRORS = Counter("kpi_api_errors_total", "Bot API error per method dan kode HTTP", ("method", "code"))
+API_RETRY_AFTER = Counter("kpi_api_retry_after_total", "Balasan 429 (flood limit) per method", ("method",))
+REPORTS_DONE = Counter("kpi_reports_completed_total", "Laporan final yang terkirim", ("shift",))
+REPORTS_ABANDONED = Counter("kpi_reports_abandoned_total", "Laporan yang ditinggal/di-reset per step", ("step",))
+ACTIVE_SESSIONS = Gauge("kpi_active_sessions", "Sesi dengan laporan yang sedang diisi")
+UPDATES_PENDING = Gauge("kpi_updates_pending", "Update yang menunggu diproses (PerUserUpdateProcessor)")
+UPDATES_RUNNING = Gauge("kpi_updates_running", "Update yang sedang diproses (PerUserUpdateProcessor)")
+FANOUT_PENDING = Gauge("kpi_fanout_pending", "Pesan fan-out (laporan ke grup, reminder) yang menunggu dikirim")
+SESSIONS_IN_MEMORY = Gauge("kpi_sessions_in_memory", "Sesi user_data yang ada di memori")
+SESSIONS_EVICTED = Counter("kpi_sessions_evicted_total", "Sesi idle yang dilepas dari memori (TTL/LRU)")
+UPDATES_DUPLICATE = Counter("kpi_updates_duplicate_total", "Update yang dilewati karena update_id sudah diproses")
+COLD_START = ColdStart("kpi_startup_seconds", "Detik sejak proses dibuat sampai fase start tercapai")
+
+# Method balasan ke user: yang pertama sukses setelah update pertama = time-to-first-response
+_RESPONSE_METHODS = frozenset(("sendMessage", "editMessageText", "answerCallbackQuery", "sendDocument"))
+
+
+def timed(name: str, fn, by_step: bool = False):
+    """Bungkus callback handler: catat durasi ke HANDLER_SECONDS (label step = step sebelum input)."""
+    async def wrapper(update, context):
+        step = (context.user_data or {}).get('step') if by_step else None
+        t0 = perf_counter()
+        try:
+            return await fn(update, context)
+        finally:
+            HANDLER_SECONDS.observe(perf_counter() - t0, name, step or "-")
+    wrapper.__name__ = getattr(fn, "__name__", name)
+    return wrapper
+
+async def count_update(update, context):
+    UPDATES.inc()
+    if "first_update" not in COLD_START.marks: COLD_START.mark("first_update")
+
+
+def _instrumented_request():
+    from telegram.request import HTTPXRequest
+
+    class InstrumentedRequest(HTTPXRequest):
+        """HTTPXRequest yang mencatat latency, error, dan 429 per method Bot API."""
+
+        async def do_request(self, url, method, *args, **kwargs):
+            api_method = url.rsplit("/", 1)[-1]
+            t0 = perf_counter()
+            try:
+                code, payload = await super().do_request(url, method, *args, **kwargs)
+            except Exception:
+                API_ERRORS.inc(api_method, "network")
+                raise
+            finally:
+                API_SECONDS.observe(perf_counter() - t0, api_method)
+            if code == 429:
+                API_RETRY_AFTER.inc(api_method)
+            if code >= 400:
+                API_ERRORS.inc(api_method, str(code))
+            elif api_method in _RESPONSE_METHODS and "first_update" in COLD_START.marks:
+                COLD_START.mark("first_response")
+            return code, payload
+
+    return InstrumentedRequest
+
+def __getattr__(name):
+    # InstrumentedRequest dibuat saat pertama diambil: telegram.request (httpx, ±60 ms) tidak
+    # ikut terimpor bersama metrics sebelum port webhook di-bind
+    if name == "InstrumentedRequest":
+        cls = globals()[name] = _instrumented_request()
+        return cls
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# ----- Ekspos -----
+def metrics_route(path: str = "/metrics"):
+    """Route tornado (path, handler) untuk GET `path`; dipasang di server webhook."""
+    import tornado.web
+
+    class MetricsHandler(tornado.web.RequestHandler):
+        def get(self):
+            self.set_header("Content-Type", CONTENT_TYPE)
+            self.write(render())
+
+    return path, MetricsHandler
+
+async def log_periodically(interval: float):
+    """Mode polling: ringkasan metrik ke log tiap `interval` detik."""
+    last_updates, last_handler = UPDATES.total(), HANDLER_SECONDS.merged()
+    last_api, last_err, last_429 = (sum(API_SECONDS.merged()), API_ERRORS.total(), API_RETRY_AFTER.total())
+    last_done, last_abandon = REPORTS_DONE.total(), REPORTS_ABANDONED.total()
+    while True:
+        await asyncio.sleep(interval)
+        handler = HANDLER_SECONDS.merged()
+        delta = [a - b for a, b in zip(handler, last_handler)]
+        api, err, r429 = sum(API_SECONDS.merged()), API_ERRORS.total(), API_RETRY_AFTER.total()
+        done, abandon = REPORTS_DONE.total(), REPORTS_ABANDONED.total()
+        _LOGGER.info(
+            "metrics: %.1f update/s, handler p50<=%.0fms p95<=%.0fms, api %d call (%d error, %d 429), "
+            "%d sesi aktif, %d laporan selesai, %d ditinggal",
+            (UPDATES.total() - last_updates) / interval,
+            HANDLER_SECONDS.quantile(.5, delta) * 1e3, HANDLER_SECONDS.quantile(.95, delta) * 1e3,
+            api - last_api, err - last_err, r429 - last_429,
+            ACTIVE_SESSIONS.value(), done - last_done, abandon - last_abandon)
+        last_updates, last_handler = UPDATES.total(), handler
+        last_api, last_err, last_429, last_done, last_abandon = api, err, r429, done, abandon
@@ -0,0 +1,225 @@
+import asyncio, json, logging, sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from report import json_default, json_object_hook, stored_open
+
+# ===================== SQLite persistence (write-behind) =====================
+# - File SQLite lokal mode WAL. Semua I/O jalan di SATU thread worker khusus, jadi
+#   urutan baca/tulis FIFO terjaga dan event loop tidak pernah menunggu disk.
+# - update_* hanya menaruh data ter-serialisasi ke buffer `_pending` (per key, yang
+#   terakhir menang); buffer ditulis sekaligus dalam satu transaksi tiap flush_interval.
+# - Sesi user/chat di-load malas: get_user_data() tidak membaca apa pun, data user baru
+#   dibaca dari DB saat update pertamanya lewat refresh_user_data().
+# - Key user_data/chat_data berawalan "_" dianggap cache sementara, tidak disimpan.
+# - Laporan (report.py) disimpan dalam bentuk ringkasnya.
+# - spill(): sesi yang di-evict dari memori (sessions.IdleSessions) ditulis ke buffer dan
+#   dibaca ulang pada update berikutnya. Eviction memakai Application.drop_user_data(), jadi
+#   drop_user_data() sesudahnya untuk user itu bukan hapus: diabaikan, atau — jika user
+#   sudah kembali sebelum flush PTB (yang melewati update user yang di-drop) — isi dict
+#   aktifnya yang ditulis.
+# - all_user_data(): semua sesi tersimpan (DB + buffer), untuk job yang menyapu semua
+#   sesi — user_data di memori hanya berisi user yang sudah di-load dan belum di-evict.
+# - Kolom `open` (laporan sedang diisi, report.stored_open) diisi saat baris user ditulis di
+#   thread worker; count_open() menghitungnya lewat index tanpa decode sesi satu per satu.
+
+_LOGGER = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    kind TEXT NOT NULL,
+    key  TEXT NOT NULL,
+    data TEXT NOT NULL,
+    open INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (kind, key)
+) WITHOUT ROWID
+"""
+_INDEX = "CREATE INDEX IF NOT EXISTS kv_open ON kv (kind, open)"
+
+def _dumps(data) -> str:
+    if isinstance(data, dict):
+        data = {k: v for k, v in data.items() if not (isinstance(k, str) and k.startswith("_"))}
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=json_default)
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, path: str = "sessions.db", flush_interval: float = 2.0, update_interval: float = 5,
+                 user_data: bool = True):
+        # callback_data butuh arbitrary_callback_data, bot ini tidak memakainya;
+        # user_data=False saat sesi dipegang backend bersama (sessions.py)
+        super().__init__(store_data=PersistenceInput(user_data=user_data, callback_data=False),
+                         update_interval=update_interval)
+        self.path = path
+        self.flush_interval = flush_interval
+        self._conn: Optional[sqlite3.Connection] = None
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-persistence")
+        self._pending: Dict[tuple, Optional[str]] = {}  # (kind, key) -> json | None (hapus)
+        self._loaded = {"user": set(), "chat": set()}
+        self._evicted: Dict[int, Optional[dict]] = {}   # user -> user_data aktif jika sudah di-load lagi
+        self._flush_task: Optional[asyncio.Task] = None
+
+    # ----- SQLite (hanya dipanggil dari thread worker) -----
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(_SCHEMA)
+            if "open" not in {row[1] for row in conn.execute("PRAGMA table_info(kv)")}:
+                # DB dari versi sebelum kolom open: flag diisi sekali dari sesi yang ada
+                rows = conn.execute("SELECT key, data FROM kv WHERE kind='user'").fetchall()
+                conn.execute("ALTER TABLE kv ADD COLUMN open INTEGER NOT NULL DEFAULT 0")
+                conn.executemany("UPDATE kv SET open=1 WHERE kind='user' AND key=?",
+                                 [(key,) for key, data in rows if stored_open(data)])
+            conn.execute(_INDEX)
+            self._conn = conn
+        return self._conn
+
+    def _read(self, kind: str, key: str) -> Optional[str]:
+        row = self._db().execute("SELECT data FROM kv WHERE kind=? AND key=?", (kind, key)).fetchone()
+        return row[0] if row else None
+
+    def _read_kind(self, kind: str) -> Dict[str, str]:
+        return dict(self._db().execute("SELECT key, data FROM kv WHERE kind=?", (kind,)))
+
+    def _write(self, batch: Dict[tuple, Optional[str]]):
+        upserts = [(kind, key, data, kind == "user" and stored_open(data))
+                   for (kind, key), data in batch.items() if data is not None]
+        deletes = [(kind, key) for (kind, key), data in batch.items() if data is None]
+        db = self._db()
+        db.execute("BEGIN")
+        try:
+            db.executemany("INSERT OR REPLACE INTO kv (kind, key, data, open) VALUES (?, ?, ?, ?)", upserts)
+            db.executemany("DELETE FROM kv WHERE kind=? AND key=?", deletes)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def _count_open(self) -> int:
+        return self._db().execute("SELECT COUNT(*) FROM kv WHERE kind='user' AND open=1").fetchone()[0]
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _run(self, fn, *args):
+        # shield: pembatalan task pemanggil tidak membatalkan job yang sudah antre di worker
+        return asyncio.shield(asyncio.get_running_loop().run_in_executor(self._io, fn, *args))
+
+    # ----- Buffer write-behind -----
+    def _put(self, kind: str, key, data: Optional[str]):
+        self._pending[(kind, str(key))] = data
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await self._write_pending()
+        except Exception:
+            _LOGGER.exception("Gagal menulis sesi ke %s, dicoba lagi di flush berikutnya", self.path)
+
+    async def _write_pending(self):
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        try:
+            await self._run(self._write, batch)
+        except Exception:
+            # Kembalikan ke buffer (tanpa menimpa data yang lebih baru) untuk dicoba lagi
+            for k, v in batch.items():
+                self._pending.setdefault(k, v)
+            raise
+
+    async def _load_into(self, kind: str, key: int, target: dict):
+        if key in self._loaded[kind]:
+            return
+        self._loaded[kind].add(key)
+        if kind == "user" and key in self._evicted:
+            self._evicted[key] = target
+        pk = (kind, str(key))
+        data = self._pending[pk] if pk in self._pending else await self._run(self._read, kind, str(key))
+        if data:
+            target.update(json.loads(data, object_hook=json_object_hook))
+
+    # ----- BasePersistence -----
+    async def get_user_data(self) -> Dict[int, dict]:
+        return {}  # lazy: lihat refresh_user_data
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}  # lazy: lihat refresh_chat_data
+
+    async def get_bot_data(self) -> dict:
+        data = await self._run(self._read, "bot", "")
+        return json.loads(data) if data else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = await self._run(self._read_kind, f"conv:{name}")
+        return {tuple(json.loads(k)): json.loads(v) for k, v in rows.items()}
+
+    async def update_conversation(self, name: str, key, new_state):
+        self._put(f"conv:{name}", json.dumps(list(key)), None if new_state is None else json.dumps(new_state))
+
+    async def update_user_data(self, user_id: int, data: dict):
+        self._put("user", user_id, _dumps(data))
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        self._put("chat", chat_id, _dumps(data))
+
+    async def update_bot_data(self, data: dict):
+        self._put("bot", "", _dumps(data))
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id: int):
+        if user_id in self._evicted:
+            live = self._evicted.pop(user_id)
+            if live is not None: self._put("user", user_id, _dumps(live))
+            return
+        self._put("user", user_id, None)
+
+    async def drop_chat_data(self, chat_id: int):
+        self._put("chat", chat_id, None)
+
+    async def all_user_data(self) -> Dict[int, dict]:
+        # Buffer disalin sebelum baca DB: batch yang di-flush sesudahnya ada di salinan,
+        # yang sebelumnya sudah antre di worker sebelum pembacaan ini
+        pending = {k: v for (kind, k), v in self._pending.items() if kind == "user"}
+        rows = await self._run(self._read_kind, "user")
+        rows.update(pending)
+        rows.update({k: v for (kind, k), v in self._pending.items() if kind == "user"})
+        return {int(k): json.loads(v, object_hook=json_object_hook) for k, v in rows.items() if v}
+
+    async def count_open(self) -> int:
+        """Sesi tersimpan dengan laporan terbuka; yang masih di buffer ikut setelah flush berikutnya."""
+        return await self._run(self._count_open)
+
+    def spill(self, user_id: int, data: dict):
+        """Dipanggil sebelum Application.drop_user_data(user_id) saat sesi dilepas dari memori."""
+        self._put("user", user_id, _dumps(data))
+        self._loaded["user"].discard(user_id)
+        self._evicted[user_id] = None
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        await self._load_into("user", user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        await self._load_into("chat", chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
+
+    async def flush(self):
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self._write_pending()
+        await self._run(self._close)
@@ -0,0 +1,130 @@
+import asyncio, logging
+from typing import Any, Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+_LOGGER = logging.getLogger(__name__)
+
+# ===================== Pemrosesan update paralel per user =====================
+# Update dari user/chat berbeda diproses paralel (maksimal `concurrency` sekaligus),
+# update dari user yang sama tetap berurutan karena state machine `step` di
+# user_data bergantung pada urutan input.
+#
+# Urutan penguncian: lock per user DULU, baru slot worker. Jadi satu user yang
+# mengirim banyak pesan tidak menghabiskan slot worker selagi menunggu gilirannya.
+# Semaphore bawaan BaseUpdateProcessor dipakai sebagai batas total update yang
+# boleh menunggu (concurrency + max_pending).
+#
+# Backpressure: `pending` = update yang sudah diterima (process_update) tapi belum mulai
+# diproses: menunggu semaphore bawaan, lock user, lease atau slot worker. Melewati high_watermark → `overloaded` True (+ log warning); turun lagi di bawah
+# separuhnya → False.
+#
+# Multi-replica (sessions.py): dengan `sessions`, setiap update user dibungkus lease +
+# sinkronisasi versi sesi di backend bersama, di dalam lock per user lokal dan sebelum
+# slot worker (menunggu lease replica lain tidak memakan slot).
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, concurrency: int = 32, max_pending: int = 4096, high_watermark: Optional[int] = None):
+        super().__init__(max_concurrent_updates=concurrency + max_pending)
+        self.sessions = None
+        self.ledger = None
+        self._app = None
+        self.concurrency = concurrency
+        self.high_watermark = high_watermark or max(1, max_pending // 2)
+        self.pending = 0
+        self.running = 0
+        self.overloaded = False
+        self._workers = asyncio.Semaphore(concurrency)
+        self._keys: Dict[Any, List] = {}   # key -> [Lock, jumlah update yang memakai lock]
+
+    @staticmethod
+    def _key(update: object):
+        if isinstance(update, Update):
+            if update.effective_user: return ("u", update.effective_user.id)
+            if update.effective_chat: return ("c", update.effective_chat.id)
+        return None
+
+    def attach(self, app, sessions=None, ledger=None):
+        # user_data hanya bisa diambil lewat Application; dipanggil dari build_app
+        self._app, self.sessions, self.ledger = app, sessions, ledger
+
+    def busy(self, user_id: int) -> bool:
+        """True jika ada update user ini yang antre/diproses (sessions.IdleSessions tidak melepasnya)."""
+        return ("u", user_id) in self._keys
+
+    def _pressure(self):
+        if not self.overloaded and self.pending >= self.high_watermark:
+            self.overloaded = True
+            _LOGGER.warning("Antrean update penuh: %d menunggu, %d diproses", self.pending, self.running)
+        elif self.overloaded and self.pending <= self.high_watermark // 2:
+            self.overloaded = False
+            _LOGGER.info("Antrean update normal lagi: %d menunggu", self.pending)
+
+    async def process_update(self, update: object, coroutine) -> None:
+        # id dicatat ke ledger saat diterima, sebelum menunggu lock user/lease/slot worker,
+        # supaya hwm ledger tidak melewati update yang masih antre
+        update_id = update.update_id if self.ledger is not None and isinstance(update, Update) else None
+        if update_id is not None: self.ledger.receive(update_id)
+        started = False
+
+        async def run():
+            nonlocal started
+            started = True
+            self.pending -= 1
+            self._pressure()
+            await coroutine
+
+        wrapped = run()
+        self.pending += 1
+        self._pressure()
+        try:
+            await super().process_update(update, wrapped)
+        finally:
+            if not started:
+                self.pending -= 1
+                self._pressure()
+                wrapped.close()
+                if asyncio.iscoroutine(coroutine): coroutine.close()
+            if update_id is not None: self.ledger.release(update_id)
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = self._key(update)
+        entry = None
+        if key is not None:
+            entry = self._keys.get(key)
+            if entry is None:
+                entry = self._keys[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+        started = False
+        try:
+            if entry: await entry[0].acquire()
+            shared = None
+            try:
+                if self.sessions is not None and self._app is not None and key and key[0] == "u":
+                    ud = self._app.user_data[key[1]]
+                    await self.sessions.enter(key[1], ud)
+                    shared = (key[1], ud)
+                async with self._workers:
+                    started = True
+                    self.running += 1
+                    try:
+                        await coroutine
+                    finally:
+                        self.running -= 1
+            finally:
+                try:
+                    if shared: await self.sessions.exit(*shared)
+                finally:
+                    if entry: entry[0].release()
+        finally:
+            if not started and asyncio.iscoroutine(coroutine): coroutine.close()
+            if entry:
+                entry[1] -= 1
+                if entry[1] == 0: del self._keys[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,187 @@
+import json
+from collections.abc import MutableMapping
+from copy import deepcopy
+from typing import Tuple
+
+# ===================== Model laporan yang sedang diisi =====================
+# Dulu dict biasa: ~90 key string per sesi, hash table dict dan pointer key dibayar
+# per sesi. Laporan menyimpan field tetap sebagai __slots__ (tanpa dict per objek; field
+# yang belum diisi berisi UNSET — bukan slot kosong, supaya baca slot tidak pernah
+# melempar AttributeError yang mahal di renderer ter-compile), key dinamis per staff (varmin_<nama>,
+# variance_plus_<nama>) di `_extra`. Antarmuka mapping (get / [] / in / update / pop)
+# sama dengan dict, jadi step graph, renderer ter-compile dan kpi.py bekerja langsung.
+#
+# Serialisasi ringkas (persistence, sesi bersama): [bitmask slot terisi, [nilai...], extra?]
+# tanpa nama key. Urutan FIELDS bagian dari format → field baru hanya ditambah di AKHIR.
+# Tipe per field: int untuk angka hasil parse_amount/turunannya, str untuk teks apa adanya
+# (variance, ✅, nilai turunan yang sudah diformat fmt_id).
+
+_KPI_FIELDS = tuple(
+    (f"{name}_{suffix}", str)
+    for name, suffixes in (
+        ("cancel", ("poin", "budget", "shift1", "shift2", "total")),
+        ("tertib", ("poin",)),
+        ("tertib_setor", ("shift1", "shift2")),
+        ("tunai", ("poin", "target", "shift1", "shift2", "total", "sisa")),
+        ("isaku", ("poin", "target", "shift1", "shift2", "total", "sisa")),
+        ("poinku", ("poin", "target", "shift1", "shift2", "total", "sisa")),
+        ("klik", ("poin", "target", "shift1", "shift2", "total", "sisa")),
+        ("store_activity", ("poin", "shift1", "shift2")),
+        ("kbk", ("poin", "shift1", "shift2", "total", "sisa")),
+        ("pjr", ("target", "poin", "shift1", "shift2")),
+        ("itt", ("poin", "budget", "shift1", "shift2", "total")),
+    )
+    for suffix in suffixes)
+
+FIELDS: Tuple[Tuple[str, type], ...] = (
+    # --- Identitas ---
+    ("store_code", str), ("shift", str), ("tanggal", str), ("store", str), ("kpi_title", str),
+    # --- Sales & struk ---
+    ("sales_induk", int), ("sales_anak", int), ("total_sales", int),
+    ("struk_induk", int), ("struk_anak", int), ("total_struk", int),
+    ("s1_struk_induk_for_s2", int), ("s1_struk_anak_for_s2", int),
+    ("trx_cpu_shift1_induk", int), ("trx_cpu_shift1_anak", int),
+    ("trx_cpu_shift2_induk", int), ("trx_cpu_shift2_anak", int),
+    ("cpu_50_left", str), ("cpu_50_right", str),
+    # --- Produk khusus ---
+    ("mrbread", int), ("primebread", int), ("telur", int), ("buah_import", int), ("buah_lokal", int),
+    ("all_produk", int),
+    # --- Variance ---
+    ("variance_shift1_induk", str), ("variance_shift1_anak", str),
+    ("variance_shift2_induk", str), ("variance_shift2_anak", str),
+    ("variance_poin", str), ("variance_plus_total_gt10k", str), ("total_varmin", str), ("total_varplus", str),
+    # --- KPI ---
+    *_KPI_FIELDS,
+    ("kpi_score", int), ("kpi_score_mtd", int),
+)
+_NAMES = tuple(name for name, _ in FIELDS)
+_SLOTS = frozenset(_NAMES)
+STATE_KEY = "$laporan"
+_MISSING = object()
+
+
+class _Unset:
+    __slots__ = ()
+    def __repr__(self): return "UNSET"
+    def __reduce__(self): return "UNSET"
+
+
+UNSET = _Unset()
+
+
+class Laporan(MutableMapping):
+    __slots__ = _NAMES + ("_extra",)
+    __annotations__ = dict(FIELDS)
+
+    def __init__(self, data=(), **kwargs):
+        self._clear()
+        if data: self.update(data)
+        if kwargs: self.update(kwargs)
+
+    def _clear(self):
+        for name in _NAMES: setattr(self, name, UNSET)
+        self._extra = None
+
+    # ----- Mapping -----
+    def get(self, key, default=None):
+        if key in _SLOTS:
+            v = getattr(self, key)
+            return default if v is UNSET else v
+        return self._extra.get(key, default) if self._extra else default
+
+    def __getitem__(self, key):
+        v = self.get(key, _MISSING)
+        if v is _MISSING: raise KeyError(key)
+        return v
+
+    def __setitem__(self, key, value):
+        if key in _SLOTS:
+            setattr(self, key, value)
+        elif self._extra is None:
+            self._extra = {key: value}
+        else:
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in _SLOTS:
+            if getattr(self, key) is UNSET: raise KeyError(key)
+            setattr(self, key, UNSET)
+        elif self._extra and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in _SLOTS: return getattr(self, key) is not UNSET
+        return bool(self._extra) and key in self._extra
+
+    def __iter__(self):
+        for name in _NAMES:
+            if getattr(self, name) is not UNSET: yield name
+        if self._extra: yield from list(self._extra)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"Laporan({dict(self)!r})"
+
+    def __copy__(self):
+        return Laporan.from_state(self.to_state())
+
+    def __deepcopy__(self, memo):
+        # Nilai slot str/int (immutable); hanya extra yang perlu disalin dalam
+        new = Laporan.from_state(self.to_state())
+        if new._extra: new._extra = deepcopy(new._extra, memo)
+        return new
+
+    copy = __copy__
+
+    # ----- Serialisasi ringkas -----
+    def to_state(self) -> list:
+        mask, values = 0, []
+        for i, name in enumerate(_NAMES):
+            v = getattr(self, name)
+            if v is not UNSET:
+                mask |= 1 << i
+                values.append(v)
+        return [mask, values, self._extra] if self._extra else [mask, values]
+
+    @classmethod
+    def from_state(cls, state: list) -> "Laporan":
+        self = cls.__new__(cls)
+        self._clear()
+        self._extra = dict(state[2]) if len(state) > 2 and state[2] else None
+        mask, values = state[0], iter(state[1])
+        i = 0
+        while mask:
+            if mask & 1: setattr(self, _NAMES[i], next(values))
+            mask >>= 1
+            i += 1
+        return self
+
+
+assert not _SLOTS & set(dir(MutableMapping)), "nama field bentrok dengan method mapping"
+
+
+def json_default(o):
+    """`default=` untuk json.dumps user_data yang berisi Laporan."""
+    if isinstance(o, Laporan): return {STATE_KEY: o.to_state()}
+    raise TypeError(f"{type(o).__name__} tidak bisa di-serialize")
+
+
+def json_object_hook(o: dict):
+    """`object_hook=` untuk json.loads; dict biasa dikembalikan apa adanya."""
+    if STATE_KEY in o and len(o) == 1: return Laporan.from_state(o[STATE_KEY])
+    return o
+
+
+# ----- Status laporan per sesi (metrics, reminder) -----
+# 'selesai' = laporan_rev saat laporan final terkirim; edit lewat /ubah membuatnya terbuka lagi
+def report_open(user_data) -> bool:
+    return bool(user_data.get('laporan', {}).get('shift')) and user_data.get('selesai') != user_data.get('laporan_rev')
+
+
+def stored_open(data: str) -> bool:
+    """report_open() untuk user_data ter-serialisasi; dipanggil di thread I/O saat sesi ditulis."""
+    return report_open(json.loads(data, object_hook=json_object_hook))
@@ -0,0 +1,215 @@
+import asyncio, logging, math
+from collections import deque
+from time import monotonic
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+_LOGGER = logging.getLogger(__name__)
+
+# ===================== Scheduler pengiriman keluar =====================
+# Dipasang lewat ApplicationBuilder().rate_limiter(...), jadi semua reply_text /
+# edit_message_text lewat sini tanpa perlu mengubah handler.
+# - Token bucket global + per chat (private & grup punya budget berbeda).
+# - Dua lane prioritas: PRIORITY_INTERACTIVE (prompt step, default) selalu diambil
+#   lebih dulu dari PRIORITY_BULK (laporan final, broadcast). Pilih lane dengan
+#   rate_limit_args={"priority": PRIORITY_BULK} pada pemanggilan bot.
+# - 429 RetryAfter: chat tsb di-pause selama retry_after lalu request diantrekan ulang.
+# - editMessageText ke pesan yang sama yang belum terkirim digabung: hanya isi terakhir
+#   yang dikirim, semua pemanggil menerima hasil yang sama.
+# Request tanpa chat_id (getUpdates, answerCallbackQuery, setWebhook, ...) tidak diantrekan.
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "stamp", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate, self.capacity = rate, capacity
+        self.tokens, self.stamp, self.blocked_until = capacity, now, 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self, now: float) -> float:
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, until: float):
+        self.blocked_until = max(self.blocked_until, until)
+
+
+class _Item:
+    __slots__ = ("chat_id", "edit_key", "priority", "callback", "args", "kwargs", "futures", "retries", "started")
+
+    def __init__(self, chat_id, edit_key, priority, callback, args, kwargs, fut):
+        self.chat_id, self.edit_key, self.priority = chat_id, edit_key, priority
+        self.callback, self.args, self.kwargs = callback, args, kwargs
+        self.futures: List[asyncio.Future] = [fut]
+        self.retries = 0
+        self.started = False
+
+
+class SendScheduler(BaseRateLimiter):
+    def __init__(self, global_rate: float = 30, private_rate: float = 1.0, group_rate: float = 20 / 60,
+                 chat_burst: float = 3, max_retries: int = 3):
+        self.global_rate = global_rate
+        self.private_rate, self.group_rate, self.chat_burst = private_rate, group_rate, chat_burst
+        self.max_retries = max_retries
+        self._lanes: Tuple[Deque[_Item], Deque[_Item]] = (deque(), deque())
+        self._edits: Dict[Tuple[Any, Any], _Item] = {}
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._global: Optional[TokenBucket] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight = set()
+        self._last_prune = 0.0
+
+    # ----- BaseRateLimiter -----
+    async def initialize(self):
+        if self._worker is not None:   # ExtBot bisa memanggil initialize lebih dari sekali
+            return
+        self._global = TokenBucket(self.global_rate, self.global_rate, monotonic())
+        self._wake = asyncio.Event()
+        self._worker = asyncio.create_task(self._run())
+
+    async def shutdown(self):
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        for lane in self._lanes:
+            for item in lane:
+                for f in item.futures:
+                    if not f.done(): f.cancel()
+            lane.clear()
+        self._edits.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id") if data else None
+        if chat_id is None or self._worker is None:
+            return await callback(*args, **kwargs)
+
+        fut = asyncio.get_running_loop().create_future()
+        edit_key = None
+        if endpoint == "editMessageText" and data.get("message_id") is not None:
+            edit_key = (chat_id, data["message_id"])
+            queued = self._edits.get(edit_key)
+            if queued is not None and not queued.started:
+                # Gabungkan: edit sebelumnya belum terkirim, cukup kirim isi terbaru
+                queued.callback, queued.args, queued.kwargs = callback, args, kwargs
+                queued.futures.append(fut)
+                return await fut
+
+        item = _Item(chat_id, edit_key, self._priority(rate_limit_args), callback, args, kwargs, fut)
+        if edit_key is not None:
+            self._edits[edit_key] = item
+        self._lanes[item.priority].append(item)
+        self._wake.set()
+        return await fut
+
+    # ----- Internal -----
+    @staticmethod
+    def _priority(rate_limit_args) -> int:
+        if isinstance(rate_limit_args, dict):
+            return PRIORITY_BULK if rate_limit_args.get("priority") == PRIORITY_BULK else PRIORITY_INTERACTIVE
+        return PRIORITY_INTERACTIVE
+
+    def _bucket(self, chat_id, now: float) -> TokenBucket:
+        b = self._chats.get(chat_id)
+        if b is None:
+            group = (isinstance(chat_id, int) and chat_id < 0) or isinstance(chat_id, str)
+            b = self._chats[chat_id] = TokenBucket(self.group_rate if group else self.private_rate,
+                                                   self.chat_burst, now)
+        return b
+
+    def _prune(self, now: float):
+        # Bucket yang idle >60 detik pasti sudah penuh lagi → sama dengan bucket baru
+        if now - self._last_prune < 60: return
+        self._last_prune = now
+        for chat_id in [c for c, b in self._chats.items() if now - b.stamp > 60 and now >= b.blocked_until]:
+            del self._chats[chat_id]
+
+    def _pick(self, now: float):
+        """Item pertama (lane prioritas dulu) yang chat-nya punya token; selain itu waktu tunggu terdekat."""
+        wait = math.inf
+        for lane in self._lanes:
+            for i, item in enumerate(lane):
+                w = self._bucket(item.chat_id, now).wait_time(now)
+                if w <= 0:
+                    del lane[i]
+                    return item, 0.0
+                wait = min(wait, w)
+        return None, wait
+
+    async def _run(self):
+        while True:
+            now = monotonic()
+            self._prune(now)
+            wait = self._global.wait_time(now)
+            if wait <= 0:
+                item, wait = self._pick(now)
+                if item is not None:
+                    if all(f.done() for f in item.futures):   # semua pemanggil sudah batal
+                        self._drop_edit(item)
+                        continue
+                    self._global.take(now)
+                    self._bucket(item.chat_id, now).take(now)
+                    item.started = True
+                    self._drop_edit(item)
+                    task = asyncio.create_task(self._send(item))
+                    self._inflight.add(task)
+                    task.add_done_callback(self._inflight.discard)
+                    continue
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=None if wait == math.inf else wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _drop_edit(self, item: _Item):
+        if item.edit_key is not None and self._edits.get(item.edit_key) is item:
+            del self._edits[item.edit_key]
+
+    async def _send(self, item: _Item):
+        try:
+            result = await item.callback(*item.args, **item.kwargs)
+        except RetryAfter as e:
+            item.retries += 1
+            if item.retries > self.max_retries:
+                self._resolve(item, exc=e)
+                return
+            delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+            _LOGGER.warning("429 untuk chat %s, tunggu %.1f detik", item.chat_id, delay)
+            self._bucket(item.chat_id, monotonic()).pause(monotonic() + delay)
+            newer = self._edits.get(item.edit_key) if item.edit_key is not None else None
+            if newer is not None:
+                # Sudah ada edit lebih baru yang antre → yang gagal ini tidak perlu dikirim ulang
+                newer.futures.extend(item.futures)
+                return
+            item.started = False
+            if item.edit_key is not None:
+                self._edits[item.edit_key] = item
+            self._lanes[item.priority].appendleft(item)
+            self._wake.set()
+        except Exception as e:
+            self._resolve(item, exc=e)
+        else:
+            self._resolve(item, result=result)
+
+    @staticmethod
+    def _resolve(item: _Item, result=None, exc: Optional[BaseException] = None):
+        for f in item.futures:
+            if f.done(): continue
+            if exc is not None: f.set_exception(exc)
+            else: f.set_result(result)
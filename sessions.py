@@ -0,0 +1,337 @@
+import asyncio, json, logging, os, socket, sqlite3, threading, time, uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import TypeHandler
+
+from metrics import SESSIONS_EVICTED
+from report import json_default, json_object_hook, stored_open
+
+_LOGGER = logging.getLogger(__name__)
+
+# ===================== Sesi bersama antar replica =====================
+# Beberapa replica webhook di belakang satu load balancer: update user yang sama bisa
+# masuk ke replica mana saja. Per update (dibungkus PerUserUpdateProcessor):
+#   1. lease per user di backend (hanya satu replica yang memproses user tsb)
+#   2. versi sesi di backend dibandingkan dengan cache lokal — sama → user_data di
+#      memori langsung dipakai (replica "pemilik" yang panas), beda → muat ulang
+#   3. setelah handler selesai: simpan hanya jika isi berubah, CAS pada versi
+#      (SessionConflict jika lease sempat kedaluwarsa dan replica lain menulis)
+#   4. lease dilepas
+# Backend pluggable: SessionBackend (blocking, dipanggil lewat thread). Yang tersedia:
+# SQLiteSessionBackend — satu file SQLite yang dipakai bersama (volume yang sama /
+# test lokal). Backend jaringan (Redis/Postgres) cukup mengimplementasikan method yang sama.
+# Key user_data berawalan "_" adalah cache lokal dan tidak ikut disimpan.
+
+
+class SessionConflict(Exception):
+    pass
+
+
+class SessionBackend(ABC):
+    @abstractmethod
+    def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        """Ambil/perpanjang lease `key`; False jika dipegang owner lain yang belum kedaluwarsa."""
+
+    @abstractmethod
+    def release(self, key: str, owner: str):
+        ...
+
+    @abstractmethod
+    def version(self, user_id: int) -> int:
+        """Versi sesi saat ini (0 = belum ada)."""
+
+    @abstractmethod
+    def load(self, user_id: int) -> Tuple[int, Optional[str]]:
+        ...
+
+    @abstractmethod
+    def save(self, user_id: int, data: str, expected: int) -> int:
+        """Tulis jika versi di backend masih `expected`; mengembalikan versi baru."""
+
+    @abstractmethod
+    def sessions(self) -> Iterator[Tuple[int, str]]:
+        ...
+
+    def count_open(self) -> int:
+        """Sesi dengan laporan terbuka. Default decode semua sesi; backend sebaiknya menyimpan flag-nya."""
+        return sum(1 for _, data in self.sessions() if stored_open(data))
+
+    def close(self):
+        pass
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS session (
+    user_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL,
+    data    TEXT NOT NULL,
+    open    INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS lease (
+    key     TEXT PRIMARY KEY,
+    owner   TEXT NOT NULL,
+    expires REAL NOT NULL
+) WITHOUT ROWID;
+"""
+_INDEX = "CREATE INDEX IF NOT EXISTS session_open ON session (open)"
+
+
+class SQLiteSessionBackend(SessionBackend):
+    PRUNE_EVERY = 500   # lease kedaluwarsa (job/update yang sudah lewat) dibersihkan berkala
+
+    def __init__(self, path: str = "shared_sessions.db"):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._acquired = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            if "open" not in {row[1] for row in conn.execute("PRAGMA table_info(session)")}:
+                # file dari versi sebelum kolom open: flag diisi sekali dari sesi yang ada
+                rows = conn.execute("SELECT user_id, data FROM session").fetchall()
+                conn.execute("ALTER TABLE session ADD COLUMN open INTEGER NOT NULL DEFAULT 0")
+                conn.executemany("UPDATE session SET open=1 WHERE user_id=?",
+                                 [(user_id,) for user_id, data in rows if stored_open(data)])
+            conn.execute(_INDEX)
+            self._conn = conn
+        return self._conn
+
+    def acquire(self, key, owner, ttl):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT owner, expires FROM lease WHERE key=?", (key,)).fetchone()
+                held = bool(row and row[0] != owner and row[1] > now)
+                if not held:
+                    db.execute("INSERT OR REPLACE INTO lease (key, owner, expires) VALUES (?, ?, ?)",
+                               (key, owner, now + ttl))
+                    if (self._acquired + 1) % self.PRUNE_EVERY == 0:
+                        db.execute("DELETE FROM lease WHERE expires < ?", (now,))
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            if not held: self._acquired += 1
+            return not held
+
+    def release(self, key, owner):
+        with self._lock:
+            self._db().execute("DELETE FROM lease WHERE key=? AND owner=?", (key, owner))
+
+    def version(self, user_id):
+        with self._lock:
+            row = self._db().execute("SELECT version FROM session WHERE user_id=?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def load(self, user_id):
+        with self._lock:
+            row = self._db().execute("SELECT version, data FROM session WHERE user_id=?", (user_id,)).fetchone()
+        return (row[0], row[1]) if row else (0, None)
+
+    def save(self, user_id, data, expected):
+        is_open = stored_open(data)
+        with self._lock:
+            db = self._db()
+            if expected == 0:
+                cur = db.execute("INSERT OR IGNORE INTO session (user_id, version, data, open) VALUES (?, 1, ?, ?)",
+                                 (user_id, data, is_open))
+            else:
+                cur = db.execute("UPDATE session SET version = version + 1, data = ?, open = ? "
+                                 "WHERE user_id=? AND version=?", (data, is_open, user_id, expected))
+        if cur.rowcount != 1:
+            raise SessionConflict(f"sesi user {user_id} sudah berubah (versi lokal {expected})")
+        return expected + 1
+
+    def sessions(self):
+        with self._lock:
+            rows = self._db().execute("SELECT user_id, data FROM session").fetchall()
+        return iter(rows)
+
+    def count_open(self):
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM session WHERE open=1").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def backend_from_url(url: str) -> SessionBackend:
+    """SESSION_BACKEND, mis. "sqlite:///data/shared_sessions.db" (path absolut) atau "sqlite://shared.db"."""
+    scheme, _, rest = url.partition("://")
+    if scheme == "sqlite" and rest:
+        return SQLiteSessionBackend(rest)
+    raise ValueError(f"SESSION_BACKEND tidak dikenal: {url!r}")
+
+
+def _dumps(data: dict) -> str:
+    # Sama dengan persistence.py: key "_" = cache lokal
+    return json.dumps({k: v for k, v in data.items() if not (isinstance(k, str) and k.startswith("_"))},
+                      ensure_ascii=False, separators=(",", ":"), sort_keys=True, default=json_default)
+
+
+class SharedSessions:
+    def __init__(self, backend: SessionBackend, ttl: float = 30.0, owner: Optional[str] = None):
+        self.backend = backend
+        self.ttl = ttl   # lease harus lebih lama dari update terlama (mis. /export)
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._versions: Dict[int, int] = {}   # user -> versi sesi di cache lokal
+        self._saved: Dict[int, str] = {}      # user -> isi terakhir yang sama dengan backend
+        self.hits = self.misses = self.conflicts = 0
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"user:{user_id}"
+
+    async def enter(self, user_id: int, user_data: dict):
+        """Ambil lease user lalu pastikan `user_data` sama dengan versi terbaru di backend."""
+        delay = 0.02
+        while not await asyncio.to_thread(self.backend.acquire, self._key(user_id), self.owner, self.ttl):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        try:
+            version = await asyncio.to_thread(self.backend.version, user_id)
+            if user_id in self._versions and version == self._versions[user_id]:
+                self.hits += 1
+                return
+            self.misses += 1
+            version, data = await asyncio.to_thread(self.backend.load, user_id)
+            user_data.clear()
+            if data: user_data.update(json.loads(data, object_hook=json_object_hook))
+            self._versions[user_id] = version
+            self._saved[user_id] = _dumps(user_data)
+        except BaseException:
+            await asyncio.to_thread(self.backend.release, self._key(user_id), self.owner)
+            raise
+
+    async def exit(self, user_id: int, user_data: dict):
+        """Simpan (jika berubah) lalu lepas lease."""
+        data = _dumps(user_data)
+
+        def save_and_release():
+            try:
+                if data != self._saved.get(user_id):
+                    self._versions[user_id] = self.backend.save(user_id, data, self._versions.get(user_id, 0))
+                    self._saved[user_id] = data
+            finally:
+                self.backend.release(self._key(user_id), self.owner)
+
+        try:
+            await asyncio.to_thread(save_and_release)
+        except SessionConflict as e:
+            # Lease kedaluwarsa di tengah update dan replica lain sudah menulis: versi itu yang
+            # dipakai, cache lokal dibuang supaya update berikutnya memuat ulang
+            self.conflicts += 1
+            self._versions.pop(user_id, None)
+            self._saved.pop(user_id, None)
+            _LOGGER.warning("Konflik sesi: %s", e)
+
+    def forget(self, user_id: int):
+        self._versions.pop(user_id, None)
+        self._saved.pop(user_id, None)
+
+    async def claim(self, name: str, ttl: float) -> bool:
+        """Lease sekali pakai untuk job terjadwal: hanya satu replica yang menjalankannya."""
+        return await asyncio.to_thread(self.backend.acquire, f"job:{name}", self.owner, ttl)
+
+    async def count_open(self) -> int:
+        return await asyncio.to_thread(self.backend.count_open)
+
+    async def all(self) -> Dict[int, dict]:
+        rows = await asyncio.to_thread(lambda: list(self.backend.sessions()))
+        return {user_id: json.loads(data, object_hook=json_object_hook) for user_id, data in rows}
+
+
+# ===================== Eviction sesi idle =====================
+# user_data Application tidak pernah menyusut: sesi yang ditinggal di tengah laporan
+# tetap di memori selama proses hidup. IdleSessions mencatat waktu update terakhir per
+# user (urut LRU) dan sweep() berkala melepas dari memori:
+#   - sesi yang idle lebih dari `ttl` detik
+#   - sesi paling lama idle selama jumlah sesi di memori melebihi `max_sessions`
+# Sesi yang aktif kurang dari `min_idle` detik (flush persistence PTB tiap
+# update_interval) atau yang update-nya masih antre/diproses (`busy`) tidak pernah dilepas.
+# Waktu update dicatat di check_update handler group -3: sinkron, sebelum PTB membuat
+# context dan me-refresh user_data dari persistence.
+# Dilepas = spill, bukan hilang: dengan SQLitePersistence data ditulis ke buffer
+# write-behind (spill) lalu dibaca ulang saat user kembali; dengan SharedSessions backend
+# sudah memegang versi terbaru. Tanpa keduanya sesi idle memang dibuang.
+# Lepas dari memori lewat Application.drop_user_data(); yang membaca semua sesi
+# (reminder, gauge kpi_active_sessions) membaca persistence/backend, bukan app.user_data.
+
+class IdleSessions:
+    def __init__(self, ttl: float = 1800.0, max_sessions: int = 5000, min_idle: float = 60.0):
+        self.ttl, self.max_sessions, self.min_idle = ttl, max_sessions, min_idle
+        self._seen: "OrderedDict[int, float]" = OrderedDict()   # user -> waktu update terakhir
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._seen)
+
+    def touch(self, user_id: int):
+        self._seen[user_id] = time.monotonic()
+        self._seen.move_to_end(user_id)
+
+    def victims(self, now: Optional[float] = None) -> List[int]:
+        now = time.monotonic() if now is None else now
+        over = len(self._seen) - self.max_sessions
+        out = []
+        for user_id, seen in self._seen.items():   # paling lama idle dulu
+            idle = now - seen
+            if idle < self.min_idle: break
+            if idle >= self.ttl or over > 0:
+                out.append(user_id)
+                over -= 1
+            else:
+                break
+        return out
+
+    def install(self, app):
+        idle = self
+
+        class Touch(TypeHandler):
+            def check_update(self, update):
+                if isinstance(update, Update) and update.effective_user:
+                    idle.touch(update.effective_user.id)
+                return False   # hanya mencatat, callback tidak pernah jalan
+
+        async def never(update, context): pass
+        app.add_handler(Touch(Update, never), group=-3)
+
+    async def sweep(self, app, sessions: Optional[SharedSessions] = None, busy=None) -> int:
+        persistence = app.persistence if app.persistence and app.persistence.store_data.user_data else None
+        n = 0
+        for user_id in self.victims():
+            if busy is not None and busy(user_id): continue
+            del self._seen[user_id]
+            if sessions is not None:
+                sessions.forget(user_id)   # data sudah di backend; persistence lokal tanpa user_data
+            elif persistence is not None:
+                # drop_user_data() berikutnya (dari Application.drop_user_data) dianggap eviction
+                persistence.spill(user_id, app.user_data.get(user_id) or {})
+            app.drop_user_data(user_id)
+            n += 1
+        self.evicted += n
+        if n: SESSIONS_EVICTED.inc(n=n)
+        return n
+
+    async def run(self, app, sessions: Optional[SharedSessions] = None, interval: float = 60.0):
+        busy = getattr(app.update_processor, "busy", None)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                n = await self.sweep(app, sessions, busy)
+                if n: _LOGGER.info("%d sesi idle dilepas dari memori (%d tersisa)", n, len(self))
+            except Exception:
+                _LOGGER.exception("Sweep sesi idle gagal")
@@ -0,0 +1,130 @@
+import asyncio, json, logging, os
+from typing import Dict, Iterable, Optional, Tuple
+
+_LOGGER = logging.getLogger(__name__)
+
+# ===================== Registry konfigurasi per store =====================
+# File JSON (lihat stores.example.json) dibaca sekali ke index in-memory:
+# kode store -> config, chat id -> config, user id -> config. Handler hanya melakukan
+# lookup dict; file hanya disentuh oleh watch() yang mengecek mtime secara berkala
+# dan menukar seluruh index sekaligus saat file berubah (tanpa restart).
+
+BUILTIN_STAFF = ("Dian", "Dinda", "Agung", "Rifa", "Putri")
+BUILTIN_TARGETS = {"tunai": "215", "isaku": "8", "poinku": "10", "klik": "13",
+                   "pjr": "", "cancel": "", "itt": ""}   # cancel/itt = budget
+BUILTIN_POIN = {"variance": "5", "cancel": "5", "tertib": "5", "tunai": "5", "isaku": "5",
+                "poinku": "10", "klik": "10", "store_activity": "5", "kbk": "5", "pjr": "10", "itt": "5"}
+
+
+class StoreConfig:
+    __slots__ = ("code", "name", "area", "staff", "targets", "poin", "reminders", "report_chats", "__weakref__")
+
+    def __init__(self, code: str, name: str, staff: Iterable[str] = BUILTIN_STAFF,
+                 targets: Optional[dict] = None, poin: Optional[dict] = None,
+                 reminders: Optional[dict] = None, report_chats: Iterable[int] = (), area: str = ""):
+        self.code = code
+        self.name = name
+        self.area = area   # kelompok store untuk /area (kosong = semua store)
+        self.staff: Tuple[str, ...] = tuple(staff)
+        self.targets: Dict[str, str] = {**BUILTIN_TARGETS, **{k: str(v) for k, v in (targets or {}).items()}}
+        self.poin: Dict[str, str] = {**BUILTIN_POIN, **{k: str(v) for k, v in (poin or {}).items()}}
+        # shift -> jam reminder "HH:MM" (zona waktu TIMEZONE); grup tujuan posting laporan final
+        self.reminders: Dict[str, str] = {str(k): str(v) for k, v in (reminders or {}).items() if v}
+        self.report_chats: Tuple[int, ...] = tuple(int(c) for c in report_chats)
+
+    def __repr__(self):
+        return f"StoreConfig({self.code!r}, {self.name!r})"
+
+BUILTIN_STORE = StoreConfig("T67T", "T67T CIBULARENG")
+
+
+class StoreRegistry:
+    def __init__(self, path: str = "stores.json"):
+        self.path = path
+        self.generation = 0   # naik setiap reload; dipakai sebagai bagian key cache render
+        self._mtime: Optional[float] = None
+        # (by_code, by_chat, by_user, default) — ditukar sebagai satu tuple saat reload
+        self._state = None
+
+    # ----- Load -----
+    def _parse(self, raw: dict):
+        base = raw.get("defaults", {})
+        by_code, by_chat, by_user = {}, {}, {}
+        for s in raw.get("stores", []):
+            cfg = StoreConfig(
+                code=str(s["code"]),
+                name=s.get("name", str(s["code"])),
+                staff=s.get("staff", base.get("staff", BUILTIN_STAFF)),
+                targets={**base.get("targets", {}), **s.get("targets", {})},
+                poin={**base.get("poin", {}), **s.get("poin", {})},
+                reminders={**base.get("reminders", {}), **s.get("reminders", {})},
+                report_chats=s.get("report_chats", ()),
+                area=str(s.get("area", base.get("area", ""))).upper(),
+            )
+            by_code[cfg.code] = cfg
+            for chat_id in s.get("chats", []): by_chat[int(chat_id)] = cfg
+            for user_id in s.get("users", []): by_user[int(user_id)] = cfg
+        default = by_code.get(str(raw.get("default", ""))) or next(iter(by_code.values()), BUILTIN_STORE)
+        return by_code, by_chat, by_user, default
+
+    def reload(self) -> bool:
+        """Baca ulang file. Jika file tidak ada, pakai store bawaan; jika rusak, config lama dipertahankan."""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            if self._state is None:
+                self._state = ({BUILTIN_STORE.code: BUILTIN_STORE}, {}, {}, BUILTIN_STORE)
+            return False
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = self._parse(json.load(f))
+        except Exception:
+            _LOGGER.exception("Config store %s tidak valid, config lama tetap dipakai", self.path)
+            self._mtime = mtime
+            if self._state is None:
+                self._state = ({BUILTIN_STORE.code: BUILTIN_STORE}, {}, {}, BUILTIN_STORE)
+            return False
+        self._state, self._mtime = state, mtime
+        self.generation += 1
+        _LOGGER.info("Config store dimuat: %d store dari %s", len(state[0]), self.path)
+        return True
+
+    def maybe_reload(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return False
+        return mtime != self._mtime and self.reload()
+
+    async def watch(self, interval: float = 30):
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.maybe_reload)
+
+    # ----- Lookup (tanpa I/O setelah load pertama) -----
+    def _index(self):
+        if self._state is None:
+            self.reload()
+        return self._state
+
+    @property
+    def default(self) -> StoreConfig:
+        return self._index()[3]
+
+    def get(self, code: Optional[str]) -> StoreConfig:
+        by_code, _, _, default = self._index()
+        return by_code.get(code, default) if code else default
+
+    def for_ids(self, chat_id: Optional[int], user_id: Optional[int]) -> StoreConfig:
+        return self.mapped(chat_id, user_id) or self.default
+
+    def mapped(self, chat_id: Optional[int], user_id: Optional[int]) -> Optional[StoreConfig]:
+        """Store yang di-set eksplisit untuk user/chat ini (tanpa fallback ke default)."""
+        _, by_chat, by_user, _ = self._index()
+        return by_user.get(user_id) or by_chat.get(chat_id)
+
+    def all(self) -> Tuple[StoreConfig, ...]:
+        return tuple(self._index()[0].values())
+
+    def in_area(self, area: str) -> Tuple[StoreConfig, ...]:
+        return tuple(c for c in self._index()[0].values() if c.area == area) if area else self.all()
@@ -0,0 +1,38 @@
+import pytest
+
+from bot import Laporan, bulk_values, ensure_defaults_for_shift, renderer_for
+from stores import BUILTIN_STORE
+
+# /isi memakai validasi yang sama dengan input per step (_variance_input)
+
+
+@pytest.mark.parametrize("label, key", [
+    ("variance induk", "variance_induk"),
+    ("variance anak", "variance_anak"),
+    ("variance induk shift 1", "variance_shift1_induk"),
+    ("variance anak shift 2", "variance_shift2_anak"),
+])
+def test_invalid_variance_is_rejected(label, key):
+    values, errors = bulk_values(f"shift: 1\ntanggal: 01/08/2025\n{label}: abc\nsales induk: 1.000")
+    assert key not in values
+    assert errors == [f"{label}: abc"]
+    assert values["sales_induk"] == 1000
+
+
+def test_valid_variance_is_kept():
+    values, errors = bulk_values("shift: 2\nvariance induk: +4.139 Dian\nvariance anak: 0\n"
+                                 "variance induk shift 1: Agung -1.200")
+    assert errors == []
+    assert values["variance_induk"] == "+4.139 Dian"
+    assert values["variance_anak"] == "0"
+    assert values["variance_shift1_induk"] == "Agung -1.200"
+
+
+def test_pasted_report_still_valid():
+    d = Laporan({"shift": "1", "tanggal": "01/08/2025", "sales_induk": 5, "sales_anak": 1, "total_sales": 6,
+                 "struk_induk": 3, "struk_anak": 2, "total_struk": 5,
+                 "variance_shift1_induk": "+4.139 Dian", "variance_shift1_anak": "-334 Rifa"})
+    ensure_defaults_for_shift(d, "1")
+    values, errors = bulk_values(renderer_for(BUILTIN_STORE)(d))
+    assert errors == []
+    assert values["variance_shift1_anak"] == "-334 Rifa"
@@ -0,0 +1,117 @@
+import json, random, sqlite3
+from collections import defaultdict
+from datetime import date, timedelta
+
+import pytest
+
+from history import METRIC_NAMES, ReportStore, metric_values, periods, rank_periods, variance_entries, VARIANCE_PLUS_BIG
+
+# Tabel delta (rollup, variance, score, ranking) dibandingkan dengan hitung ulang penuh
+# dari index `latest` setelah append acak + revisi.
+
+STORES = ("A", "B", "C")
+STAFF = ("Dian", "Rifa", "Agung")
+
+
+def random_report(rng: random.Random, day: date, shift: str) -> dict:
+    d = {"tanggal": f"{day:%d/%m/%Y}", "shift": shift, "kpi_score": rng.randint(0, 100),
+         "total_sales": rng.randint(0, 5_000_000), "total_struk": rng.randint(0, 600),
+         "all_produk": rng.choice([0, rng.randint(1, 900_000)])}
+    for m in ("cancel", "tunai", "isaku", "poinku", "klik", "itt"):
+        d[f"{m}_shift{shift}"] = str(rng.randint(0, 120))
+    for part in ("induk", "anak"):
+        amount = rng.choice([0, rng.randint(-20_000, 20_000)])
+        d[f"variance_shift{shift}_{part}"] = f"{amount:+,}".replace(",", ".") + " " + rng.choice(STAFF)
+    return d
+
+
+def fill(store: ReportStore, rng: random.Random, n: int = 400):
+    days = [date(2025, 7, 20) + timedelta(days=i) for i in range(30)]   # lintas minggu & bulan
+    for _ in range(n):
+        store.append(rng.choice(STORES), random_report(rng, rng.choice(days), rng.choice("12")))
+
+
+def recompute(path: str) -> dict:
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT l.store, l.tanggal, l.shift, r.data FROM latest l "
+                        "JOIN reports r ON r.id = l.id ORDER BY l.store, l.tanggal, l.shift").fetchall()
+    conn.close()
+    rollup = defaultdict(lambda: [0] * (len(METRIC_NAMES) + 1))
+    variance = defaultdict(lambda: [0, 0, 0])
+    day_score, sums = {}, defaultdict(lambda: [0] * len(METRIC_NAMES))
+    for store, tanggal, shift, data in rows:
+        d, day = json.loads(data), date.fromisoformat(tanggal)
+        vals = metric_values(d)
+        for period in periods(day):
+            acc = rollup[store, period]
+            acc[0] += 1
+            for i, v in enumerate(vals): acc[i + 1] += v
+        for period in rank_periods(day):
+            for i, v in enumerate(vals): sums[store, period][i] += v
+        for staff, amount in variance_entries(d):
+            acc = variance[store, tanggal[:7], staff]
+            if amount < 0: acc[0] += amount
+            else:
+                acc[1] += amount
+                acc[2] += amount > VARIANCE_PLUS_BIG
+        # Skor hari: Shift 2 jika ada (baris diurutkan shift), selain itu Shift 1
+        day_score[store, tanggal] = d["kpi_score"]
+
+    score = defaultdict(lambda: [0, 0])
+    ranking = {}
+    days = defaultdict(set)
+    for (store, tanggal), poin in day_score.items():
+        day = date.fromisoformat(tanggal)
+        ranking[tanggal, "score", store] = poin
+        for period in periods(day):
+            score[store, period][0] += 1
+            score[store, period][1] += poin
+        for period in rank_periods(day):
+            days[store, period].add(tanggal)
+    for (store, period), (n, poin) in score.items():
+        ranking[period, "score", store] = round(poin / n)
+    for (store, period), vals in sums.items():
+        for m, v in zip(METRIC_NAMES, vals): ranking[period, m, store] = v
+        ranking[period, "days", store] = len(days[store, period])
+    return {
+        "rollup": {k: tuple(v) for k, v in rollup.items()},
+        "variance": {k: tuple(v) for k, v in variance.items() if any(v)},
+        "score": {k: tuple(v) for k, v in score.items()},
+        "ranking": ranking,
+    }
+
+
+def stored(path: str) -> dict:
+    conn = sqlite3.connect(path)
+    out = {
+        "rollup": {(r[0], r[1]): tuple(r[2:]) for r in conn.execute(
+            f"SELECT store, period, n, {', '.join(METRIC_NAMES)} FROM rollup")},
+        "variance": {(r[0], r[1], r[2]): tuple(r[3:]) for r in conn.execute(
+            "SELECT store, period, staff, varmin, varplus, big FROM variance") if any(r[3:])},
+        "score": {(r[0], r[1]): (r[2], r[3]) for r in conn.execute("SELECT store, period, days, poin FROM score")},
+        "ranking": {(r[0], r[1], r[2]): r[3] for r in conn.execute(
+            "SELECT period, metric, store, value FROM ranking")},
+    }
+    conn.close()
+    return out
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_delta_tables_match_full_recompute(tmp_path, seed):
+    path = str(tmp_path / "reports.db")
+    fill(ReportStore(path), random.Random(seed))
+    assert stored(path) == recompute(path)
+
+
+def test_migration_rebuilds_tables(tmp_path):
+    path = str(tmp_path / "reports.db")
+    fill(ReportStore(path), random.Random(7), n=200)
+    expected = recompute(path)
+    # Kembali ke kondisi sebelum user_version 1: variance, skor mingguan dan ranking belum ada
+    conn = sqlite3.connect(path)
+    conn.executescript("DELETE FROM variance; DELETE FROM ranking; DELETE FROM score WHERE period LIKE '%-W%';"
+                       "PRAGMA user_version = 0;")
+    conn.close()
+    ReportStore(path).rollup("A", "2025-08")   # koneksi pertama menjalankan migrasi
+    assert stored(path) == expected
+    assert sqlite3.connect(path).execute("PRAGMA user_version").fetchone()[0] == 2
@@ -0,0 +1,44 @@
+import asyncio, sqlite3
+
+from persistence import SQLitePersistence, _dumps
+from report import Laporan
+
+# Gauge kpi_active_sessions: flag `open` disimpan bersama sesi dan dihitung di SQL
+
+
+def session(open_: bool) -> dict:
+    return {"laporan": Laporan({"shift": "1", "tanggal": "01/08/2025"}), "laporan_rev": 3,
+            "selesai": None if open_ else 3}
+
+
+def test_count_open_follows_writes(tmp_path):
+    async def run():
+        p = SQLitePersistence(str(tmp_path / "s.db"), flush_interval=0)
+        for user_id in range(10):
+            await p.update_user_data(user_id, session(user_id % 3 == 0))
+        await p.update_chat_data(0, session(True))            # chat_data tidak dihitung
+        await p._write_pending()
+        assert await p.count_open() == 4
+        await p.update_user_data(0, session(False))            # laporan terkirim
+        await p.drop_user_data(3)
+        p.spill(5, session(True))                              # dilepas dari memori, tetap dihitung
+        await p._write_pending()
+        assert await p.count_open() == 3
+        await p.flush()
+    asyncio.run(run())
+
+
+def test_count_open_migrates_old_db(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE kv (kind TEXT NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL, "
+                 "PRIMARY KEY (kind, key)) WITHOUT ROWID")
+    conn.executemany("INSERT INTO kv VALUES ('user', ?, ?)", [(str(i), _dumps(session(i < 2))) for i in range(5)])
+    conn.commit()
+    conn.close()
+
+    async def run():
+        p = SQLitePersistence(path)
+        assert await p.count_open() == 2
+        await p.flush()
+    asyncio.run(run())
@@ -0,0 +1,31 @@
+import pytest
+
+from bot import Laporan, compile_layout, report_layout
+from stores import StoreConfig
+
+# Nilai config (nama store, target, nama staff) tidak boleh ikut jadi source yang
+# di-compile: karakter quote/brace/backslash harus keluar apa adanya.
+
+ODD = ("'", '"', "{", "}", "{}", "\\", "\\n", "'''", '"""')
+
+
+@pytest.mark.parametrize("odd", ODD)
+def test_config_values_render_verbatim(odd):
+    name = f"TOKO D{odd}ARCY"
+    staff = (f"O{odd}Neil", "Rifa")
+    cfg = StoreConfig("D", name, staff=staff, targets={"tunai": f"2{odd}0"}, poin={"itt": f"1{odd}"})
+    render = compile_layout(report_layout(cfg))
+    d = Laporan({"shift": "1", "tanggal": "01/08/2025", f"variance_plus_o{odd.lower()}neil": "+3.000 O"})
+    lines = render(d).splitlines()
+    assert lines[0] == f"*{name}*"
+    assert f"Target : 2{odd}0" in lines
+    assert f"POIN 1{odd}" in lines
+    assert f"O{odd}Neil : 0" in lines            # varmin, default "0"
+    assert f"O{odd}Neil : +3.000 O" in lines     # variance plus dari key dinamis staff
+
+
+def test_render_matches_plain_store():
+    cfg = StoreConfig("X", "Toko X", staff=("Dian",))
+    text = compile_layout(report_layout(cfg))(Laporan({"shift": "2", "tanggal": "01/08/2025"}))
+    assert text.startswith("*Toko X*\nMonitoring *KPI* \n SHIFT 02\nTanggal: 01/08/2025\n")
+    assert "Dian : 0\n" in text
@@ -0,0 +1,99 @@
+import asyncio, sqlite3
+
+import pytest
+
+from report import Laporan
+from sessions import SessionConflict, SharedSessions, SQLiteSessionBackend
+
+# Sesi bersama antar replica: lease, CAS versi, rollback, lease kedaluwarsa.
+# Tiap "replica" memakai koneksi backend sendiri ke file yang sama.
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "shared_sessions.db")
+
+
+def replica(path, name, ttl=30.0) -> SharedSessions:
+    return SharedSessions(SQLiteSessionBackend(path), ttl=ttl, owner=name)
+
+
+def test_lease_held_by_other_replica(path):
+    a, b = SQLiteSessionBackend(path), SQLiteSessionBackend(path)
+    assert a.acquire("user:1", "A", 30)
+    assert not b.acquire("user:1", "B", 30)
+    assert a.acquire("user:1", "A", 30)          # owner yang sama memperpanjang
+    b.release("user:1", "B")                     # bukan pemilik: tidak melepas
+    assert not b.acquire("user:1", "B", 30)
+    a.release("user:1", "A")
+    assert b.acquire("user:1", "B", 30)
+
+
+def test_enter_waits_for_lease(path):
+    async def run():
+        a, b = replica(path, "A"), replica(path, "B")
+        ud_a, ud_b = {}, {}
+        await a.enter(1, ud_a)
+        waiting = asyncio.create_task(b.enter(1, ud_b))
+        await asyncio.sleep(0.1)
+        assert not waiting.done()
+        ud_a["laporan"] = Laporan({"shift": "2", "tanggal": "01/08/2025"})
+        await a.exit(1, ud_a)
+        await asyncio.wait_for(waiting, 2)
+        assert ud_b["laporan"]["shift"] == "2"   # versi A dimuat, bukan cache kosong
+        await b.exit(1, ud_b)
+    asyncio.run(run())
+
+
+def test_expired_lease_taken_over(path):
+    a, b = SQLiteSessionBackend(path), SQLiteSessionBackend(path)
+    assert a.acquire("user:1", "A", -1)          # langsung kedaluwarsa (replica A mati)
+    assert b.acquire("user:1", "B", 30)
+    assert not a.acquire("user:1", "A", 30)
+
+
+def test_cas_conflict(path):
+    backend = SQLiteSessionBackend(path)
+    assert backend.save(1, '{"step":"a"}', 0) == 1
+    with pytest.raises(SessionConflict):
+        backend.save(1, '{"step":"b"}', 0)       # insert ulang dengan versi 0
+    assert backend.save(1, '{"step":"c"}', 1) == 2
+    with pytest.raises(SessionConflict):
+        backend.save(1, '{"step":"d"}', 1)       # versi lokal basi
+    assert backend.load(1) == (2, '{"step":"c"}')
+
+
+def test_conflict_after_lease_expired(path):
+    async def run():
+        a, b = replica(path, "A", ttl=-1), replica(path, "B")
+        ud_a, ud_b = {}, {}
+        await a.enter(1, ud_a)                   # lease A kedaluwarsa di tengah update
+        await b.enter(1, ud_b)
+        ud_b["step"] = "dari B"
+        await b.exit(1, ud_b)
+        ud_a["step"] = "dari A"
+        await a.exit(1, ud_a)                    # CAS gagal: tulisan B yang dipakai
+        assert a.conflicts == 1
+        assert a.backend.load(1) == (1, '{"step":"dari B"}')
+        await a.enter(1, ud_a)                   # cache A dibuang → muat ulang
+        assert ud_a == {"step": "dari B"}
+        await a.exit(1, ud_a)
+    asyncio.run(run())
+
+
+def test_failed_lease_write_rolled_back(path):
+    # Prune lease lama gagal SETELAH lease baru ditulis: seluruh transaksi dibatalkan,
+    # lease tidak boleh tertinggal untuk acquire yang melempar exception
+    backend = SQLiteSessionBackend(path)
+    backend.PRUNE_EVERY = 1
+    db = backend._db()
+    db.execute("INSERT INTO lease VALUES ('job:lama', 'C', 0)")
+    db.execute("CREATE TRIGGER boom BEFORE DELETE ON lease BEGIN SELECT RAISE(ABORT, 'boom'); END")
+    with pytest.raises(sqlite3.IntegrityError):
+        backend.acquire("user:1", "A", 30)
+    assert not db.in_transaction
+    other = SQLiteSessionBackend(path)
+    assert other.acquire("user:1", "B", 30)      # tidak terkunci dan lease A tidak ada
+    db.execute("DROP TRIGGER boom")
+    other.release("user:1", "B")
+    assert backend.acquire("user:1", "A", 30)
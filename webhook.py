@@ -0,0 +1,189 @@
+import asyncio, bisect, json, logging, signal, socket
+from typing import TYPE_CHECKING, Callable, List, Optional, Sequence
+
+from metrics import COLD_START, UPDATES_DUPLICATE
+
+if TYPE_CHECKING:
+    from telegram.ext import Application
+
+_LOGGER = logging.getLogger(__name__)
+
+# ===================== Webhook: start cepat + replay tanpa kehilangan update =====================
+# Web Service gratis (Render/Koyeb) tidur saat idle dan dibangunkan oleh webhook
+# Telegram itu sendiri. run_webhook() baru bind port setelah build + getMe + post_init +
+# setWebhook, dan dulu memakai drop_pending_updates=True → pesan kasir selama instance
+# tidur dibuang. serve_webhook() membalik urutannya:
+#   1. bind port (socket stdlib, sebelum telegram/tornado diimpor — bind() dipanggil main.py
+#      sebelum modul bot yang berat diimpor), lalu tornado; update ditampung mentah di buffer
+#   2. build Application (import bot, httpx/SSL, handler) + initialize + post_init
+#   3. buffer diurutkan per update_id lalu masuk update_queue, app.start()
+#   4. setWebhook(drop_pending_updates=False): antrean Telegram selama tidur tetap dikirim
+# UpdateLedger membuat retry webhook dan restart idempotent: update_id yang sudah
+# diproses dilewati, high-water mark-nya disimpan di bot_data (ikut persistence).
+# Multi-replica: retry bisa jatuh ke replica lain, jadi id juga di-claim di backend sesi bersama.
+
+LEDGER_KEY = "update_ledger"
+
+
+class UpdateLedger:
+    """Dedup update_id. `done`: id terbaru yang sudah selesai (WINDOW..2×WINDOW id); `hwm`:
+    batas bawah jendela, id <= hwm dianggap sudah selesai. Jendela, bukan "semua id <= x
+    selesai": id yang masuk bisa bolong (replica lain) dan diproses tidak berurutan
+    (paralel antar user). `received`: id yang sudah diterima PerUserUpdateProcessor tapi
+    belum selesai (menunggu lock user, lease, slot worker) — hwm tidak pernah melewati
+    yang terkecil, jadi update yang antre lama tidak pernah dianggap sudah diproses."""
+
+    WINDOW = 1024
+    CLAIM_TTL = 24 * 3600   # Telegram berhenti retry jauh sebelum ini
+
+    def __init__(self, sessions=None):
+        self.sessions = sessions
+        self.hwm = 0
+        self.done = set()
+        self.inflight = set()
+        self.received = set()
+        self._loaded = False
+
+    def load(self, state: Optional[dict]):
+        self._loaded = True
+        if state:
+            self.hwm = max(self.hwm, int(state.get("hwm", 0)))
+            self.done.update(i for i in state.get("done", ()) if i > self.hwm)
+
+    def state(self) -> dict:
+        return {"hwm": self.hwm, "done": sorted(self.done)}
+
+    def begin(self, update_id: int) -> bool:
+        """False jika update ini sudah/sedang diproses."""
+        if update_id <= self.hwm or update_id in self.done or update_id in self.inflight:
+            return False
+        self.inflight.add(update_id)
+        return True
+
+    def receive(self, update_id: int):
+        self.received.add(update_id)
+
+    def release(self, update_id: int):
+        """Update selesai diproses (atau dibatalkan); id yang tidak sampai finish() bisa diulang."""
+        self.received.discard(update_id)
+        self.inflight.discard(update_id)
+
+    def finish(self, update_id: int):
+        self.inflight.discard(update_id)
+        self.done.add(update_id)
+        if len(self.done) > 2 * self.WINDOW:
+            old = sorted(self.done)[:-self.WINDOW]
+            waiting = min(self.received | self.inflight, default=None)
+            if waiting is not None:
+                old = old[:bisect.bisect_left(old, waiting)]
+            if old:
+                self.hwm = max(self.hwm, old[-1])
+                self.done.difference_update(old)
+
+    def install(self, app: "Application"):
+        from telegram import Update
+        from telegram.ext import ApplicationHandlerStop, TypeHandler
+
+        # group -2: sebelum hitungan update (group -1) dan semua handler; group 99: paling akhir
+        async def begin(update: Update, context):
+            if not self._loaded: self.load(context.bot_data.get(LEDGER_KEY))
+            fresh = self.begin(update.update_id)
+            if fresh and self.sessions is not None \
+                    and not await self.sessions.claim(f"update:{update.update_id}", self.CLAIM_TTL):
+                self.inflight.discard(update.update_id)   # diproses replica lain
+                fresh = False
+            if not fresh:
+                UPDATES_DUPLICATE.inc()
+                _LOGGER.info("Update %s sudah diproses, dilewati", update.update_id)
+                raise ApplicationHandlerStop
+
+        async def finish(update: Update, context):
+            self.finish(update.update_id)
+            context.bot_data[LEDGER_KEY] = self.state()
+
+        app.add_handler(TypeHandler(Update, begin), group=-2)
+        app.add_handler(TypeHandler(Update, finish), group=99)
+
+
+class _Inbox:
+    """Penampung update sebelum Application siap; setelah attach() langsung ke update_queue."""
+
+    def __init__(self):
+        self.buffer: List[dict] = []
+        self.app: Optional["Application"] = None
+
+    async def put(self, data: dict):
+        if self.app is None:
+            self.buffer.append(data)
+            return
+        await self.app.update_queue.put(self.de_json(data, self.app.bot))
+
+    async def attach(self, app: "Application"):
+        from telegram import Update
+
+        self.de_json = Update.de_json
+        # Urut per update_id: retry paralel dari Telegram bisa tiba tidak berurutan
+        self.buffer.sort(key=lambda d: d.get("update_id", 0))
+        for data in self.buffer:
+            await app.update_queue.put(Update.de_json(data, app.bot))
+        if self.buffer:
+            _LOGGER.info("Replay %d update yang masuk selama start", len(self.buffer))
+        self.buffer.clear()
+        self.app = app
+
+
+def bind(listen: str, port: int) -> socket.socket:
+    """Socket listen non-blocking; koneksi Telegram sudah diterima kernel (backlog) selama
+    tornado dan bot masih diimpor."""
+    sock = socket.create_server((listen, port), backlog=128)
+    sock.setblocking(False)
+    COLD_START.mark("port")
+    return sock
+
+
+async def serve_webhook(build: Callable[[], "Application"], listen: str, port: int, url_path: str,
+                        webhook_url: str, extra_routes: Sequence[tuple] = (), max_connections: int = 40,
+                        sock: Optional[socket.socket] = None):
+    if sock is None: sock = bind(listen, port)
+    import tornado.web
+    from tornado.httpserver import HTTPServer
+
+    inbox = _Inbox()
+
+    class UpdateHandler(tornado.web.RequestHandler):
+        async def post(self):
+            try:
+                data = json.loads(self.request.body)
+            except ValueError:
+                raise tornado.web.HTTPError(400)
+            await inbox.put(data)
+
+    routes = [(rf"/{url_path.strip('/')}/?", UpdateHandler), *extra_routes]
+    server = HTTPServer(tornado.web.Application(routes))
+    server.add_sockets([sock])
+
+    app = build()
+    await app.initialize()
+    try:
+        if app.post_init: await app.post_init(app)
+        await inbox.attach(app)
+        await app.start()
+        COLD_START.mark("ready")
+        try:
+            await app.bot.set_webhook(webhook_url, drop_pending_updates=False, max_connections=max_connections)
+        except Exception:
+            # Webhook lama biasanya masih terpasang; update tetap masuk
+            _LOGGER.exception("setWebhook gagal")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+    finally:
+        server.stop()
+        if app.running:
+            await app.stop()
+            if app.post_stop: await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown: await app.post_shutdown(app)